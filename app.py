@@ -1,8 +1,19 @@
 from flask import Flask
-from extensions import db, bcrypt, login_manager
+from extensions import db, bcrypt, login_manager, site_cache, site_index, compressor, upload_store, password_hasher, rate_limiter, file_cache, site_storage
 from routes.auth import auth_bp
 from routes.apps import apps_bp
 from routes.files import files_bp
+from routes.uploads import uploads_bp
+from routes.metrics import metrics_bp
+from routes.jobs import jobs_bp
+from services.usage import usage_reconciler
+from services.blobstore import blob_store
+from services.identity import identity_cache
+from database import engine_options, init_database, migrate
+from services.metrics import request_metrics
+from services.jobs import job_runner
+from services.fingerprint import asset_publisher
+from services.site_sync import site_sync
 import os
 from config import Config
 
@@ -11,24 +22,56 @@ def create_app(config_class = Config):
     app.config.from_object(config_class)
 
     # init extensions
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
     db.init_app(app)
+    init_database(app)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
+    identity_cache.init_app(app)
+    site_cache.init_app(app)
+    site_index.init_app(app)
+    compressor.init_app(app)
+    upload_store.init_app(app)
+    rate_limiter.init_app(app)
+    file_cache.init_app(app)
+    # где лежат файлы сайтов: локально или в общем хранилище
+    site_storage.init_app(app)
 
     # register blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(apps_bp)
     app.register_blueprint(files_bp)
+    app.register_blueprint(uploads_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(jobs_bp)
+
+    # метрики запросов и профилирование медленных
+    request_metrics.init_app(app)
+
+    # периодическая сверка занятого места
+    usage_reconciler.init_app(app)
 
     # ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    blob_store.init_app(app)
+    # фоновые задачи: удаление, сборка ZIP
+    job_runner.init_app(app)
+    asset_publisher.init_app(app)
+    site_sync.init_app(app)
 
     return app
 
+
+def init_db(app):
+    # схема ведётся миграциями (database.py), а не create_all
+    migrate(app)
+
+
 if __name__ == '__main__':
+    # только для разработки; в продакшене - gunicorn -c gunicorn.conf.py wsgi:app
     app = create_app()
-    with app.app_context():
-        db.create_all()
-        print('Database tables created successfully')
+    init_db(app)
+    print('Database schema is up to date')
     app.run(debug=True)
\ No newline at end of file
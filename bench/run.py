@@ -0,0 +1,369 @@
+"""Load test for the hosting hot paths.
+
+Starts ``bench/server.py`` (the real ``create_app`` behind a threaded
+werkzeug server) on synthetic tenants, runs each scenario with N client
+threads and writes throughput, latency percentiles and the server's peak
+RSS as JSON. With ``--baseline`` the run is compared against an earlier
+result and the exit code is 1 on a regression beyond ``--threshold``.
+
+    python bench/run.py --output bench/results.json
+    python bench/run.py --baseline bench/results.json --scenario serve_site
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+SCENARIOS = ('serve_site', 'upload_files', 'download_app', 'manage_app', 'login')
+
+
+# -------------------------
+# HTTP-клиент
+# -------------------------
+class Client:
+    """One keep-alive connection with its own session cookie."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # сервер закрыл соединение - один повтор на новом
+            self.conn.close()
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        size = 0
+        while True:
+            block = response.read(64 * 1024)
+            if not block:
+                break
+            size += len(block)
+        cookie = response.getheader('Set-Cookie')
+        if cookie and cookie.startswith('session='):
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, size
+
+    def post_form(self, path, fields):
+        return self.request('POST', path, urlencode(fields),
+                            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def login(self, username, password):
+        return self.post_form('/login', {'username': username, 'password': password})
+
+    def close(self):
+        self.conn.close()
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# -------------------------
+# сценарии
+# -------------------------
+# каждый сценарий: setup(client, tenant) -> state, step(client, tenant, state, rng) -> (status, bytes);
+# ответ со статусом не из ok считается ошибкой
+def serve_site_step(client, tenant, state, rng):
+    filename = rng.choice(tenant['files'])
+    if filename == 'index.html':
+        filename = ''  # /sites/<id>/index.html редиректит на /sites/<id>/
+    return client.request('GET', f"/sites/{tenant['app_id']}/{filename}",
+                          headers={'Accept-Encoding': 'gzip, br'})
+
+
+def upload_setup(client, tenant, options):
+    client.login(tenant['username'], options.password)
+    return random.Random(options.seed).randbytes(options.upload_size)
+
+
+def upload_step(client, tenant, data, rng):
+    body, content_type = multipart({'app_id': tenant['app_id'], 'path': ''},
+                                   [('files[]', 'bench-upload.bin', data)])
+    return client.request('POST', '/upload', body, {'Content-Type': content_type})
+
+
+def no_setup(client, tenant, options):
+    return None
+
+
+def login_setup(client, tenant, options):
+    return options.password
+
+
+def authenticated_setup(client, tenant, options):
+    client.login(tenant['username'], options.password)
+    return None
+
+
+def download_app_step(client, tenant, state, rng):
+    return client.request('GET', f"/download/{tenant['app_id']}")
+
+
+def manage_app_step(client, tenant, state, rng):
+    return client.request('GET', f"/manage/{tenant['app_id']}")
+
+
+def login_step(client, tenant, password, rng):
+    client.cookie = None
+    return client.login(tenant['username'], password)
+
+
+SCENARIO_STEPS = {
+    'serve_site': (no_setup, serve_site_step, (200,)),
+    'upload_files': (upload_setup, upload_step, (302,)),
+    'download_app': (authenticated_setup, download_app_step, (200,)),
+    'manage_app': (authenticated_setup, manage_app_step, (200,)),
+    'login': (login_setup, login_step, (302,)),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(name, port, tenants, options):
+    setup, step, ok = SCENARIO_STEPS[name]
+    requests = options.requests if name != 'login' else options.login_requests
+    latencies = []
+    errors = [0]
+    transferred = [0]
+    counter = iter(range(options.warmup + requests))
+    lock = threading.Lock()
+
+    def worker(index):
+        tenant = tenants[index % len(tenants)]
+        client = Client(port)
+        rng = random.Random(options.seed + index)
+        state = setup(client, tenant, options)
+        local, local_errors, local_bytes = [], 0, 0
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            started = time.perf_counter()
+            try:
+                status, size = step(client, tenant, state, rng)
+            except (http.client.HTTPException, OSError):
+                status, size = 0, 0
+            elapsed = time.perf_counter() - started
+            if n < options.warmup:
+                continue  # прогрев: не учитываем
+            local.append(elapsed)
+            local_bytes += size
+            if status not in ok:
+                local_errors += 1
+        client.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+            transferred[0] += local_bytes
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(options.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors[0],
+        'concurrency': options.concurrency,
+        'rps': round(count / wall, 2) if wall else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if count else 0.0,
+        'bytes': transferred[0],
+    }
+
+
+# -------------------------
+# сервер
+# -------------------------
+def start_server(options, data_dir):
+    command = [sys.executable, os.path.join(HERE, 'server.py'),
+               '--data-dir', data_dir,
+               '--tenants', str(options.tenants),
+               '--files', str(options.files),
+               '--file-size', str(options.file_size),
+               '--dirs', str(options.dirs),
+               '--seed', str(options.seed),
+               '--bcrypt-rounds', str(options.bcrypt_rounds)]
+    process = subprocess.Popen(command, cwd=data_dir, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise SystemExit(f'benchmark server failed to start (exit code {process.returncode})')
+    return process, json.loads(line)
+
+
+def server_rss(port):
+    client = Client(port)
+    try:
+        client.conn.request('GET', '/_bench/rss')
+        return json.loads(client.conn.getresponse().read())['peak_rss_kb']
+    finally:
+        client.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -------------------------
+# сравнение с эталоном
+# -------------------------
+# метрика -> True, если больше - лучше
+METRICS = {'rps': True, 'p50_ms': False, 'p99_ms': False}
+
+
+def compare(result, baseline, threshold):
+    """Print a comparison table to stderr; return the list of regressions."""
+    regressions = []
+    print(f"{'scenario':<14} {'metric':<8} {'baseline':>12} {'current':>12} {'change':>9}", file=sys.stderr)
+    for name, current in result['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before[metric], current[metric]
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > threshold:
+                regressions.append((name, metric, old, new))
+                flag = '  REGRESSION'
+            print(f'{name:<14} {metric:<8} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{flag}', file=sys.stderr)
+    old_rss = baseline.get('server', {}).get('peak_rss_kb')
+    new_rss = result['server']['peak_rss_kb']
+    if old_rss:
+        change = (new_rss - old_rss) / old_rss
+        flag = ''
+        if change > threshold:
+            regressions.append(('server', 'peak_rss_kb', old_rss, new_rss))
+            flag = '  REGRESSION'
+        print(f"{'server':<14} {'rss_kb':<8} {old_rss:>12} {new_rss:>12} {change:>+8.1%}{flag}", file=sys.stderr)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='run only these scenarios (repeatable); default: all')
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--files', type=int, default=50, help='files per site')
+    parser.add_argument('--file-size', type=int, default=16 * 1024, help='average file size, bytes')
+    parser.add_argument('--dirs', type=int, default=5, help='folders per site (0 - all in root)')
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result here (default: stdout)')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed relative regression, default 0.10 (10%%)')
+    parser.add_argument('--keep-data', action='store_true', help='do not delete the seeded data directory')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    scenarios = options.scenario or list(SCENARIOS)
+
+    data_dir = tempfile.mkdtemp(prefix='hosting-bench-')
+    process = None
+    try:
+        print(f'seeding {options.tenants} tenants x {options.files} files ...', file=sys.stderr)
+        process, info = start_server(options, data_dir)
+        options.password = info['password']
+        result = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'params': {key: value for key, value in vars(options).items()
+                           if key not in ('output', 'baseline', 'password')},
+            },
+            'scenarios': {},
+        }
+        for name in scenarios:
+            print(f'running {name} ...', file=sys.stderr)
+            result['scenarios'][name] = run_scenario(name, info['port'], info['tenants'], options)
+            result['scenarios'][name]['peak_rss_kb'] = server_rss(info['port'])
+        result['server'] = {'peak_rss_kb': server_rss(info['port'])}
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not options.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
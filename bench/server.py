@@ -0,0 +1,138 @@
+"""Benchmark target: the real app, seeded with synthetic tenants.
+
+Started by ``bench/run.py`` in a separate process so the load generator
+does not share a GIL (or an RSS figure) with the server. Prints one JSON
+line with the port and the seeded tenants once it is ready to serve.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+
+EXTENSIONS = ('.html', '.css', '.js', '.json', '.png')
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'hosting', 'site', 'frontend', 'static', 'cache')
+
+PASSWORD = 'benchpass'
+
+
+def bench_config(data_dir, bcrypt_rounds):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(data_dir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(data_dir, 'user_files')
+        ASSET_CACHE_FOLDER = os.path.join(data_dir, 'asset_cache')
+        UPLOAD_TMP_FOLDER = os.path.join(data_dir, 'upload_tmp')
+        BLOB_FOLDER = os.path.join(data_dir, 'blob_store')
+        JOB_FOLDER = os.path.join(data_dir, 'job_results')
+        BCRYPT_LOG_ROUNDS = bcrypt_rounds
+        # формы отправляет скрипт, а не браузер
+        WTF_CSRF_ENABLED = False
+        # фоновая сверка места исказила бы замеры
+        USAGE_RECONCILE_INTERVAL = 0
+        # лимитер работает (его цена входит в замер), но не отказывает
+        SITE_RATE_LIMIT = SITE_RATE_BURST = 1e9
+        SITE_BANDWIDTH = SITE_BANDWIDTH_BURST = 1 << 50
+    return BenchConfig
+
+
+def file_body(rng, ext, size):
+    if ext == '.png':
+        return rng.randbytes(size)
+    # текст сжимается примерно как настоящие html/css/js
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words).encode()[:size]
+
+
+def seed(app, tenants, files, file_size, dirs, seed_value):
+    """Create ``tenants`` users, one site each, with ``files`` files per site."""
+    from extensions import db, password_hasher, compressor, site_storage
+    from models import User, UserApp
+    from services.blobstore import blob_store
+    from services.usage import measure
+
+    rng = random.Random(seed_value)
+    result = []
+    with app.app_context():
+        password = password_hasher.hash(PASSWORD)
+        for t in range(tenants):
+            username = f'bench{t:04d}'
+            app_id = f'bn{t:06d}'
+            site_path = site_storage.local_path(site_storage.site_key(app_id))
+            user = User(username=username, password=password)
+            db.session.add(user)
+            db.session.flush()
+
+            names = ['index.html']
+            for i in range(1, files):
+                ext = EXTENSIONS[i % len(EXTENSIONS)]
+                folder = f'dir{i % dirs}/' if dirs else ''
+                names.append(f'{folder}file{i:05d}{ext}')
+            for name in names:
+                path = os.path.join(site_path, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                size = rng.randint(max(file_size // 2, 1), file_size * 3 // 2)
+                with open(path, 'wb') as f:
+                    f.write(file_body(rng, os.path.splitext(name)[1], size))
+
+            db.session.add(UserApp(app_id=app_id, app_name=f'site{t:04d}', user_id=user.id,
+                                   storage_key=site_storage.site_key(app_id),
+                                   storage_used=measure(site_path)))
+            db.session.commit()
+            for name in names:
+                blob_store.adopt(app_id, name, os.path.join(site_path, name))
+            compressor.schedule(app_id, site_path, names)
+            result.append({'username': username, 'app_id': app_id, 'files': names})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-size', type=int, default=16 * 1024)
+    parser.add_argument('--dirs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    from app import create_app, init_db
+
+    app = create_app(bench_config(args.data_dir, args.bcrypt_rounds))
+    init_db(app)
+    tenants = seed(app, args.tenants, args.files, args.file_size, args.dirs, args.seed)
+
+    @app.route('/_bench/rss')
+    def bench_rss():
+        # ru_maxrss: КБ в Linux, байты в macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'peak_rss_kb': peak // 1024 if sys.platform == 'darwin' else peak}
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server(args.host, args.port, app, threaded=True)
+    print(json.dumps({'port': server.server_port, 'password': PASSWORD, 'tenants': tenants}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -8,5 +8,136 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret") 
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///database.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # пул соединений (для файловой SQLite и серверных БД)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    # SQLite: WAL-журнал и ожидание блокировки вместо "database is locked" (мс)
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(os.getcwd(), 'user_files'))
     WTF_CSRF_ENABLED = True
+
+    # bcrypt: стоимость хэша и отдельный пул процессов под него
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+    PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 8))
+    PASSWORD_TIMEOUT = int(os.getenv("PASSWORD_TIMEOUT", 10))
+
+    # кэш пользователя и его приложений (секунды); личность хранится
+    # в подписанной сессии, чтобы load_user обходился без запроса в БД
+    IDENTITY_CACHE_TTL = int(os.getenv("IDENTITY_CACHE_TTL", 60))
+    IDENTITY_IN_SESSION = os.getenv("IDENTITY_IN_SESSION", "1") == "1"
+
+    # метрики Prometheus на /metrics; эндпоинт есть только с METRICS_TOKEN
+    # (доступ по токену), METRICS_DIR - общая папка, чтобы /metrics суммировал
+    # всех воркеров (завершившихся - тоже, см. child_exit в gunicorn.conf.py)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    METRICS_DIR = os.getenv("METRICS_DIR", "")
+    METRICS_FLUSH_INTERVAL = int(os.getenv("METRICS_FLUSH_INTERVAL", 10))
+    METRICS_MAX_SITES = int(os.getenv("METRICS_MAX_SITES", 1000))
+    # профилировщик: стеки запросов дольше PROFILE_SLOW_MS (0 - выключен)
+    PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", 0))
+    PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", 5))
+    PROFILE_FOLDER = os.getenv("PROFILE_FOLDER", os.path.join(os.getcwd(), 'profiles'))
+
+    # лимиты на сайт для /sites: запросы в секунду и байты в секунду (0 - без лимита)
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    SITE_RATE_LIMIT = float(os.getenv("SITE_RATE_LIMIT", 50))
+    SITE_RATE_BURST = float(os.getenv("SITE_RATE_BURST", 100))
+    SITE_BANDWIDTH = int(os.getenv("SITE_BANDWIDTH", 10 * 1024 * 1024))
+    SITE_BANDWIDTH_BURST = int(os.getenv("SITE_BANDWIDTH_BURST", 50 * 1024 * 1024))
+    # 'memory' - у каждого воркера свои счётчики, 'sqlite' - общие на хост
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(os.getcwd(), 'ratelimit.db'))
+
+    # кэш app_id -> папка сайта для /sites/. invalidate() доходит только до
+    # своего воркера: в остальных смена Cache-Control, флажка отпечатков или
+    # удаление сайта видны не позже чем через SITE_CACHE_TTL секунд
+    SITE_CACHE_SIZE = int(os.getenv("SITE_CACHE_SIZE", 1024))
+    SITE_CACHE_TTL = int(os.getenv("SITE_CACHE_TTL", 300))
+    # индекс файлов сайтов: через сколько секунд перечитать сайт с диска
+    # (изменения в обход приложения), либо следить за ними через inotify
+    # (SITE_INDEX_WATCH=1, нужен пакет inotify_simple)
+    SITE_INDEX_TTL = int(os.getenv("SITE_INDEX_TTL", 300))
+    SITE_INDEX_MAX_SITES = int(os.getenv("SITE_INDEX_MAX_SITES", 1000))
+    SITE_INDEX_WATCH = os.getenv("SITE_INDEX_WATCH", "0") == "1"
+    # тела небольших популярных файлов сайтов в памяти воркера: общий
+    # бюджет в байтах (0 - выключено) и предел для одного файла; запись
+    # сверяется со штампом сайта, так что изменения из других воркеров видны сразу
+    FILE_CACHE_BYTES = int(os.getenv("FILE_CACHE_BYTES", 64 * 1024 * 1024))
+    FILE_CACHE_MAX_FILE = int(os.getenv("FILE_CACHE_MAX_FILE", 256 * 1024))
+
+    # Cache-Control для сайтов: политика выбирается в настройках приложения
+    ASSET_EXTENSIONS = ('.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg',
+                        '.webp', '.ico', '.woff', '.woff2', '.ttf')
+    CACHE_POLICIES = {
+        'standard': {'assets': 'public, max-age=3600', 'default': 'no-cache'},
+        'long': {'assets': 'public, max-age=86400', 'default': 'public, max-age=300'},
+        'no-store': {'assets': 'no-store', 'default': 'no-store'},
+    }
+    DEFAULT_CACHE_POLICY = 'standard'
+    # ассеты по адресам с хэшем (включается в настройках сайта): содержимое
+    # по такому адресу не меняется, поэтому кэш на год
+    FINGERPRINT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    # gzip/brotli копии текстовых файлов сайтов, создаются при загрузке
+    ASSET_CACHE_FOLDER = os.getenv("ASSET_CACHE_FOLDER", os.path.join(os.getcwd(), 'asset_cache'))
+    COMPRESSION_WORKERS = int(os.getenv("COMPRESSION_WORKERS", 2))
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 256))
+
+    # лимит места на одно приложение и сверка счётчиков с диском
+    # (фоновая сверка идёт в одном воркере узла; 0 - только flask reconcile-usage)
+    SITE_QUOTA_BYTES = int(os.getenv("SITE_QUOTA_BYTES", 100 * 1024 * 1024))
+    USAGE_RECONCILE_INTERVAL = int(os.getenv("USAGE_RECONCILE_INTERVAL", 3600))
+
+    # развёртывание сайта из архива (zip/tar): предел для самого архива и
+    # числа файлов; распакованное целиком должно влезть в SITE_QUOTA_BYTES
+    DEPLOY_MAX_ARCHIVE_BYTES = int(os.getenv("DEPLOY_MAX_ARCHIVE_BYTES", 2 * SITE_QUOTA_BYTES))
+    DEPLOY_MAX_FILES = int(os.getenv("DEPLOY_MAX_FILES", 10000))
+
+    # фоновые задачи (удаление сайтов и папок, сборка ZIP): потоки на воркер,
+    # попытки с паузой между ними (сек), сколько хранить готовые результаты;
+    # JOB_WORKERS=0 - выполнять прямо в запросе
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", 5))
+    JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 24 * 3600))
+    JOB_FOLDER = os.getenv("JOB_FOLDER", os.path.join(os.getcwd(), 'job_results'))
+
+    # недокачанные файлы (кусочная загрузка); лучше на той же ФС, что UPLOAD_FOLDER
+    UPLOAD_TMP_FOLDER = os.getenv("UPLOAD_TMP_FOLDER", os.path.join(os.getcwd(), 'upload_tmp'))
+    UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+
+    # общее хранилище содержимого файлов (дедупликация между сайтами через
+    # жёсткие ссылки); должно быть на той же ФС, что UPLOAD_FOLDER
+    BLOB_FOLDER = os.getenv("BLOB_FOLDER", os.path.join(os.getcwd(), 'blob_store'))
+    BLOB_DEDUP = os.getenv("BLOB_DEDUP", "1") == "1"
+
+    # общее для нескольких узлов хранилище файлов сайтов: local - папка
+    # (STORAGE_FOLDER, например NFS) или s3 - S3-совместимый бакет (нужен
+    # boto3; ключи - как обычно для boto3, AWS_ACCESS_KEY_ID и т.д.).
+    # По умолчанию local в BLOB_FOLDER - один узел, ничего не копируется.
+    # Узел сверяет свою копию сайта с общей не чаще раза в STORAGE_SYNC_INTERVAL сек
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+    STORAGE_FOLDER = os.getenv("STORAGE_FOLDER", BLOB_FOLDER)
+    S3_BUCKET = os.getenv("S3_BUCKET", "")
+    S3_PREFIX = os.getenv("S3_PREFIX", "sites")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+    S3_REGION = os.getenv("S3_REGION")
+    STORAGE_SYNC_INTERVAL = float(os.getenv("STORAGE_SYNC_INTERVAL", 2))
+
+    # сколько записей папки показывать за раз в менеджере файлов
+    FILE_LIST_PAGE_SIZE = int(os.getenv("FILE_LIST_PAGE_SIZE", 200))
+
+    # как отдавать файлы сайтов: wsgi (sendfile через wsgi.file_wrapper),
+    # x-accel (nginx X-Accel-Redirect) или x-sendfile (Apache/lighttpd)
+    SENDFILE_MODE = os.getenv("SENDFILE_MODE", "wsgi")
+    # internal location в nginx для UPLOAD_FOLDER и ASSET_CACHE_FOLDER (режим x-accel)
+    X_ACCEL_SITES_PREFIX = os.getenv("X_ACCEL_SITES_PREFIX", "/_internal/sites")
+    X_ACCEL_ASSETS_PREFIX = os.getenv("X_ACCEL_ASSETS_PREFIX", "/_internal/assets")
+    # больше кусков в одном Range - отдаём файл целиком
+    MAX_RANGES = int(os.getenv("MAX_RANGES", 16))
@@ -0,0 +1,161 @@
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+from extensions import db
+from models import User, UserApp, Blob, SiteFile, Job
+
+
+# -------------------------
+# НАСТРОЙКА ДВИЖКА
+# -------------------------
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database URL."""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') == 'sqlite:'):
+        return {}  # база в памяти живёт в одном соединении, пул не нужен
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if not uri.startswith('sqlite'):
+        # серверная БД рвёт простаивающие соединения - проверяем перед выдачей
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = True
+    return options
+
+
+def init_engine(app):
+    """Apply SQLite pragmas to every new connection of the app's engine."""
+    busy_timeout = app.config['SQLITE_BUSY_TIMEOUT']
+    wal = app.config['SQLITE_WAL']
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL: читатели не блокируют писателя и наоборот
+        if wal:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+        cursor.close()
+
+
+# -------------------------
+# МИГРАЦИИ
+# -------------------------
+schema_version = db.Table(
+    'schema_version',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.String(80), nullable=False),
+)
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def _create_index(conn, table, name):
+    if name not in {index['name'] for index in inspect(conn).get_indexes(table.name)}:
+        next(index for index in table.indexes if index.name == name).create(conn)
+
+
+def initial_schema(conn):
+    User.__table__.create(conn, checkfirst=True)
+    UserApp.__table__.create(conn, checkfirst=True)
+
+
+def app_settings_and_usage(conn):
+    # storage_used у старых записей заполнит первый проход сверки места
+    columns = _columns(conn, 'user_app')
+    if 'cache_policy' not in columns:
+        conn.execute(text("ALTER TABLE user_app ADD COLUMN cache_policy VARCHAR(20) "
+                          "NOT NULL DEFAULT 'standard'"))
+    if 'storage_used' not in columns:
+        conn.execute(text('ALTER TABLE user_app ADD COLUMN storage_used BIGINT NOT NULL DEFAULT 0'))
+
+
+def blob_store_tables(conn):
+    Blob.__table__.create(conn, checkfirst=True)
+    SiteFile.__table__.create(conn, checkfirst=True)
+
+
+def user_app_user_id_index(conn):
+    _create_index(conn, UserApp.__table__, 'ix_user_app_user_id')
+
+
+def job_table(conn):
+    Job.__table__.create(conn, checkfirst=True)
+
+
+def user_app_fingerprint_assets(conn):
+    if 'fingerprint_assets' not in _columns(conn, 'user_app'):
+        conn.execute(text('ALTER TABLE user_app ADD COLUMN fingerprint_assets BOOLEAN NOT NULL DEFAULT FALSE'))
+
+
+def user_app_revision(conn):
+    if 'revision' not in _columns(conn, 'user_app'):
+        conn.execute(text('ALTER TABLE user_app ADD COLUMN revision BIGINT NOT NULL DEFAULT 0'))
+
+
+# Номера только растут; применённый шаг не меняем - добавляем новый.
+# Шаги идемпотентны: на свежей базе initial_schema уже создаёт актуальные
+# таблицы, и следующие шаги ничего не делают.
+MIGRATIONS = [
+    (1, initial_schema),
+    (2, app_settings_and_usage),
+    (3, blob_store_tables),
+    (4, user_app_user_id_index),
+    (5, job_table),
+    (6, user_app_fingerprint_assets),
+    (7, user_app_revision),
+]
+
+
+def applied_versions(conn):
+    schema_version.create(conn, checkfirst=True)
+    return {version for version, in conn.execute(db.select(schema_version.c.version))}
+
+
+def migrate(app):
+    """Bring the database schema up to the latest version.
+
+    Every step runs in its own transaction together with its row in
+    ``schema_version``. Several workers may start at once; a worker that
+    loses the race on a step sees it recorded and moves on.
+    """
+    applied = []
+    with app.app_context():
+        with db.engine.begin() as conn:
+            done = applied_versions(conn)
+        for version, step in MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    step(conn)
+                    conn.execute(schema_version.insert().values(version=version, name=step.__name__))
+            except (IntegrityError, OperationalError, ProgrammingError):
+                with db.engine.begin() as conn:
+                    if version not in applied_versions(conn):
+                        raise
+                continue
+            applied.append(step.__name__)
+            app.logger.info('applied migration %s %s', version, step.__name__)
+    return applied
+
+
+def init_database(app):
+    init_engine(app)
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Apply pending schema migrations."""
+        for name in migrate(app):
+            print(f'applied {name}')
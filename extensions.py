@@ -1,7 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from services.site_cache import SiteCache
+from services.site_index import SiteIndex
+from services.compression import AssetCompressor
+from services.uploads import UploadStore
+from services.passwords import PasswordHasher
+from services.ratelimit import RateLimiter
+from services.file_cache import FileCache
+from services.storage import SiteStorage
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
-login_manager = LoginManager()
\ No newline at end of file
+login_manager = LoginManager()
+site_cache = SiteCache()
+site_index = SiteIndex()
+compressor = AssetCompressor()
+upload_store = UploadStore()
+password_hasher = PasswordHasher()
+rate_limiter = RateLimiter()
+file_cache = FileCache()
+site_storage = SiteStorage()
\ No newline at end of file
@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# несколько процессов и потоки внутри каждого: пока один поток ждёт диск
+# или БД, остальные обслуживают запросы
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# файлы сайтов уходят через sendfile(2) (wsgi.file_wrapper), без копирования в Python
+sendfile = True
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# перезапуск воркеров против утечек памяти
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = 200
+
+# приложение создаётся в каждом воркере отдельно: фоновые потоки
+# (сжатие, сверка места) не переживают fork. Кэши тоже у каждого воркера
+# свои: индекс файлов сверяется со штампом сайта, который сдвигает любое
+# изменение; кэш app_id -> папка устаревает не дольше SITE_CACHE_TTL.
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def child_exit(server, worker):
+    # файл метрик завершившегося воркера (max_requests, падение) - в общий итог
+    from services.metrics import retire_worker
+    retire_worker(os.getenv("METRICS_DIR", ""), worker.pid)
@@ -1,5 +1,5 @@
 from collections import namedtuple
-from extensions import db
+from extensions import db, site_index, site_storage
 from flask_login import UserMixin
 from datetime import timezone, datetime
 import os
@@ -21,38 +21,85 @@ class UserApp(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     app_id = db.Column(db.String(8), unique=True, nullable=False)
     app_name = db.Column(db.String(80), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    path = db.Column(db.String(200), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # ключ папки сайта относительно UPLOAD_FOLDER (ab/<app_id>); у старых записей - абсолютный путь
+    storage_key = db.Column('path', db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    cache_policy = db.Column(db.String(20), nullable=False, default='standard')
+    # занятое место в байтах, обновляется при каждой загрузке/удалении
+    storage_used = db.Column(db.BigInteger, nullable=False, default=0)
+    # ассеты по адресам с хэшем содержимого и кэшем на год (services/fingerprint.py)
+    fingerprint_assets = db.Column(db.Boolean, nullable=False, default=False)
+    # растёт при каждом изменении манифеста; по нему узлы замечают, что копия устарела
+    revision = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @property
+    def path(self):
+        # папка сайта на этом узле
+        return site_storage.local_path(self.storage_key)
 
     def get_files(self):
-        try:
-            if os.path.exists(self.path):
-                return os.listdir(self.path)
-            return []
-        except Exception:
-            return []
-    
-    def get_files_tree(self, relative_path=""):
-        base_path = os.path.join(self.path, relative_path)
-        if not os.path.exists(base_path):
-            return []
-
-        def build_tree(path):
-            items = []
-            for name in sorted(os.listdir(path)):
-                full_path = os.path.join(path, name)
-                if os.path.isdir(full_path):
-                    items.append({
-                        "name": name,
-                        "is_dir": True,
-                        "children": build_tree(full_path)
-                    })
-                else:
-                    items.append({
-                        "name": name,
-                        "is_dir": False
-                    })
-            return items
-
-        return build_tree(base_path)
\ No newline at end of file
+        # имена в корне сайта, из индекса - без обращения к диску
+        return [name for name, _ in site_index.listing(self.app_id, self.path) or []]
+
+    def list_dir(self, relative_path="", cursor=None, limit=None):
+        """One level of the site tree, sorted by name.
+
+        Returns ``(entries, next_cursor)``; pass ``next_cursor`` back as
+        ``cursor`` to get the following page, it is None on the last one.
+        """
+        listing = site_index.listing(self.app_id, self.path, relative_path)
+        if listing is None:
+            return [], None
+
+        items = []
+        for name, meta in listing:
+            if cursor is not None and name <= cursor:
+                continue
+            if limit is not None and len(items) == limit:
+                return items, items[-1]["name"]
+            items.append({
+                "name": name,
+                "is_dir": meta is None,
+                "size": meta.size if meta else 0,
+                "mtime": meta.mtime if meta else None,
+            })
+        return items, None
+
+
+class Blob(db.Model):
+    # уникальное содержимое файла в хранилище, адресуется sha256
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SiteFile(db.Model):
+    # манифест сайта: путь внутри сайта -> blob
+    id = db.Column(db.Integer, primary_key=True)
+    app_id = db.Column(db.String(8), nullable=False, index=True)
+    path = db.Column(db.String(255), nullable=False)
+    digest = db.Column(db.String(64), db.ForeignKey('blob.digest'), nullable=False)
+    __table_args__ = (db.UniqueConstraint('app_id', 'path'),)
+
+
+class Job(db.Model):
+    # фоновая задача (удаление, сборка ZIP); строка переживает перезапуск
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    app_id = db.Column(db.String(8), nullable=True)
+    # queued -> running -> done / failed / cancelled
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    # host:pid процесса, в очереди которого задача
+    owner = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -1,11 +1,20 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, Response
 from flask_login import login_required, current_user
 from forms import CreateApp
-from extensions import db
+from extensions import db, site_cache, site_index, compressor, file_cache, site_storage
 from models import UserApp
-import uuid, os, zipfile, io
+from services.zipstream import stream_zip
+from services.usage import add_usage, measure
+from services.delivery import send_site_file
+from services.blobstore import blob_store
+from services.identity import identity_cache
+from services.jobs import job_runner
+from services.fingerprint import asset_publisher
+from services.site_sync import site_sync
+from routes.jobs import job_state
+from datetime import datetime, timezone
+import uuid, os
 from werkzeug.utils import secure_filename
-import shutil
 import re
 apps_bp = Blueprint('apps', __name__, url_prefix='')
 
@@ -17,7 +26,7 @@ apps_bp = Blueprint('apps', __name__, url_prefix='')
 @login_required
 def dashboard():
     form = CreateApp()
-    apps = UserApp.query.filter_by(user_id=current_user.id).all()
+    apps = identity_cache.apps(current_user.id)
     return render_template('dashboard.html',
                            username=current_user.username,
                            form=form,
@@ -30,7 +39,7 @@ def dashboard():
 @apps_bp.route('/api/apps', methods=['GET'])
 @login_required
 def api_list_apps():
-    apps = UserApp.query.filter_by(user_id=current_user.id).all()
+    apps = identity_cache.apps(current_user.id)
     return jsonify([{
         'app_id': a.app_id,
         'app_name': a.app_name,
@@ -38,6 +47,27 @@ def api_list_apps():
     } for a in apps])
 
 
+# -------------------------
+# API: содержимое папки (постранично)
+# -------------------------
+@apps_bp.route('/api/apps/<app_id>/files', methods=['GET'])
+@login_required
+def api_list_files(app_id):
+    app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
+
+    path = request.args.get('path', '')
+    page_size = current_app.config['FILE_LIST_PAGE_SIZE']
+    limit = min(request.args.get('limit', page_size, type=int), page_size)
+    entries, next_cursor = app_obj.list_dir(path, cursor=request.args.get('cursor'), limit=max(limit, 1))
+
+    return jsonify({
+        'path': path,
+        'entries': entries,
+        'next_cursor': next_cursor,
+    })
+
+
 # -------------------------
 # СОЗДАНИЕ ПРИЛОЖЕНИЯ
 # -------------------------
@@ -45,8 +75,7 @@ def api_list_apps():
 @login_required
 def index():
     form = CreateApp()
-    user_apps_count = UserApp.query.filter_by(user_id=current_user.id).count()
-    print(user_apps_count)
+    user_apps_count = len(identity_cache.apps(current_user.id))
     if user_apps_count >= 5:
             flash("You have reached the maximum number of applications (5). It is impossible to create something new.", "warning")
             return redirect(url_for('apps.dashboard'))
@@ -57,7 +86,8 @@ def index():
         app_name = form.NewApp.data
         try:
             app_id = str(uuid.uuid4())[:8]
-            app_path = os.path.join(current_app.config['UPLOAD_FOLDER'], app_id)
+            storage_key = site_storage.site_key(app_id)
+            app_path = site_storage.local_path(storage_key)
             os.makedirs(app_path, exist_ok=True)
 
             # создаём базовый index.html
@@ -66,9 +96,14 @@ def index():
 
             # сохраняем в БД
             new_app = UserApp(app_id=app_id, app_name=app_name,
-                              user_id=current_user.id, path=app_path)
+                              user_id=current_user.id, storage_key=storage_key,
+                              storage_used=measure(app_path))
             db.session.add(new_app)
             db.session.commit()
+            blob_store.adopt(app_id, 'index.html', os.path.join(app_path, 'index.html'))
+            site_cache.invalidate(app_id)
+            site_index.invalidate(app_id)
+            identity_cache.invalidate_apps(current_user.id)
 
             flash(f'Application "{app_name}" created! Link: /sites/{app_id}/', 'success')
             return redirect(url_for('apps.dashboard'))
@@ -87,6 +122,7 @@ def index():
 @login_required
 def create_folder(app_id):
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
     parent = request.form.get("parent", "")
     folder_name = request.form.get("folder_name", "").strip()
     
@@ -107,6 +143,7 @@ def create_folder(app_id):
     try:
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
+            site_index.record(app_id, os.path.relpath(folder_path, app_obj.path).replace(os.sep, '/'))
             flash(f'Folder "{folder_name}" created successfully!', 'success')
         else:
             flash(f'Folder "{folder_name}" already exists.', 'warning')
@@ -132,36 +169,53 @@ def upload_files():
 
     # получаем объект приложения сначала!
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
     upload_path = os.path.join(app_obj.path, current_path)
     os.makedirs(upload_path, exist_ok=True)
 
-    # ---- проверка лимита 100 МБ ----
-    MAX_SIZE = 100 * 1024 * 1024  # 100 MB
-
-    def get_folder_size(path):
-        total = 0
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.isfile(fp):
-                    total += os.path.getsize(fp)
-        return total
-
-    current_size = get_folder_size(app_obj.path)
+    # ---- проверка лимита (счётчик в БД, без обхода диска) ----
+    quota = current_app.config['SITE_QUOTA_BYTES']
     upload_size = sum(f.content_length or 0 for f in files if f)
-    if current_size + upload_size > MAX_SIZE:
-        flash("Storage limit exceeded (100 MB)", "error")
+    if app_obj.storage_used + upload_size > quota:
+        flash(f"Storage limit exceeded ({quota // (1024 * 1024)} MB)", "error")
         return redirect(url_for("apps.manage_app", app_id=app_id, path=current_path))
     # ---------------------------------
 
+    saved = []
+    delta = 0
     for file in files:
         if file and file.filename:
             filename = secure_filename(file.filename)
             dst_path = os.path.join(upload_path, filename)
             os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-            file.save(dst_path)
 
-    flash('Files uploaded successfully', 'success')
+            # content_length у частей обычно 0, поэтому реальный размер
+            # проверяем после записи во временный (скрытый) файл
+            rel_path = os.path.relpath(dst_path, app_obj.path).replace(os.sep, '/')
+            old = site_index.lookup(app_id, app_obj.path, rel_path)
+            # своё имя у каждого запроса: параллельная загрузка того же файла не помешает
+            tmp_path = os.path.join(upload_path, f'.{filename}.{uuid.uuid4().hex[:8]}.part')
+            file.save(tmp_path)
+            file_delta = os.path.getsize(tmp_path) - (old.size if old else 0)
+            if app_obj.storage_used + delta + file_delta > quota:
+                os.remove(tmp_path)
+                flash(f"Storage limit exceeded ({quota // (1024 * 1024)} MB)", "error")
+                break
+            os.replace(tmp_path, dst_path)
+            digest = blob_store.adopt(app_id, rel_path, dst_path)
+            site_index.record(app_id, rel_path, sha256=digest)
+            file_cache.invalidate(app_id, rel_path)
+            delta += file_delta
+            saved.append(rel_path)
+    else:
+        flash('Files uploaded successfully', 'success')
+    add_usage(app_obj, delta)
+
+    # сжатые копии готовим в фоне, запрос не ждёт
+    compressor.schedule(app_id, app_obj.path, saved)
+    if saved:
+        asset_publisher.site_changed(app_obj)
+
     return redirect(url_for('apps.manage_app', app_id=app_id, path=current_path))
 
 
@@ -172,6 +226,7 @@ def upload_files():
 @login_required
 def delete_file_route(app_id):
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
     
     filename = request.form.get('filename', '').strip()  # только имя файла
     current_path = request.form.get('current_path', '')   # путь из URL, например css/
@@ -189,9 +244,17 @@ def delete_file_route(app_id):
         flash("Invalid file path", "error")
         return redirect(url_for('apps.manage_app', app_id=app_id, path=current_path))
 
+    rel_path = os.path.relpath(file_path_abs, app_root).replace(os.sep, '/')
     try:
-        if os.path.isfile(file_path_abs):
+        meta = site_index.lookup(app_id, app_obj.path, rel_path)
+        if meta is not None:
             os.remove(file_path_abs)
+            site_index.remove(app_id, rel_path)
+            file_cache.invalidate(app_id, rel_path)
+            blob_store.release(app_id, rel_path)
+            add_usage(app_obj, -meta.size)
+            compressor.discard(app_id, rel_path)
+            asset_publisher.site_changed(app_obj)
             flash("File deleted", "success")
         else:
             flash("File not found", "error")
@@ -211,19 +274,68 @@ def delete_file_route(app_id):
 @login_required
 def manage_app(app_id):
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
 
     current_path = request.args.get("path", "")
-    files_tree = app_obj.get_files_tree(current_path)
+    # только текущая папка и только одна страница, вложенные раскрываются через API
+    files_tree, next_cursor = app_obj.list_dir(current_path,
+                                               cursor=request.args.get("cursor"),
+                                               limit=current_app.config['FILE_LIST_PAGE_SIZE'])
 
     return render_template(
         "manage_app.html",
         app=app_obj,
         username=current_user.username,
         current_path=current_path,
-        files_tree=files_tree
+        files_tree=files_tree,
+        next_cursor=next_cursor,
+        cache_policies=current_app.config['CACHE_POLICIES']
     )
 
 
+# -------------------------
+# НАСТРОЙКИ КЭШИРОВАНИЯ САЙТА
+# -------------------------
+@apps_bp.route('/settings/cache/<app_id>', methods=['POST'])
+@login_required
+def set_cache_policy(app_id):
+    app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    policy = request.form.get('cache_policy', '')
+
+    if policy not in current_app.config['CACHE_POLICIES']:
+        flash("Unknown cache policy", "error")
+        return redirect(url_for('apps.manage_app', app_id=app_id))
+
+    app_obj.cache_policy = policy
+    db.session.commit()
+    site_cache.invalidate(app_id)
+
+    flash(f'Cache policy set to "{policy}"', 'success')
+    return redirect(url_for('apps.manage_app', app_id=app_id))
+
+
+# -------------------------
+# АССЕТЫ С ХЭШЕМ В АДРЕСЕ
+# -------------------------
+@apps_bp.route('/settings/fingerprint/<app_id>', methods=['POST'])
+@login_required
+def set_fingerprint_assets(app_id):
+    app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    enabled = request.form.get('fingerprint_assets') == 'on'
+
+    app_obj.fingerprint_assets = enabled
+    db.session.commit()
+    site_cache.invalidate(app_id)
+    file_cache.invalidate(app_id)
+    if enabled:
+        asset_publisher.schedule(app_id, current_user.id)
+        flash('Fingerprinted asset URLs enabled, the site is being published', 'success')
+    else:
+        asset_publisher.discard(app_id)
+        flash('Fingerprinted asset URLs disabled', 'success')
+    return redirect(url_for('apps.manage_app', app_id=app_id))
+
+
 # -------------------------
 # СКАЧАТЬ ВСЁ ПРИЛОЖЕНИЕ ZIP
 # -------------------------
@@ -234,19 +346,26 @@ def download_app(app_id):
     if not app_obj:
         flash('Application not found', 'error')
         return redirect(url_for('apps.dashboard'))
+    site_sync.ensure(app_obj)
+
+    # архив отдаётся кусками по мере сборки, целиком в памяти не держим
+    files = site_index.iter_files(app_id, app_obj.path)
+    response = Response(stream_zip(files), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{app_obj.app_name}.zip')
+    return response
 
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for root, dirs, files in os.walk(app_obj.path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zf.write(file_path, os.path.relpath(file_path, app_obj.path))
-    memory_file.seek(0)
 
-    return send_file(memory_file,
-                     download_name=f'{app_obj.app_name}.zip',
-                     as_attachment=True,
-                     mimetype='application/zip')
+# -------------------------
+# API: СОБРАТЬ ZIP В ФОНЕ
+# -------------------------
+@apps_bp.route('/api/apps/<app_id>/export', methods=['POST'])
+@login_required
+def api_export_app(app_id):
+    app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
+    # готовый архив забирают по download_url из состояния задачи
+    job = job_runner.submit('export_app', user_id=current_user.id, app_id=app_obj.app_id)
+    return jsonify(job_state(job)), 202
 
 
 # -------------------------
@@ -259,13 +378,15 @@ def download_file(app_id, filename):
     if not app_obj:
         flash('Application not found', 'error')
         return redirect(url_for('apps.dashboard'))
+    site_sync.ensure(app_obj)
 
-    file_path = os.path.join(app_obj.path, filename)
-    if not os.path.exists(file_path):
+    meta = site_index.lookup(app_id, app_obj.path, filename)
+    if meta is None:
         flash('File not found', 'error')
         return redirect(url_for('apps.dashboard'))
 
-    return send_file(file_path, as_attachment=True)
+    return send_site_file(meta.path, meta.mimetype, meta.etag,
+                          datetime.fromtimestamp(meta.mtime, timezone.utc), as_attachment=True)
 
 # -------------------------
 # УДАЛЕНИЕ ПРИЛОЖЕНИЕ
@@ -276,14 +397,21 @@ def delete_app(app_id):
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
 
     try:
-        # удалить папку сайта
+        # папка сайта сразу уходит в корзину, удаляет её фоновая задача
         if os.path.exists(app_obj.path):
-            
-            shutil.rmtree(app_obj.path)
+            job_runner.trash(app_obj.path, user_id=current_user.id, app_id=app_id)
 
         # удалить из базы
         db.session.delete(app_obj)
         db.session.commit()
+        site_cache.invalidate(app_id)
+        site_index.forget(app_id)
+        file_cache.invalidate(app_id)
+        compressor.discard(app_id)
+        asset_publisher.discard(app_id)
+        blob_store.release(app_id)
+        site_sync.forget(app_id)
+        identity_cache.invalidate_apps(current_user.id)
 
         flash(f'Application "{app_obj.app_name}" deleted', 'success')
     except Exception as e:
@@ -300,6 +428,7 @@ def delete_app(app_id):
 @login_required
 def delete_folder(app_id):
     app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
     
     foldername = (request.form.get('foldername') or "").strip().lstrip('/')
     current_path = request.form.get('current_path', '')
@@ -319,7 +448,15 @@ def delete_folder(app_id):
 
     try:
         if os.path.isdir(folder_path_abs):
-            shutil.rmtree(folder_path_abs)
+            rel_path = os.path.relpath(folder_path_abs, app_root).replace(os.sep, '/')
+            size = site_index.size_under(app_id, app_obj.path, rel_path)
+            job_runner.trash(folder_path_abs, user_id=current_user.id, app_id=app_id)
+            site_index.remove(app_id, rel_path)
+            file_cache.invalidate(app_id, rel_path)
+            blob_store.release(app_id, None if rel_path == '.' else rel_path)
+            add_usage(app_obj, -size)
+            compressor.discard(app_id, rel_path)
+            asset_publisher.site_changed(app_obj)
             flash("Folder deleted successfully", "success")
         else:
             flash("Folder not found", "error")
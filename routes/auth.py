@@ -1,11 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
-from extensions import db, bcrypt, login_manager
+from extensions import db, login_manager, password_hasher
+from services.passwords import PasswordHasherBusy
 from models import User
 from forms import RegisterForm, LoginForm
 from flask_login import login_user, logout_user, login_required, current_user
 
 auth_bp = Blueprint('auth', __name__)
 
+def server_busy(template, form):
+    # пул bcrypt перегружен - быстро отказываем, а не держим поток
+    flash("The server is busy right now. Please try again in a few seconds.", "error")
+    return render_template(template, form=form), 503, {'Retry-After': '5'}
+
+
 @auth_bp.route('/')
 @auth_bp.route('/home')
 def home():
@@ -22,7 +29,10 @@ def register():
             flash("That username already exists. Please choose a different one.", "error")
             return render_template('register.html', form=form)
 
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        try:
+            hashed_password = password_hasher.hash(form.password.data)
+        except PasswordHasherBusy:
+            return server_busy('register.html', form)
         new_user = User(username=form.username.data, password=hashed_password)
         try:
             db.session.add(new_user)
@@ -45,11 +55,23 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
+        try:
+            valid = user is not None and password_hasher.verify(user.password, form.password.data)
+        except PasswordHasherBusy:
+            return server_busy('login.html', form)
+
         if not user:
             flash("Username does not exist.", "error")
-        elif not bcrypt.check_password_hash(user.password, form.password.data):
+        elif not valid:
             flash("Incorrect password.", "error")
         else:
+            # хэш со старой (меньшей) стоимостью обновляем при входе
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    user.password = password_hasher.hash(form.password.data)
+                    db.session.commit()
+                except PasswordHasherBusy:
+                    pass
             login_user(user)
             flash("Logged in successfully!", "success")
             next_page = request.args.get('next')
@@ -67,8 +89,9 @@ def logout():
     return redirect(url_for('auth.login'))
 
 from extensions import login_manager
-from models import User
+from services.identity import identity_cache
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
\ No newline at end of file
+    # сначала сессия и кэш процесса, в БД - только при промахе
+    return identity_cache.load_user(user_id)
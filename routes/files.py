@@ -1,10 +1,69 @@
-from flask import Blueprint, send_from_directory, redirect, url_for, make_response, abort
-from models import UserApp
 import os
+from flask import Blueprint, Response, redirect, url_for, make_response, abort, request, current_app
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.http import is_resource_modified
+from models import UserApp
+from extensions import site_cache, site_index, compressor, rate_limiter, file_cache
+from services.compression import is_compressible
+from services.delivery import send_site_file
+from services.fingerprint import asset_publisher
+from services.site_cache import SiteRoot
+from services.site_sync import site_sync
+from services.site_index import make_etag, normalize
+from datetime import datetime, timezone
 
 files_bp = Blueprint('files', __name__, url_prefix='')
 
 
+def resolve_site(site_id):
+    # с общим хранилищем копия сайта на этом узле могла устареть
+    site_sync.check(site_id)
+    # Сначала кэш, в БД идём только при промахе
+    site = site_cache.get(site_id)
+    if site is None:
+        app_obj = UserApp.query.filter_by(app_id=site_id).first_or_404()
+        site = SiteRoot(path=app_obj.path, app_name=app_obj.app_name,
+                        cache_policy=app_obj.cache_policy, fingerprint=app_obj.fingerprint_assets)
+        site_cache.set(site_id, site)
+    return site
+
+
+def cache_control_for(site, filename):
+    policies = current_app.config['CACHE_POLICIES']
+    policy = policies.get(site.cache_policy) or policies[current_app.config['DEFAULT_CACHE_POLICY']]
+    if filename.lower().endswith(current_app.config['ASSET_EXTENSIONS']):
+        return policy['assets']
+    return policy['default']
+
+
+def cached_body(site_id, filename, encoding, path, etag, size, file_etag):
+    """Body from the hot-file cache, or None to send the file from disk.
+
+    A miss reads the file into the cache once it looks hot. ``file_etag``
+    is what the file on disk must match (None for compressed copies, they
+    are checked by size), so a body newer or older than the index is not
+    stored under its ETag.
+    """
+    if (not file_cache.enabled or 'Range' in request.headers
+            or current_app.config['SENDFILE_MODE'] != 'wsgi'):
+        return None
+    key = (site_id, normalize(filename), encoding)
+    # штамп сайта меняет любое изменение в любом воркере
+    stamp = site_index.stamp(site_id)
+    body = file_cache.get(key, etag, stamp)
+    if body is None and file_cache.admit(key, size):
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_size != size or (file_etag and make_etag(st) != file_etag):
+                    return None
+                body = f.read()
+        except OSError:
+            return None
+        file_cache.put(key, etag, body, stamp)
+    return body
+
+
 @files_bp.route('/sites/<site_id>')
 def show_site_redirect(site_id):
     # Редирект на index.html
@@ -14,19 +73,75 @@ def show_site_redirect(site_id):
 @files_bp.route('/sites/<site_id>/', defaults={'filename': 'index.html'})
 @files_bp.route('/sites/<site_id>/<path:filename>')
 def serve_site(site_id, filename='index.html'):
-    app_obj = UserApp.query.filter_by(app_id=site_id).first_or_404()
-    file_path = os.path.join(app_obj.path, filename)
+    site = resolve_site(site_id)
+
+    # у каждого сайта свой бюджет запросов и трафика - шумный сосед не задевает остальных
+    retry_after = rate_limiter.hit(site_id)
+    if retry_after is not None:
+        raise TooManyRequests(f"Too many requests for app '{site.app_name}'.", retry_after=retry_after)
+
+    # адрес с хэшем содержимого (style.<hash>.css) -> исходный файл
+    published = None
+    if site.fingerprint:
+        filename, published = asset_publisher.resolve(site_id, site.path, filename)
 
-    if not os.path.exists(file_path):
+    meta = site_index.lookup(site_id, site.path, filename)
+
+    if meta is None:
         # Если файла нет, отдаём 404
-        abort(404, description=f"File '{filename}' not found in app '{app_obj.app_name}'.")
+        abort(404, description=f"File '{filename}' not found in app '{site.app_name}'.")
+
+    last_modified = datetime.fromtimestamp(meta.mtime, timezone.utc)
+    path, etag, encoding, size = meta.path, meta.etag, None, meta.size
+    # кэш на год - только пока файл тот же, что при публикации
+    immutable = published is not None and published['etag'] == meta.etag
+
+    # страницы и стили опубликованного сайта - копия со ссылками на адреса с хэшем
+    rewritten = None
+    if site.fingerprint:
+        rewritten = asset_publisher.variant(site_id, filename, meta,
+                                            None if 'Range' in request.headers else request.accept_encodings)
 
-    response = make_response(send_from_directory(app_obj.path, filename))
+    # Готовая сжатая копия, если клиент её принимает (Range - всегда по исходнику)
+    compressible = is_compressible(filename)
+    if rewritten is not None:
+        encoding, path, size, etag = rewritten
+    elif compressible and 'Range' not in request.headers:
+        # манифест копий ведётся по нормализованным путям (a//b.css, ./b.css -> b.css)
+        variant = compressor.best_variant(site_id, normalize(filename), meta, request.accept_encodings)
+        if variant is not None:
+            encoding, path, size = variant
+            etag = f'{meta.etag}-{encoding}'
 
-    # Кэшировать CSS/JS/изображения на 1 час
-    if filename.lower().endswith(('.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg')):
-        response.headers['Cache-Control'] = 'public, max-age=3600'
+    # Клиентская копия актуальна - 304 без открытия файла
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
     else:
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        body = cached_body(site_id, filename, encoding, path, etag, size,
+                           None if encoding or rewritten else meta.etag)
+        try:
+            if body is not None:
+                # из памяти: ни open, ни stat
+                response = Response(body, mimetype=meta.mimetype)
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.headers['Accept-Ranges'] = 'bytes'
+            else:
+                response = make_response(send_site_file(path, meta.mimetype, etag, last_modified))
+        except OSError:
+            # файл пропал в обход индекса (другой воркер, ручное удаление)
+            site_index.invalidate(site_id)
+            site_cache.invalidate(site_id)
+            abort(404, description=f"File '{filename}' not found in app '{site.app_name}'.")
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        # тело отдаёт nginx/Apache - длину берём из индекса
+        offloaded = 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers
+        rate_limiter.charge(site_id, size if offloaded else response.content_length or 0)
 
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = asset_publisher.cache_control if immutable else cache_control_for(site, filename)
     return response
@@ -0,0 +1,93 @@
+import json
+import os
+
+from flask import Blueprint, jsonify, abort, send_file, url_for
+from flask_login import login_required, current_user
+from models import Job
+from services.jobs import job_runner, ACTIVE
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def get_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        abort(404)
+    return job
+
+
+def job_state(job):
+    result = json.loads(job.result) if job.result else None
+    state = {
+        'job_id': job.id,
+        'kind': job.kind,
+        'app_id': job.app_id,
+        'status': job.status,
+        'progress': job.progress,
+        'attempts': job.attempts,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+        'status_url': url_for('jobs.job_status', job_id=job.id),
+    }
+    if result and result.get('file') and job.status == 'done':
+        state['download_url'] = url_for('jobs.job_download', job_id=job.id)
+    return state
+
+
+# -------------------------
+# СПИСОК ЗАДАЧ
+# -------------------------
+@jobs_bp.route('', methods=['GET'])
+@login_required
+def list_jobs():
+    # незавершённые и последние завершённые
+    active = Job.query.filter(Job.user_id == current_user.id, Job.status.in_(ACTIVE)) \
+        .order_by(Job.created_at).all()
+    recent = Job.query.filter(Job.user_id == current_user.id, Job.status.notin_(ACTIVE)) \
+        .order_by(Job.finished_at.desc()).limit(20).all()
+    return jsonify([job_state(job) for job in active + recent])
+
+
+# -------------------------
+# СОСТОЯНИЕ ЗАДАЧИ
+# -------------------------
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    return jsonify(job_state(get_job(job_id)))
+
+
+# -------------------------
+# ОТМЕНА И ПОВТОР
+# -------------------------
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    return jsonify(job_state(job_runner.cancel(get_job(job_id)))), 202
+
+
+@jobs_bp.route('/<job_id>/retry', methods=['POST'])
+@login_required
+def retry_job(job_id):
+    job = get_job(job_id)
+    if job.status not in ('failed', 'cancelled'):
+        return jsonify(error='Only failed or cancelled jobs can be retried'), 409
+    return jsonify(job_state(job_runner.retry(job))), 202
+
+
+# -------------------------
+# РЕЗУЛЬТАТ (ГОТОВЫЙ ФАЙЛ)
+# -------------------------
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+@login_required
+def job_download(job_id):
+    job = get_job(job_id)
+    result = json.loads(job.result) if job.result else {}
+    if job.status != 'done' or not result.get('file'):
+        abort(404)
+    path = job_runner.result_path(result['file'])
+    if not os.path.exists(path):
+        abort(410)  # результат уже удалён по JOB_RESULT_TTL
+    return send_file(path, mimetype='application/zip', as_attachment=True,
+                     download_name=result.get('filename') or os.path.basename(path))
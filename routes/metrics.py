@@ -0,0 +1,24 @@
+import hmac
+
+from flask import Blueprint, Response, abort, current_app, request
+from services.metrics import request_metrics
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='')
+
+
+# -------------------------
+# МЕТРИКИ ДЛЯ PROMETHEUS
+# -------------------------
+@metrics_bp.route('/metrics')
+def metrics():
+    # без METRICS_TOKEN эндпоинта нет: метрики выдают id сайтов и их трафик
+    token = current_app.config.get('METRICS_TOKEN')
+    if not request_metrics.enabled or not token:
+        abort(404)
+
+    # только с заголовком Authorization: Bearer <token>
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied, token):
+        abort(401)
+
+    return Response(request_metrics.export(), mimetype='text/plain; version=0.0.4')
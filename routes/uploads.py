@@ -0,0 +1,217 @@
+import os
+import re
+from flask import Blueprint, request, jsonify, current_app, abort, flash, redirect, url_for
+from flask_login import login_required, current_user
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from extensions import db, site_cache, site_index, compressor, upload_store, file_cache
+from models import UserApp
+from services.uploads import UploadError
+from services import deploy
+from services.jobs import job_runner
+from services.fingerprint import asset_publisher
+from services.usage import add_usage
+from services.blobstore import blob_store
+from services.site_sync import site_sync
+
+uploads_bp = Blueprint('uploads', __name__, url_prefix='/api/uploads')
+
+# размер куска, который предлагаем клиенту
+CLIENT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# имена папок - как в create_folder: без точек, а значит и без скрытых
+FOLDER_NAME_RE = re.compile(r'^[a-zA-Z0-9_\- ]+$')
+
+
+@uploads_bp.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify(error=e.message, **e.extra), e.status
+
+
+def get_upload(upload_id):
+    upload = upload_store.load(upload_id)
+    if upload is None or upload['user_id'] != current_user.id:
+        abort(404)
+    return upload
+
+
+def upload_budget(app_obj, target):
+    # сколько байт может занять файл, не выходя за лимит (старая версия файла заменяется)
+    old = site_index.lookup(app_obj.app_id, app_obj.path, target)
+    old_size = old.size if old else 0
+    return current_app.config['SITE_QUOTA_BYTES'] - app_obj.storage_used + old_size, old_size
+
+
+def upload_state(upload):
+    return {
+        'upload_id': upload['upload_id'],
+        'offset': upload['offset'],
+        'size': upload['size'],
+        'chunk_size': CLIENT_CHUNK_SIZE,
+    }
+
+
+# -------------------------
+# НАЧАТЬ ЗАГРУЗКУ
+# -------------------------
+@uploads_bp.route('', methods=['POST'])
+@login_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    app_obj = UserApp.query.filter_by(app_id=data.get('app_id'), user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
+
+    filename = secure_filename(data.get('filename') or '')
+    size = data.get('size')
+    if not filename or not isinstance(size, int) or size < 0:
+        raise UploadError('filename and size are required')
+
+    parts = [part for part in (data.get('path') or '').split('/') if part]
+    if len(parts) > deploy.MAX_DEPTH:
+        raise UploadError(f'Folder nesting limit exceeded (max {deploy.MAX_DEPTH} levels)')
+    if not all(FOLDER_NAME_RE.match(part) for part in parts):
+        raise UploadError("Invalid folder name! Use only letters, numbers, spaces, '-' and '_'.")
+    folder = '/'.join(parts)
+    target = f'{folder}/{filename}' if folder else filename
+    dst_path = safe_join(app_obj.path, target)
+    if dst_path is None:
+        raise UploadError('Invalid path')
+
+    budget, _ = upload_budget(app_obj, target)
+    if size > budget:
+        raise UploadError('Storage limit exceeded', 413)
+
+    upload = upload_store.create(current_user.id, app_obj.app_id, target, size, data.get('sha256'))
+    return jsonify(upload_state(upload)), 201
+
+
+# -------------------------
+# СОСТОЯНИЕ (ДЛЯ ВОЗОБНОВЛЕНИЯ)
+# -------------------------
+@uploads_bp.route('/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    return jsonify(upload_state(get_upload(upload_id)))
+
+
+# -------------------------
+# ОЧЕРЕДНОЙ КУСОК
+# -------------------------
+@uploads_bp.route('/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    upload = get_upload(upload_id)
+    app_obj = UserApp.query.filter_by(app_id=upload['app_id'], user_id=current_user.id).first_or_404()
+
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        raise UploadError('offset is required')
+
+    budget, _ = upload_budget(app_obj, upload['target'])
+    # тело читаем из потока напрямую, без буферизации Werkzeug
+    upload_store.write_chunk(upload, offset, request.stream, budget,
+                             checksum=request.headers.get('X-Chunk-SHA256'))
+    return jsonify(upload_state(upload))
+
+
+# -------------------------
+# ЗАВЕРШИТЬ ЗАГРУЗКУ
+# -------------------------
+@uploads_bp.route('/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    upload = get_upload(upload_id)
+    app_obj = UserApp.query.filter_by(app_id=upload['app_id'], user_id=current_user.id).first_or_404()
+    site_sync.ensure(app_obj)
+
+    dst_path = safe_join(app_obj.path, upload['target'])
+    budget, old_size = upload_budget(app_obj, upload['target'])
+    if upload['size'] > budget:
+        upload_store.discard(upload_id)
+        raise UploadError('Storage limit exceeded', 413)
+
+    size = upload_store.complete(upload, dst_path)
+    digest = blob_store.adopt(upload['app_id'], upload['target'], dst_path)
+    add_usage(app_obj, size - old_size)
+    site_index.record(upload['app_id'], upload['target'], sha256=digest)
+    file_cache.invalidate(upload['app_id'], upload['target'])
+    compressor.schedule(upload['app_id'], app_obj.path, [upload['target']])
+    asset_publisher.site_changed(app_obj)
+
+    return jsonify(path=upload['target'], size=size)
+
+
+# -------------------------
+# ОТМЕНА
+# -------------------------
+@uploads_bp.route('/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    upload_store.discard(get_upload(upload_id)['upload_id'])
+    return '', 204
+
+
+# -------------------------
+# РАЗВЕРНУТЬ САЙТ ИЗ АРХИВА
+# -------------------------
+@uploads_bp.route('/deploy/<app_id>', methods=['POST'])
+@login_required
+def deploy_archive(app_id):
+    """Replace the whole site with the contents of a ZIP or tar archive.
+
+    The archive is the raw request body (or the ``archive`` field of a
+    form). ``strip`` drops that many leading folders from every entry.
+    """
+    app_obj = UserApp.query.filter_by(app_id=app_id, user_id=current_user.id).first_or_404()
+    from_form = request.mimetype == 'multipart/form-data'
+    try:
+        result = deploy_site(app_obj, request.args.get('strip', 0, type=int))
+    except UploadError as e:
+        if not from_form:
+            raise
+        flash(e.message, 'error')
+        return redirect(url_for('apps.manage_app', app_id=app_id))
+
+    if from_form:
+        flash(f'Site deployed: {len(result.files)} files', 'success')
+        return redirect(url_for('apps.manage_app', app_id=app_id))
+    return jsonify(files=len(result.files), size=result.total, skipped=result.skipped)
+
+
+def deploy_site(app_obj, strip):
+    if request.mimetype == 'multipart/form-data':
+        archive = request.files.get('archive')
+        if archive is None or not archive.filename:
+            raise UploadError('No archive selected')
+        stream = archive.stream
+    else:
+        # тело читаем из потока: tar распаковывается по мере приёма
+        stream = request.stream
+
+    config = current_app.config
+    staging = deploy.staging_dir(app_obj.path)
+    try:
+        result = deploy.extract(stream, staging, config['SITE_QUOTA_BYTES'], config['DEPLOY_MAX_FILES'],
+                                config['DEPLOY_MAX_ARCHIVE_BYTES'], config['UPLOAD_TMP_FOLDER'],
+                                strip=max(strip, 0))
+    except BaseException:
+        deploy.remove_tree(staging)
+        raise
+
+    # новое дерево встаёт на место старого целиком
+    old_tree = deploy.swap_tree(staging, app_obj.path)
+    app_id = app_obj.app_id
+    UserApp.query.filter_by(id=app_obj.id).update({UserApp.storage_used: result.total},
+                                                  synchronize_session=False)
+    # старый манифест уходит, новый встаёт - одной транзакцией вместе со счётчиком
+    blob_store.replace_all(app_id, ((rel, os.path.join(app_obj.path, rel)) for rel in result.files))
+    db.session.commit()
+    site_index.invalidate(app_id)
+    site_cache.invalidate(app_id)
+    file_cache.invalidate(app_id)
+    compressor.discard(app_id)
+    compressor.schedule(app_id, app_obj.path, list(result.files))
+    asset_publisher.site_changed(app_obj)
+    if old_tree:
+        job_runner.submit('remove_tree', user_id=current_user.id, app_id=app_id, path=old_tree)
+    return result
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, site_storage
+from models import Blob, SiteFile, UserApp
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed, deduplicated storage for site file bodies.
+
+    Each unique body is stored once as ``<BLOB_FOLDER>/ab/cd/<sha256>`` and
+    every site file with that body is a hard link to it, so all tenants
+    share one inode (and one copy in the page cache) while serve_site,
+    download_app and the rest keep reading plain paths. The ``site_file``
+    table is the per-site path -> blob manifest, ``blob.refcount`` counts
+    the manifest rows, and a blob is removed when it drops to zero.
+
+    Files must be replaced, never rewritten in place - a write through one
+    link would change the content of every site sharing the blob.
+
+    With a shared storage backend the manifest is kept even without
+    deduplication: every adopted body is also written to the backend
+    before its row is committed, and ``user_app.revision`` is bumped so the
+    other nodes pick the change up.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.enabled = False
+
+    def init_app(self, app):
+        self.folder = app.config['BLOB_FOLDER']
+        self.enabled = app.config.get('BLOB_DEDUP', True)
+        os.makedirs(self.folder, exist_ok=True)
+        # жёсткие ссылки работают только в пределах одной ФС
+        if self.enabled and os.stat(self.folder).st_dev != os.stat(app.config['UPLOAD_FOLDER']).st_dev:
+            app.logger.warning('BLOB_FOLDER and UPLOAD_FOLDER are on different filesystems, '
+                               'deduplication is disabled')
+            self.enabled = False
+        app.extensions['blob_store'] = self
+
+        @app.cli.command('gc-blobs')
+        def gc_blobs_command():
+            """Remove blob files no site file links to any more."""
+            print(f'{self.collect_garbage()} blobs removed')
+
+    @property
+    def tracked(self):
+        # манифест нужен и для дедупликации, и для общего хранилища
+        return self.enabled or site_storage.shared
+
+    def blob_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest[2:4], digest)
+
+    # -------------------------
+    # счётчики ссылок
+    # -------------------------
+    def _incref(self, digest, size):
+        updated = Blob.query.filter_by(digest=digest).update(
+            {Blob.refcount: Blob.refcount + 1}, synchronize_session=False)
+        if not updated:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Blob(digest=digest, size=size, refcount=1))
+            except IntegrityError:
+                # параллельная загрузка того же содержимого успела раньше
+                Blob.query.filter_by(digest=digest).update(
+                    {Blob.refcount: Blob.refcount + 1}, synchronize_session=False)
+
+    def _decref(self, digests):
+        """Decrement refcounts; return the digests that are now unreferenced."""
+        dead = []
+        for digest in digests:
+            Blob.query.filter_by(digest=digest).update(
+                {Blob.refcount: Blob.refcount - 1}, synchronize_session=False)
+            if Blob.query.filter(Blob.digest == digest, Blob.refcount <= 0).delete(
+                    synchronize_session=False):
+                dead.append(digest)
+        return dead
+
+    def _bump_revision(self, app_id):
+        UserApp.query.filter_by(app_id=app_id).update(
+            {UserApp.revision: UserApp.revision + 1}, synchronize_session=False)
+
+    def _unlink_blobs(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError:
+                pass
+            # в общем хранилище - только если никто не успел сослаться заново
+            if site_storage.shared and db.session.get(Blob, digest) is None:
+                site_storage.backend.delete(digest)
+
+    # -------------------------
+    # запись
+    # -------------------------
+    def adopt(self, app_id, rel_path, path):
+        """Move a freshly written site file into the store.
+
+        The file at ``path`` either becomes the blob itself or is replaced
+        by a link to an existing blob with the same content. Returns the
+        SHA-256 of the body (also when deduplication is disabled).
+        """
+        return self.adopt_many(app_id, [(rel_path, path)])[0]
+
+    def adopt_many(self, app_id, files):
+        """``adopt`` for many ``(rel_path, path)`` pairs in one transaction.
+
+        Returns the digests in the order of ``files``.
+        """
+        return self._write(app_id, files, replace=False)
+
+    def replace_all(self, app_id, files):
+        """Make ``files`` the whole manifest of the site (a deploy).
+
+        Old rows go, their refcounts drop and the new rows are added under
+        a single commit, so a failure leaves the old manifest intact.
+        Returns the digests in the order of ``files``.
+        """
+        return self._write(app_id, files, replace=True)
+
+    def _write(self, app_id, files, replace):
+        files = list(files)
+        digests = [file_digest(path) for _, path in files]
+        if not self.tracked:
+            return digests
+
+        dead = []
+        try:
+            if site_storage.shared:
+                # сначала тела, потом строки манифеста: другие узлы не увидят ссылку в пустоту
+                for (_, path), digest in zip(files, digests):
+                    site_storage.backend.put(digest, path)
+            if replace:
+                rows = SiteFile.query.filter_by(app_id=app_id).all()
+                for row in rows:
+                    db.session.delete(row)
+                dead += self._decref([row.digest for row in rows])
+            for (rel_path, path), digest in zip(files, digests):
+                # сначала счётчик: пока он больше нуля, blob никто не удалит
+                self._incref(digest, os.path.getsize(path))
+                row = SiteFile.query.filter_by(app_id=app_id, path=rel_path).first()
+                if row is None:
+                    try:
+                        with db.session.begin_nested():
+                            db.session.add(SiteFile(app_id=app_id, path=rel_path, digest=digest))
+                    except IntegrityError:
+                        # тот же путь параллельно загружают в другом запросе
+                        row = SiteFile.query.filter_by(app_id=app_id, path=rel_path).one()
+                if row is not None:
+                    old_digest, row.digest = row.digest, digest
+                    dead += self._decref([old_digest])
+            self._bump_revision(app_id)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        # тело, которое ушло из одного файла и пришло в другой, живо;
+        # файлы удаляем только после коммита
+        alive = set(digests)
+        dead = [digest for digest in dead if digest not in alive]
+
+        if self.enabled:
+            for (_, path), digest in zip(files, digests):
+                self._link(path, digest)
+        self._unlink_blobs(dead)
+        return digests
+
+    def _link(self, path, digest):
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # такого содержимого ещё нет - файл сайта и становится blob'ом
+            os.link(path, blob)
+        except FileExistsError:
+            if not os.path.samefile(path, blob):
+                tmp_link = os.path.join(os.path.dirname(path), f'.{uuid.uuid4().hex}.link')
+                try:
+                    os.link(blob, tmp_link)
+                    os.replace(tmp_link, path)
+                except FileNotFoundError:
+                    # blob удалили между проверками - оставляем свою копию
+                    os.link(path, blob)
+
+    # -------------------------
+    # удаление
+    # -------------------------
+    def release(self, app_id, rel_path=None):
+        """Forget manifest rows for a file, a folder (prefix) or a whole site.
+
+        Call after the site files are gone from disk.
+        """
+        if not self.tracked:
+            return
+        query = SiteFile.query.filter_by(app_id=app_id)
+        if rel_path:
+            rel_path = rel_path.strip('/')
+            query = query.filter(db.or_(SiteFile.path == rel_path,
+                                        SiteFile.path.startswith(rel_path + '/', autoescape=True)))
+        rows = query.all()
+        if not rows:
+            return
+        for row in rows:
+            db.session.delete(row)
+        dead = self._decref([row.digest for row in rows])
+        self._bump_revision(app_id)
+        db.session.commit()
+        self._unlink_blobs(dead)
+
+    def collect_garbage(self):
+        """Remove blob files that are neither referenced nor linked from a site.
+
+        With shared storage BLOB_FOLDER is only a local cache of the
+        backend, so copies no local site links to go as well, and the
+        backend loses bodies no manifest row refers to.
+        """
+        removed = 0
+        referenced = {digest for digest, in db.session.query(Blob.digest)}
+        if site_storage.shared:
+            removed += site_storage.collect_garbage(referenced)
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if (name not in referenced or site_storage.shared) and os.stat(path).st_nlink == 1:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        blobs, stored = db.session.query(db.func.count(Blob.digest),
+                                         db.func.coalesce(db.func.sum(Blob.size), 0)).one()
+        logical = db.session.query(db.func.coalesce(db.func.sum(Blob.size * Blob.refcount), 0)).scalar()
+        return {'blobs': blobs, 'stored_bytes': stored, 'logical_bytes': logical}
+
+
+blob_store = BlobStore()
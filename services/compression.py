@@ -0,0 +1,250 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import safe_join
+
+from services.site_index import make_etag
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него будет только gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+
+COMPRESSIBLE_EXTENSIONS = ('.html', '.htm', '.css', '.js', '.mjs', '.json',
+                           '.svg', '.txt', '.xml', '.map', '.webmanifest')
+
+# расширение сайдкара для каждого Content-Encoding
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# не чаще, чем раз в столько секунд, проверяем manifest.json на диске
+MANIFEST_CHECK_INTERVAL = 1.0
+
+
+def is_compressible(filename):
+    return filename.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+class AssetCompressor:
+    """Builds gzip/brotli sidecars for site files in the background.
+
+    Sidecars live outside the site folder, in ``<ASSET_CACHE_FOLDER>/<app_id>/``,
+    next to a ``manifest.json`` that maps each source path to the ETag it was
+    built from and the size of every variant. A variant is only used while the
+    source ETag still matches.
+
+    Every worker process keeps its own copy of the manifest and re-reads the
+    file when it changed on disk. Changes are read-modify-write of the file
+    itself under a flock on the site's folder, so workers never overwrite
+    each other's entries.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.min_size = 256
+        self._executor = None
+        self._manifests = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.root = app.config['ASSET_CACHE_FOLDER']
+        self.min_size = app.config.get('COMPRESSION_MIN_SIZE', self.min_size)
+        os.makedirs(self.root, exist_ok=True)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=app.config.get('COMPRESSION_WORKERS', 2),
+                thread_name_prefix='compress')
+        app.extensions['asset_compressor'] = self
+
+    @property
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    # -------------------------
+    # manifest
+    # -------------------------
+    def _site_dir(self, app_id):
+        return os.path.join(self.root, app_id)
+
+    def _manifest_path(self, app_id):
+        return os.path.join(self._site_dir(app_id), 'manifest.json')
+
+    @staticmethod
+    def _file_id(path):
+        # os.replace даёт новый inode, так что смену файла видно и при равном mtime
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _read_manifest(self, app_id):
+        try:
+            with open(self._manifest_path(app_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _manifest(self, app_id):
+        """The site's manifest, re-read when another worker has changed it."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._manifests.get(app_id)
+            if cached is not None and now - cached[0] < MANIFEST_CHECK_INTERVAL:
+                return cached[2]
+        file_id = self._file_id(self._manifest_path(app_id))
+        if cached is not None and cached[1] == file_id:
+            manifest = cached[2]
+        else:
+            manifest = self._read_manifest(app_id) if file_id else {}
+        with self._lock:
+            self._manifests[app_id] = (now, file_id, manifest)
+        return manifest
+
+    def _update_manifest(self, app_id, change):
+        """Apply ``change(manifest)`` to the file on disk, under a lock shared by all workers."""
+        site_dir = self._site_dir(app_id)
+        os.makedirs(site_dir, exist_ok=True)
+        with self._lock, open(os.path.join(site_dir, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # свежая копия с диска, а не наша: в ней записи других воркеров
+            manifest = self._read_manifest(app_id)
+            change(manifest)
+            tmp_path = os.path.join(site_dir, 'manifest.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._manifest_path(app_id))
+            self._manifests[app_id] = (time.monotonic(), self._file_id(self._manifest_path(app_id)), manifest)
+
+    # -------------------------
+    # сжатие
+    # -------------------------
+    def schedule(self, app_id, root, filenames):
+        filenames = [name for name in filenames if is_compressible(name)]
+        if filenames and self._executor is not None:
+            return self._executor.submit(self.compress, app_id, root, filenames)
+
+    def compress(self, app_id, root, filenames):
+        for filename in filenames:
+            src = safe_join(root, filename)
+            if src is None:
+                continue
+            try:
+                # ETag и тело - с одного открытого файла: подмена между stat и open
+                # не запишет новое содержимое под старым ETag
+                with open(src, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    data = f.read() if st.st_size >= self.min_size else None
+            except OSError:
+                continue
+
+            entry = {'etag': make_etag(st)}
+            if data is not None:
+                dst = safe_join(self._site_dir(app_id), filename)
+                entry.update(self.write_variants(dst, data))
+
+            self._update_manifest(app_id, lambda manifest: manifest.__setitem__(filename, entry))
+
+    def write_variants(self, dst, data):
+        """Write ``dst`` + .br/.gz for ``data``; return {encoding: size}."""
+        sizes = {}
+        if len(data) < self.min_size:
+            return sizes
+        for encoding in self.encodings:
+            body = self._encode(encoding, data)
+            # невыгодный вариант не храним
+            if len(body) >= len(data):
+                continue
+            path = dst + SUFFIXES[encoding]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # своё имя на каждый вызов: два сжатия одного файла не пишут в один tmp
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            sizes[encoding] = len(body)
+        return sizes
+
+    @staticmethod
+    def _encode(encoding, data):
+        if encoding == 'br':
+            return brotli.compress(data, quality=11)
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    # -------------------------
+    # выбор варианта
+    # -------------------------
+    def best_variant(self, app_id, filename, meta, accept_encodings):
+        """Return (encoding, path, size) of the best fresh sidecar or None."""
+        entry = self._manifest(app_id).get(filename)
+        fresh = bool(entry) and entry['etag'] == meta.etag
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1  # копии ещё нет или исходник уже изменился
+        if not fresh:
+            return None
+
+        encoding = self.pick_encoding(entry, accept_encodings)
+        if encoding is None:
+            return None
+        path = os.path.join(self._site_dir(app_id), filename + SUFFIXES[encoding])
+        return encoding, path, entry[encoding]
+
+    def pick_encoding(self, sizes, accept_encodings):
+        """The client's preferred encoding among those in ``sizes``, or None."""
+        best = None
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if encoding not in sizes or not quality:
+                continue
+            if best is None or quality > best[0]:
+                best = (quality, encoding)
+        return best[1] if best else None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._manifests)}
+
+    def discard(self, app_id, prefix=None):
+        """Drop sidecars for a whole site or for everything under ``prefix``."""
+        if prefix is None or prefix.strip('/') in ('', '.'):
+            with self._lock:
+                self._manifests.pop(app_id, None)
+                shutil.rmtree(self._site_dir(app_id), ignore_errors=True)
+            return
+
+        prefix = prefix.strip('/')
+        site_dir = self._site_dir(app_id)
+
+        def drop(manifest):
+            for filename in list(manifest):
+                if filename == prefix or filename.startswith(prefix + '/'):
+                    for encoding in SUFFIXES:
+                        if encoding in manifest[filename]:
+                            try:
+                                os.remove(os.path.join(site_dir, filename + SUFFIXES[encoding]))
+                            except OSError:
+                                pass
+                    del manifest[filename]
+
+        self._update_manifest(app_id, drop)
@@ -0,0 +1,206 @@
+import os
+import uuid
+from urllib.parse import quote
+
+from flask import Response, current_app, make_response, request, send_file
+
+
+def _offload_uri(path):
+    """Internal URI of ``path`` for X-Accel-Redirect, or None if not mapped."""
+    config = current_app.config
+    locations = ((config['UPLOAD_FOLDER'], config['X_ACCEL_SITES_PREFIX']),
+                 (config['ASSET_CACHE_FOLDER'], config['X_ACCEL_ASSETS_PREFIX']))
+    path = os.path.abspath(path)
+    for folder, prefix in locations:
+        folder = os.path.abspath(folder)
+        if path.startswith(folder + os.sep):
+            rel = os.path.relpath(path, folder).replace(os.sep, '/')
+            return prefix.rstrip('/') + '/' + quote(rel)
+    return None
+
+
+RANGE_BUFFER_SIZE = 64 * 1024
+
+
+def _set_file_headers(response, mimetype, etag, last_modified, as_attachment, download_name, path):
+    response.headers['Content-Type'] = mimetype
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=download_name or os.path.basename(path))
+    return response
+
+
+def parse_range(value):
+    """``(first, last)`` specs of a ``bytes=`` Range header, or None if malformed.
+
+    ``first`` is None for a suffix (``-N``: ``last`` is its length) and
+    ``last`` is None for an open range (``N-``). Unlike werkzeug's parser,
+    overlapping and unordered specs are accepted (RFC 9110, 14.2) - they
+    are merged later.
+    """
+    units, _, spec = (value or '').partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    specs = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, sep, last = (part.strip() for part in item.partition('-'))
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            if not last:
+                return None
+            specs.append((None, int(last)))
+        elif last and int(last) < int(first):
+            return None
+        else:
+            specs.append((int(first), int(last) if last else None))
+    return specs or None
+
+
+def requested_ranges(size, etag, last_modified):
+    """Byte ranges asked for by the current request.
+
+    Returns None when the whole file should be sent (no Range header, a
+    stale or weak If-Range, or too many ranges), an empty list when nothing
+    is satisfiable, or a sorted list of non-overlapping (start, stop) pairs.
+    """
+    specs = parse_range(request.headers.get('Range'))
+    if specs is None:
+        return None
+
+    # слабый валидатор в If-Range не совпадает никогда (RFC 9110, 13.1.5);
+    # request.if_range префикс W/ отбрасывает, так что смотрим сам заголовок
+    if request.headers.get('If-Range', '').lstrip().startswith('W/'):
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None:
+        if if_range.etag != etag:
+            return None
+    elif if_range.date is not None:
+        if last_modified is None or last_modified.replace(microsecond=0) > if_range.date:
+            return None
+
+    if len(specs) > current_app.config['MAX_RANGES']:
+        return None
+
+    ranges = []
+    for first, last in specs:
+        if first is None:  # bytes=-N: последние N байт
+            start, stop = max(size - last, 0), size
+        else:
+            start, stop = first, size if last is None else min(last + 1, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    # пересекающиеся и соседние куски склеиваем
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _iter_ranges(path, parts):
+    """Read ``parts`` ((prefix bytes, start, stop) triples) with a bounded buffer."""
+    with open(path, 'rb') as f:
+        for prefix, start, stop in parts:
+            if prefix:
+                yield prefix
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                block = f.read(min(RANGE_BUFFER_SIZE, remaining))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+
+
+def _range_response(path, size, ranges, mimetype):
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response = Response(_iter_ranges(path, [(b'', start, stop)]), 206, direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+        return response
+
+    # несколько кусков - multipart/byteranges
+    boundary = uuid.uuid4().hex
+    parts, length = [], 0
+    for start, stop in ranges:
+        prefix = (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                  f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        if parts:
+            prefix = b'\r\n' + prefix
+        parts.append((prefix, start, stop))
+        length += len(prefix) + stop - start
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+
+    def generate():
+        yield from _iter_ranges(path, parts)
+        yield closing
+
+    response = Response(generate(), 206, direct_passthrough=True)
+    response.content_length = length + len(closing)
+    response.content_type = f'multipart/byteranges; boundary={boundary}'
+    return response
+
+
+def send_site_file(path, mimetype, etag, last_modified, as_attachment=False, download_name=None):
+    """Build the response for a file from disk according to SENDFILE_MODE.
+
+    ``wsgi``       - send_file; the body is a wsgi.file_wrapper, so gunicorn
+                     and most WSGI servers hand it to sendfile(2). Range
+                     requests (including multipart/byteranges and If-Range)
+                     are answered here from the open file.
+    ``x-accel``    - empty body plus X-Accel-Redirect; nginx serves the file
+                     from an ``internal`` location (X_ACCEL_*_PREFIX) and
+                     handles ranges itself.
+    ``x-sendfile`` - empty body plus X-Sendfile with the absolute path
+                     (Apache mod_xsendfile, lighttpd).
+    """
+    mode = current_app.config['SENDFILE_MODE']
+
+    if mode == 'x-accel':
+        uri = _offload_uri(path)
+        if uri is not None:
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = uri
+            return _set_file_headers(response, mimetype, etag, last_modified,
+                                     as_attachment, download_name, path)
+
+    if mode == 'x-sendfile':
+        response = make_response('')
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return _set_file_headers(response, mimetype, etag, last_modified,
+                                 as_attachment, download_name, path)
+
+    if 'Range' in request.headers:
+        size = os.path.getsize(path)
+        ranges = requested_ranges(size, etag, last_modified)
+        if ranges == []:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            response.headers['Accept-Ranges'] = 'bytes'
+            return response
+        if ranges:
+            response = _range_response(path, size, ranges, mimetype)
+            content_type = response.headers['Content-Type']
+            _set_file_headers(response, mimetype, etag, last_modified,
+                              as_attachment, download_name, path)
+            response.headers['Content-Type'] = content_type
+            return response
+
+    response = send_file(path, mimetype=mimetype, etag=etag, last_modified=last_modified,
+                         as_attachment=as_attachment, download_name=download_name,
+                         conditional=False)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,251 @@
+import ctypes
+import ctypes.util
+import errno
+import gzip
+import os
+import shutil
+import stat
+import tarfile
+import uuid
+import zipfile
+import zlib
+
+from services.uploads import UploadError, CHUNK_READ_SIZE
+
+
+# как в create_folder: не больше 5 уровней папок
+MAX_DEPTH = 5
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+# мусор архиваторов macOS
+SKIPPED_TOPLEVEL = ('__MACOSX',)
+
+# renameat2(2): обмен двух путей одним системным вызовом (Linux)
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError,
+                  gzip.BadGzipFile, NotImplementedError)
+
+
+class _ArchiveStream:
+    """Read-only stream: ``head`` first, then ``stream``, at most ``limit`` bytes."""
+
+    def __init__(self, head, stream, limit):
+        self.head = head
+        self.stream = stream
+        self.left = limit - len(head)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_READ_SIZE), b''))
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            # tarfile узнаёт сжатие по первому чтению - оно должно быть полным
+            more = self.stream.read(size - len(data))
+            self.left -= len(more)
+            if self.left < 0:
+                raise UploadError('Archive is too large', 413)
+            data += more
+        return data
+
+
+def _read_head(stream, size):
+    head = b''
+    while len(head) < size:
+        block = stream.read(size - len(head))
+        if not block:
+            break
+        head += block
+    return head
+
+
+class ArchiveExtractor:
+    """Unpacks one ZIP or tar archive into an empty ``root`` folder.
+
+    Every entry is checked before anything is written: no absolute paths,
+    no ``..``, no links or device files, at most MAX_DEPTH folder levels.
+    Hidden names (``.git``, ``.DS_Store``) are skipped, like the site index
+    does. Bytes are counted as they are written, so a lying header or a
+    zip bomb stops at ``quota``.
+    """
+
+    def __init__(self, root, quota, max_files, strip=0):
+        self.root = root
+        self.quota = quota
+        self.max_files = max_files
+        self.strip = strip
+        self.files = {}
+        self.total = 0
+        self.skipped = 0
+
+    def _parts(self, name, is_dir):
+        """Path components for an archive entry, or None if it is skipped."""
+        name = name.replace('\\', '/')
+        if name.startswith('/') or name[1:3] == ':/':
+            raise UploadError(f'Absolute path in archive: {name}')
+        parts = [p for p in name.split('/') if p not in ('', '.')]
+        if '..' in parts:
+            raise UploadError(f'Path escapes the site: {name}')
+        if any('\0' in p for p in parts):
+            raise UploadError('Invalid file name in archive')
+        parts = parts[self.strip:]
+        if not parts or parts[0] in SKIPPED_TOPLEVEL or any(p.startswith('.') for p in parts):
+            self.skipped += 1
+            return None
+        if len(parts) - (0 if is_dir else 1) > MAX_DEPTH:
+            raise UploadError(f'Folder nesting limit exceeded (max {MAX_DEPTH} levels): {name}')
+        return parts
+
+    def _makedirs(self, parts):
+        path = os.path.join(self.root, *parts)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except (FileExistsError, NotADirectoryError):
+            raise UploadError(f'Archive has a file and a folder named {"/".join(parts)}')
+        return path
+
+    def add_dir(self, name):
+        parts = self._parts(name, is_dir=True)
+        if parts:
+            self._makedirs(parts)
+
+    def add_file(self, name, src):
+        parts = self._parts(name, is_dir=False)
+        if parts is None:
+            return
+        rel = '/'.join(parts)
+        if rel not in self.files and len(self.files) >= self.max_files:
+            raise UploadError(f'Too many files in archive (max {self.max_files})', 413)
+
+        folder = self._makedirs(parts[:-1]) if len(parts) > 1 else self.root
+        path = os.path.join(folder, parts[-1])
+        if os.path.isdir(path):
+            raise UploadError(f'Archive has a file and a folder named {rel}')
+        # повтор имени в архиве - побеждает последняя копия
+        self.total -= self.files.pop(rel, 0)
+        size = 0
+        with open(path, 'wb') as f:
+            for block in iter(lambda: src.read(CHUNK_READ_SIZE), b''):
+                size += len(block)
+                if self.total + size > self.quota:
+                    raise UploadError('Storage limit exceeded', 413)
+                f.write(block)
+        self.files[rel] = size
+        self.total += size
+
+    # -------------------------
+    # форматы
+    # -------------------------
+    def extract_tar(self, stream):
+        # 'r|*' - потоковое чтение: без перемотки, сжатие определяется само
+        with tarfile.open(fileobj=stream, mode='r|*') as tf:
+            for member in tf:
+                if member.isdir():
+                    self.add_dir(member.name)
+                elif member.isfile():
+                    self.add_file(member.name, tf.extractfile(member))
+                else:
+                    raise UploadError(f'Links and special files are not allowed: {member.name}')
+
+    def extract_zip(self, path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                # тип файла есть только в архивах из Unix
+                kind = stat.S_IFMT(info.external_attr >> 16)
+                if kind and kind not in (stat.S_IFREG, stat.S_IFDIR):
+                    raise UploadError(f'Links and special files are not allowed: {info.filename}')
+                if info.flag_bits & 0x1:
+                    raise UploadError('Encrypted archives are not supported')
+                if info.is_dir():
+                    self.add_dir(info.filename)
+                else:
+                    with zf.open(info) as src:
+                        self.add_file(info.filename, src)
+
+
+def spool(stream, folder):
+    """Copy ``stream`` into a temp file in ``folder``; return its path."""
+    path = os.path.join(folder, f'deploy-{uuid.uuid4().hex}.zip')
+    try:
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNK_READ_SIZE)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def extract(stream, root, quota, max_files, max_archive, tmp_folder, strip=0):
+    """Unpack the archive read from ``stream`` into ``root``.
+
+    A tar archive (plain or compressed) is unpacked while it is being
+    received. A ZIP keeps its table of contents at the end, so it is
+    spooled to ``tmp_folder`` first. Returns the ArchiveExtractor.
+    """
+    head = _read_head(stream, 4)
+    if not head:
+        raise UploadError('Archive is empty')
+    # лимит на сам архив: и ZIP на диске, и пропускаемые записи tar
+    stream = _ArchiveStream(head, stream, max_archive)
+    extractor = ArchiveExtractor(root, quota, max_files, strip)
+    try:
+        if head in ZIP_MAGIC:
+            path = spool(stream, tmp_folder)
+            try:
+                extractor.extract_zip(path)
+            finally:
+                os.remove(path)
+        else:
+            extractor.extract_tar(stream)
+    except ARCHIVE_ERRORS:
+        raise UploadError('Not a valid ZIP or tar archive')
+    return extractor
+
+
+def staging_dir(root):
+    """Empty hidden folder next to ``root`` (same filesystem, so rename works)."""
+    parent, name = os.path.split(os.path.normpath(root))
+    path = os.path.join(parent, f'.{name}.deploy-{uuid.uuid4().hex[:8]}')
+    os.makedirs(path)
+    return path
+
+
+def _exchange(a, b):
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return False
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    renameat2 = getattr(libc, 'renameat2', None)
+    if renameat2 is None:
+        return False
+    if renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+        # старое ядро или ФС без RENAME_EXCHANGE
+        return False
+    raise OSError(err, os.strerror(err), a)
+
+
+def swap_tree(staging, root):
+    """Put ``staging`` in place of ``root``; return the path of the old tree.
+
+    On Linux both folders are exchanged atomically, so readers see either
+    the old site or the new one. Elsewhere it is two renames with a short
+    window in which the site is missing.
+    """
+    if not os.path.isdir(root):
+        os.rename(staging, root)
+        return None
+    if _exchange(staging, root):
+        return staging
+    parent, name = os.path.split(os.path.normpath(root))
+    old = os.path.join(parent, f'.{name}.old-{uuid.uuid4().hex[:8]}')
+    os.rename(root, old)
+    os.rename(staging, root)
+    return old
+
+
+def remove_tree(path):
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
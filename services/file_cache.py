@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+
+class FileCache:
+    """Bodies of small, hot site files kept in memory, within a byte budget.
+
+    Entries are keyed by (app_id, relative path, encoding) and carry the
+    ETag the body was read under and the site's stamp (SiteIndex.stamp);
+    serve_site passes the current ones, so a file changed by any worker is
+    a miss without reading it. A file is only read into the cache on its second
+    request - one-off hits do not push hot files out - and the least
+    recently used entries are evicted once FILE_CACHE_BYTES is exceeded.
+    The routes that change files call ``invalidate`` right away; other
+    workers see the stamp move on their next hit.
+    """
+
+    # сколько ключей помнить для допуска "со второго запроса"
+    SEEN_LIMIT = 4096
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file=256 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.size = 0
+        self._entries = OrderedDict()
+        self._by_app = {}
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('FILE_CACHE_BYTES', self.max_bytes)
+        self.max_file = app.config.get('FILE_CACHE_MAX_FILE', self.max_file)
+        app.extensions['file_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key, etag, stamp=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag and entry[2] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def admit(self, key, size):
+        """Whether a missed file should be read into the cache now."""
+        if not self.enabled or size > min(self.max_file, self.max_bytes):
+            return False
+        with self._lock:
+            if key in self._seen:
+                del self._seen[key]
+                return True
+            self._seen[key] = None
+            if len(self._seen) > self.SEEN_LIMIT:
+                self._seen.popitem(last=False)
+            return False
+
+    def put(self, key, etag, body, stamp=None):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (etag, body, stamp)
+            self._by_app.setdefault(key[0], set()).add(key)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, body, _ = self._entries.pop(key)
+        self.size -= len(body)
+        keys = self._by_app.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_app[key[0]]
+
+    def invalidate(self, app_id, prefix=None):
+        """Forget a whole site or everything at/under ``prefix``."""
+        prefix = (prefix or '').strip('/')
+        if prefix == '.':
+            prefix = ''
+        with self._lock:
+            for key in list(self._by_app.get(app_id, ())):
+                rel = key[1]
+                if not prefix or rel == prefix or rel.startswith(prefix + '/'):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_app.clear()
+            self._seen.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'bytes': self.size}
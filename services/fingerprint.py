@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import threading
+import time
+import uuid
+from urllib.parse import unquote
+
+from extensions import site_index, compressor
+from models import Job, UserApp
+from services.compression import SUFFIXES
+from services.jobs import job_runner
+from services.site_index import normalize
+
+
+HASH_LENGTH = 10
+# страницы и стили, в которых переписываем ссылки на ассеты
+REWRITE_EXTENSIONS = ('.html', '.htm', '.css')
+# не чаще, чем раз в столько секунд, проверяем, не опубликовал ли другой воркер
+MANIFEST_CHECK_INTERVAL = 1.0
+
+ATTR_RE = re.compile(r'''(\b(?:src|href|poster|data-src)\s*=\s*)(["'])(.*?)\2''', re.I | re.S)
+SRCSET_RE = re.compile(r'''(\bsrcset\s*=\s*)(["'])(.*?)\2''', re.I | re.S)
+CSS_URL_RE = re.compile(r'''(url\(\s*)(["']?)([^"')]*?)\2(\s*\))''', re.I)
+CSS_IMPORT_RE = re.compile(r'''(@import\s+)(["'])(.*?)\2''', re.I)
+SCHEME_RE = re.compile(r'^[a-z][a-z0-9+.-]*:', re.I)
+
+
+def fingerprinted_name(name, digest):
+    """``style.css`` -> ``style.<hash>.css``."""
+    stem, dot, ext = name.rpartition('.')
+    if not dot or not stem:
+        return f'{name}.{digest[:HASH_LENGTH]}'
+    return f'{stem}.{digest[:HASH_LENGTH]}.{ext}'
+
+
+class _Publication:
+    """One publish run over a site: hashes assets, rewrites pages and styles."""
+
+    def __init__(self, app_id, root, asset_extensions):
+        self.app_id = app_id
+        self.root = root
+        self.asset_extensions = asset_extensions
+        self.files = {rel for _, rel in site_index.iter_files(app_id, root)}
+        self.assets = {}      # исходный путь -> (путь с хэшем, etag исходника, хэш)
+        self.rewritten = {}   # исходный путь -> (новое содержимое, etag исходника)
+        self._visiting = set()
+
+    def fingerprint(self, rel):
+        """Content hash of an asset (publishing it on first use), or None if it is not one."""
+        if rel in self.assets:
+            return self.assets[rel][2]
+        if not rel.lower().endswith(self.asset_extensions) or rel not in self.files or rel in self._visiting:
+            return None
+        meta = site_index.lookup(self.app_id, self.root, rel)
+        if meta is None:
+            return None
+
+        if rel.lower().endswith('.css'):
+            # хэш стиля зависит от того, на какие версии ассетов он ссылается
+            self._visiting.add(rel)
+            try:
+                body = self.rewrite(rel, meta)
+            finally:
+                self._visiting.discard(rel)
+            digest = hashlib.sha256(body).hexdigest()
+        else:
+            digest = site_index.content_hash(self.app_id, self.root, rel)
+        if digest is None:
+            return None
+
+        directory, name = posixpath.split(rel)
+        target = posixpath.join(directory, fingerprinted_name(name, digest))
+        if target in self.files:
+            return None  # такое имя уже занято настоящим файлом
+        self.assets[rel] = (target, meta.etag, digest)
+        return digest
+
+    # -------------------------
+    # переписывание ссылок
+    # -------------------------
+    def rewrite(self, rel, meta=None):
+        if rel in self.rewritten:
+            return self.rewritten[rel][0]
+        meta = meta or site_index.lookup(self.app_id, self.root, rel)
+        with open(meta.path, 'rb') as f:
+            # surrogateescape: байты не в UTF-8 проходят как есть
+            text = f.read().decode('utf-8', 'surrogateescape')
+
+        base = posixpath.dirname(rel)
+        url = lambda value: self._rewrite_url(value, base)
+        text = CSS_URL_RE.sub(lambda m: m.group(1) + m.group(2) + url(m.group(3)) + m.group(2) + m.group(4), text)
+        text = CSS_IMPORT_RE.sub(lambda m: m.group(1) + m.group(2) + url(m.group(3)) + m.group(2), text)
+        if not rel.lower().endswith('.css'):
+            text = ATTR_RE.sub(lambda m: m.group(1) + m.group(2) + url(m.group(3)) + m.group(2), text)
+            text = SRCSET_RE.sub(lambda m: m.group(1) + m.group(2) + self._rewrite_srcset(m.group(3), base)
+                                 + m.group(2), text)
+
+        body = text.encode('utf-8', 'surrogateescape')
+        self.rewritten[rel] = (body, meta.etag)
+        return body
+
+    def _rewrite_srcset(self, value, base):
+        candidates = []
+        for candidate in value.split(','):
+            parts = candidate.strip().split(None, 1)
+            if parts:
+                parts[0] = self._rewrite_url(parts[0], base)
+            candidates.append(' '.join(parts))
+        return ', '.join(candidates)
+
+    def _rewrite_url(self, url, base):
+        value = url.strip()
+        if not value or value.startswith(('#', '//')) or SCHEME_RE.match(value):
+            return url
+        cut = min([i for i in (value.find('?'), value.find('#')) if i >= 0] or [len(value)])
+        path, rest = value[:cut], value[cut:]
+
+        site_prefix = f'/sites/{self.app_id}/'
+        if path.startswith('/'):
+            if not path.startswith(site_prefix):
+                return url
+            rel = normalize(unquote(path[len(site_prefix):]))
+        else:
+            rel = normalize(unquote(posixpath.join(base, path)))
+        digest = self.fingerprint(rel) if rel else None
+        if digest is None:
+            return url
+
+        # меняем только имя файла, остальная ссылка остаётся как была
+        head, slash, name = path.rpartition('/')
+        return head + slash + fingerprinted_name(name, digest) + rest
+
+
+class AssetPublisher:
+    """Opt-in fingerprinted asset URLs for a site (UserApp.fingerprint_assets).
+
+    A publish (the ``publish_assets`` job) gives every CSS/JS/image/font
+    file a ``name.<hash>.ext`` alias and rewrites the references in the
+    site's HTML and CSS to use it. The rewritten copies, their gzip/brotli
+    variants and ``manifest.json`` live in ``<ASSET_CACHE_FOLDER>/_published/<app_id>/``;
+    each publish writes a new version folder and switches the manifest.
+
+    serve_site answers a fingerprinted URL with FINGERPRINT_CACHE_CONTROL
+    (immutable, one year) as long as the asset is unchanged since the
+    publish; routes that change files schedule a new publish, and until it
+    runs stale names and pages fall back to the current files with the
+    normal cache policy. Names from the previous publish are served only
+    while the content still has the hash in the name, and are 404 after.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.asset_extensions = ()
+        self.cache_control = 'public, max-age=31536000, immutable'
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.root = os.path.join(app.config['ASSET_CACHE_FOLDER'], '_published')
+        self.asset_extensions = tuple(app.config['ASSET_EXTENSIONS'])
+        self.cache_control = app.config.get('FINGERPRINT_CACHE_CONTROL', self.cache_control)
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['asset_publisher'] = self
+
+    def _site_dir(self, app_id):
+        return os.path.join(self.root, app_id)
+
+    # -------------------------
+    # manifest
+    # -------------------------
+    def manifest(self, app_id, fresh=False):
+        now = time.monotonic()
+        path = os.path.join(self._site_dir(app_id), 'manifest.json')
+        with self._lock:
+            cached = self._manifests.get(app_id)
+            if cached is not None and not fresh and now - cached[0] < MANIFEST_CHECK_INTERVAL:
+                return cached[2]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if cached is not None and cached[1] == mtime:
+            manifest = cached[2]
+        elif mtime is None:
+            manifest = None
+        else:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = None
+        with self._lock:
+            self._manifests[app_id] = (now, mtime, manifest)
+        return manifest
+
+    def resolve(self, app_id, root, filename):
+        """Map a requested path to (source path, fingerprinted asset entry or None).
+
+        An address from the previous publish resolves only while the content
+        served for its source still has the hash in the address; otherwise
+        the name is left as is and the lookup answers 404.
+        """
+        manifest = self.manifest(app_id)
+        if manifest:
+            rel = normalize(filename) or ''
+            entry = manifest['assets'].get(rel)
+            if entry is None:
+                entry = manifest['previous'].get(rel)
+                if entry is not None and self._current_name(app_id, root, manifest, entry['source']) != rel:
+                    return filename, None
+            if entry is not None:
+                return entry['source'], entry
+        return filename, None
+
+    def _current_name(self, app_id, root, manifest, source):
+        """Fingerprinted path for what serve_site would send for ``source`` now."""
+        meta = site_index.lookup(app_id, root, source)
+        if meta is None:
+            return None
+        # страница или стиль отдаются переписанной копией, пока исходник тот же
+        rewritten = manifest['rewritten'].get(source)
+        if rewritten is not None and rewritten['etag'] == meta.etag:
+            digest = rewritten['digest']
+        else:
+            digest = site_index.content_hash(app_id, root, source)
+        if digest is None:
+            return None
+        directory, name = posixpath.split(source)
+        return posixpath.join(directory, fingerprinted_name(name, digest))
+
+    def variant(self, app_id, filename, meta, accept_encodings=None):
+        """(encoding, path, size, etag) of the rewritten copy of a page or style, or None.
+
+        Without ``accept_encodings`` (Range requests) only the plain copy is offered.
+        """
+        manifest = self.manifest(app_id)
+        entry = manifest and manifest['rewritten'].get(normalize(filename) or '')
+        if not entry or entry['etag'] != meta.etag:
+            return None  # не опубликовано или исходник уже изменился
+        path = os.path.join(self._site_dir(app_id), manifest['version'], entry['file'])
+        etag = f"{meta.etag}-p{entry['digest'][:HASH_LENGTH]}"
+        encoding = compressor.pick_encoding(entry, accept_encodings) if accept_encodings is not None else None
+        if encoding is None:
+            return None, path, entry['size'], etag
+        return encoding, path + SUFFIXES[encoding], entry[encoding], f'{etag}-{encoding}'
+
+    # -------------------------
+    # публикация
+    # -------------------------
+    def schedule(self, app_id, user_id=None):
+        """Queue a publish unless one is already waiting."""
+        if Job.query.filter_by(kind='publish_assets', app_id=app_id, status='queued').first() is None:
+            return job_runner.submit('publish_assets', user_id=user_id, app_id=app_id)
+
+    def site_changed(self, app_obj):
+        """Called by the routes after files of a site were changed."""
+        if app_obj.fingerprint_assets:
+            self.schedule(app_obj.app_id, app_obj.user_id)
+
+    def publish(self, app_id, root):
+        run = _Publication(app_id, root, self.asset_extensions)
+        for rel in sorted(run.files):
+            if rel.lower().endswith(REWRITE_EXTENSIONS):
+                run.rewrite(rel)
+            else:
+                run.fingerprint(rel)
+
+        site_dir = self._site_dir(app_id)
+        version = f'v{int(time.time())}-{uuid.uuid4().hex[:6]}'
+        version_dir = os.path.join(site_dir, version)
+        manifest = {'version': version, 'assets': {}, 'rewritten': {}}
+        for rel, (target, etag, _) in run.assets.items():
+            manifest['assets'][target] = {'source': rel, 'etag': etag}
+        # адреса прошлой публикации ещё есть в закэшированных страницах:
+        # resolve отдаёт по ним файл, только пока хэш в адресе совпадает с содержимым
+        old = self.manifest(app_id, fresh=True) or {'assets': {}}
+        # имя, занятое теперь настоящим файлом, отдаёт сам файл
+        manifest['previous'] = {name: entry for name, entry in old['assets'].items()
+                                if name not in manifest['assets'] and name not in run.files}
+        for rel, (body, etag) in run.rewritten.items():
+            dst = os.path.join(version_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, 'wb') as f:
+                f.write(body)
+            entry = {'file': rel, 'etag': etag, 'size': len(body),
+                     'digest': hashlib.sha256(body).hexdigest()}
+            entry.update(compressor.write_variants(dst, body))
+            manifest['rewritten'][rel] = entry
+
+        os.makedirs(site_dir, exist_ok=True)
+        tmp_path = os.path.join(site_dir, 'manifest.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(site_dir, 'manifest.json'))
+        with self._lock:
+            self._manifests.pop(app_id, None)
+        self._remove_old_versions(site_dir, keep=version)
+        return {'assets': len(manifest['assets']), 'rewritten': len(manifest['rewritten'])}
+
+    def _remove_old_versions(self, site_dir, keep):
+        # предыдущую версию оставляем: её файлы могут отдаваться прямо сейчас
+        versions = sorted((os.path.getmtime(os.path.join(site_dir, name)), name)
+                          for name in os.listdir(site_dir)
+                          if name != keep and os.path.isdir(os.path.join(site_dir, name)))
+        for _, name in versions[:-1]:
+            shutil.rmtree(os.path.join(site_dir, name), ignore_errors=True)
+
+    def discard(self, app_id):
+        with self._lock:
+            self._manifests.pop(app_id, None)
+        shutil.rmtree(self._site_dir(app_id), ignore_errors=True)
+
+
+asset_publisher = AssetPublisher()
+
+
+@job_runner.handler('publish_assets')
+def publish_assets(ctx):
+    app_obj = UserApp.query.filter_by(app_id=ctx.app_id).first()
+    if app_obj is None or not app_obj.fingerprint_assets:
+        return None  # сайт удалили или публикацию выключили
+    return asset_publisher.publish(app_obj.app_id, app_obj.path)
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, session
+from flask_login import UserMixin, user_logged_in, user_logged_out
+
+from extensions import db, site_index
+from models import User, UserApp
+
+
+class CachedUser(UserMixin):
+    """Identity snapshot used as ``current_user`` - no ORM row, no session."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class AppSummary(namedtuple('AppSummary', ['app_id', 'app_name', 'path', 'created_at'])):
+    """The dashboard's view of a UserApp row."""
+
+    __slots__ = ()
+
+    def get_files(self):
+        return [name for name, _ in site_index.listing(self.app_id, self.path) or []]
+
+
+class IdentityCache:
+    """Keeps logged-in users from hitting the database on every request.
+
+    ``load_user`` first trusts the identity stored in the (signed) session
+    cookie at login (IDENTITY_IN_SESSION), then a per-process TTL cache,
+    and only then queries ``user``. A user's app list is cached the same
+    way and memoised on ``g`` for the rest of the request.
+
+    The app-list entries are tagged with a version kept in the session;
+    the create/delete routes bump it through ``invalidate_apps``, so the
+    user's next request reloads the list in whichever worker it lands in.
+    Other workers' caches otherwise expire after IDENTITY_CACHE_TTL.
+    """
+
+    SESSION_KEY = '_identity'
+    VERSION_KEY = '_apps_v'
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.in_session = True
+        self._users = {}
+        self._apps = {}
+        self._lock = threading.Lock()
+        # промах - запрос в БД
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.in_session = app.config.get('IDENTITY_IN_SESSION', self.in_session)
+        user_logged_in.connect(self._on_login, app)
+        user_logged_out.connect(self._on_logout, app)
+        app.extensions['identity_cache'] = self
+
+    def _on_login(self, sender, user):
+        if self.in_session:
+            session[self.SESSION_KEY] = {'id': user.id, 'username': user.username}
+
+    def _on_logout(self, sender, user):
+        session.pop(self.SESSION_KEY, None)
+
+    def _get(self, store, key):
+        with self._lock:
+            entry = store.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del store[key]
+                return None
+            return entry[1]
+
+    def _put(self, store, key, value):
+        with self._lock:
+            store[key] = (time.monotonic() + self.ttl, value)
+
+    # -------------------------
+    # пользователь
+    # -------------------------
+    def load_user(self, user_id):
+        user_id = int(user_id)
+        identity = session.get(self.SESSION_KEY) if self.in_session else None
+        if identity and identity.get('id') == user_id:
+            self.hits += 1
+            return CachedUser(user_id, identity['username'])
+
+        user = self._get(self._users, user_id)
+        if user is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            row = db.session.get(User, user_id)
+            if row is None:
+                return None
+            user = CachedUser(row.id, row.username)
+            if self.ttl > 0:
+                self._put(self._users, user_id, user)
+        if self.in_session:
+            # например, вход по remember-cookie - дальше уже без БД
+            session[self.SESSION_KEY] = {'id': user.id, 'username': user.username}
+        return user
+
+    # -------------------------
+    # приложения пользователя
+    # -------------------------
+    def apps(self, user_id):
+        """The user's apps as a tuple of AppSummary, oldest first."""
+        memo = g.setdefault('_user_apps', {})
+        if user_id in memo:
+            return memo[user_id]
+
+        version = session.get(self.VERSION_KEY, 0)
+        entry = self._get(self._apps, user_id)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            apps = entry[1]
+        else:
+            self.misses += 1
+            rows = UserApp.query.filter_by(user_id=user_id).order_by(UserApp.id).all()
+            apps = tuple(AppSummary(a.app_id, a.app_name, a.path, a.created_at) for a in rows)
+            if self.ttl > 0:
+                self._put(self._apps, user_id, (version, apps))
+        memo[user_id] = apps
+        return apps
+
+    def invalidate_apps(self, user_id):
+        with self._lock:
+            self._apps.pop(user_id, None)
+        g.pop('_user_apps', None)
+        session[self.VERSION_KEY] = session.get(self.VERSION_KEY, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._apps.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._users) + len(self._apps)}
+
+
+identity_cache = IdentityCache()
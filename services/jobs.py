@@ -0,0 +1,358 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from extensions import db, site_index
+from models import Job, UserApp
+from services.zipstream import stream_zip
+
+
+ACTIVE = ('queued', 'running')
+FINISHED = ('done', 'failed', 'cancelled')
+# не чаще, чем раз в столько секунд, пишем прогресс и проверяем отмену
+POLL_INTERVAL = 0.5
+PRUNE_INTERVAL = 3600
+
+
+class JobError(Exception):
+    """A job failed in a way a retry will not fix."""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _owner():
+    # pid меняется после fork, поэтому не кэшируем
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _owner_alive(owner):
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True  # чужой хост - проверить нельзя
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobContext:
+    """Passed to a handler: reports progress and tells it when to stop."""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.app_id = job.app_id
+        self._reported = 0
+        self._checked = 0
+
+    def progress(self, done, total):
+        now = time.monotonic()
+        if now - self._reported < POLL_INTERVAL:
+            return
+        self._reported = now
+        Job.query.filter_by(id=self.job_id).update(
+            {Job.progress: min(int(done * 100 / total), 99) if total else 0, Job.updated_at: _now()},
+            synchronize_session=False)
+        db.session.commit()
+
+    def check(self):
+        """Raise JobCancelled if the user asked to cancel. Handlers that can stop call this."""
+        now = time.monotonic()
+        if now - self._checked < POLL_INTERVAL:
+            return
+        self._checked = now
+        if db.session.query(Job.cancel_requested).filter_by(id=self.job_id).scalar():
+            raise JobCancelled()
+
+
+class JobRunner:
+    """In-process background jobs backed by the ``job`` table.
+
+    ``submit`` stores a row and hands the job to a thread pool of
+    JOB_WORKERS threads; ``handler(kind)`` registers the function that
+    runs it. A failing job is retried up to JOB_MAX_ATTEMPTS times,
+    JOB_RETRY_DELAY * attempt seconds apart (JobError fails at once).
+
+    The status lives in the database, so any worker can report it or
+    request cancellation. A worker that died leaves its jobs queued or
+    running; the next worker on the same host to serve a request takes
+    them over. Finished jobs and their result files are kept for
+    JOB_RESULT_TTL seconds.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.folder = None
+        self.handlers = {}
+        self.max_attempts = 3
+        self.retry_delay = 5
+        self.result_ttl = 24 * 3600
+        self._executor = None
+        self._recovered = False
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.folder = app.config['JOB_FOLDER']
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_delay = app.config.get('JOB_RETRY_DELAY', self.retry_delay)
+        self.result_ttl = app.config.get('JOB_RESULT_TTL', self.result_ttl)
+        workers = app.config.get('JOB_WORKERS', 2)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job') if workers > 0 else None
+        os.makedirs(self.folder, exist_ok=True)
+        app.extensions['job_runner'] = self
+
+        @app.before_request
+        def recover_jobs():
+            if not self._recovered:
+                self.recover()
+
+    def handler(self, kind):
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def result_path(self, name):
+        return os.path.join(self.folder, name)
+
+    # -------------------------
+    # постановка и управление
+    # -------------------------
+    def submit(self, kind, user_id=None, app_id=None, **payload):
+        job = Job(id=uuid.uuid4().hex, kind=kind, user_id=user_id, app_id=app_id,
+                  payload=json.dumps(payload), max_attempts=self.max_attempts, owner=_owner())
+        db.session.add(job)
+        db.session.commit()
+        self._dispatch(job.id)
+        if self._executor is None:
+            db.session.refresh(job)  # уже выполнена прямо здесь
+        if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+            self.prune()
+        return job
+
+    def cancel(self, job):
+        # из очереди снимаем сразу, выполняющуюся - просим остановиться
+        if Job.query.filter_by(id=job.id, status='queued').update(
+                {Job.status: 'cancelled', Job.finished_at: _now(), Job.updated_at: _now()},
+                synchronize_session=False):
+            db.session.commit()
+        elif job.status == 'running':
+            job.cancel_requested = True
+            db.session.commit()
+        db.session.refresh(job)
+        return job
+
+    def retry(self, job):
+        """Run a failed or cancelled job again from scratch."""
+        if job.status not in ('failed', 'cancelled'):
+            return job
+        job.status = 'queued'
+        job.attempts = 0
+        job.progress = 0
+        job.error = None
+        job.cancel_requested = False
+        job.finished_at = None
+        job.owner = _owner()
+        job.updated_at = _now()
+        db.session.commit()
+        self._dispatch(job.id)
+        if self._executor is None:
+            db.session.refresh(job)
+        return job
+
+    def _dispatch(self, job_id, delay=0):
+        if self._executor is None:
+            self._run(job_id)
+        elif delay:
+            timer = threading.Timer(delay, self._executor.submit, (self._run, job_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._executor.submit(self._run, job_id)
+
+    # -------------------------
+    # выполнение
+    # -------------------------
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                self._execute(job_id)
+            except Exception:
+                self.app.logger.exception('job %s crashed', job_id)
+            finally:
+                db.session.remove()
+
+    def _finish(self, job_id, status, **values):
+        now = _now()
+        values.update(status=status, finished_at=now, updated_at=now)
+        Job.query.filter_by(id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def _execute(self, job_id):
+        # забираем атомарно: задачу могли отменить или уже взять
+        if not Job.query.filter_by(id=job_id, status='queued').update(
+                {Job.status: 'running', Job.owner: _owner(), Job.attempts: Job.attempts + 1,
+                 Job.updated_at: _now()}, synchronize_session=False):
+            db.session.rollback()
+            return
+        db.session.commit()
+        job = db.session.get(Job, job_id)
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            return self._finish(job_id, 'failed', error=f'Unknown job kind {job.kind}')
+
+        try:
+            result = handler(JobContext(job), **json.loads(job.payload))
+        except JobCancelled:
+            db.session.rollback()
+            return self._finish(job_id, 'cancelled')
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if isinstance(e, JobError) or job.attempts >= job.max_attempts or job.cancel_requested:
+                self.app.logger.exception('job %s (%s) failed', job_id, job.kind)
+                return self._finish(job_id, 'failed', error=str(e) or type(e).__name__)
+            self.app.logger.warning('job %s (%s) attempt %s failed: %s', job_id, job.kind, job.attempts, e)
+            Job.query.filter_by(id=job_id).update(
+                {Job.status: 'queued', Job.error: str(e), Job.updated_at: _now()},
+                synchronize_session=False)
+            db.session.commit()
+            retry_in = self.retry_delay * job.attempts
+        else:
+            return self._finish(job_id, 'done', progress=100, error=None,
+                                result=json.dumps(result) if result is not None else None)
+        self._dispatch(job_id, delay=retry_in)
+
+    # -------------------------
+    # обслуживание
+    # -------------------------
+    def recover(self):
+        """Take over unfinished jobs of dead workers on this host."""
+        with self._lock:
+            if self._recovered:
+                return
+            self._recovered = True
+        me = _owner()
+        try:
+            stale = [(job.id, job.owner) for job in Job.query.filter(Job.status.in_(ACTIVE)).all()
+                     if job.owner != me and not _owner_alive(job.owner)]
+            for job_id, owner in stale:
+                # с условием на owner: другой воркер мог забрать её раньше
+                if Job.query.filter_by(id=job_id, owner=owner).update(
+                        {Job.status: 'queued', Job.owner: me, Job.updated_at: _now()},
+                        synchronize_session=False):
+                    db.session.commit()
+                    self.app.logger.info('recovered job %s from %s', job_id, owner)
+                    self._dispatch(job_id)
+            db.session.commit()
+        except (OperationalError, ProgrammingError):
+            # таблицы ещё нет (база не мигрирована)
+            db.session.rollback()
+            self.app.logger.warning('job table is missing, run "flask db-upgrade"')
+
+    def prune(self):
+        """Delete finished jobs older than JOB_RESULT_TTL and their files."""
+        self._pruned_at = time.monotonic()
+        cutoff = _now() - timedelta(seconds=self.result_ttl)
+        old = Job.query.filter(Job.status.in_(FINISHED), Job.finished_at < cutoff).all()
+        for job in old:
+            name = json.loads(job.result).get('file') if job.result else None
+            if name:
+                try:
+                    os.remove(self.result_path(name))
+                except OSError:
+                    pass
+            db.session.delete(job)
+        db.session.commit()
+        return len(old)
+
+    def trash(self, path, user_id=None, app_id=None):
+        """Move ``path`` out of the site right away and delete it in a job."""
+        trash_dir = os.path.join(self.app.config['UPLOAD_FOLDER'], '.trash')
+        os.makedirs(trash_dir, exist_ok=True)
+        target = os.path.join(trash_dir, f'{os.path.basename(os.path.normpath(path))}-{uuid.uuid4().hex[:8]}')
+        try:
+            os.rename(path, target)
+        except OSError:
+            # другая ФС - удаляем на месте, но всё равно в фоне
+            target = path
+        return self.submit('remove_tree', user_id=user_id, app_id=app_id, path=target)
+
+    def stats(self):
+        rows = db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all()
+        return dict(rows)
+
+
+job_runner = JobRunner()
+
+
+# -------------------------
+# задачи
+# -------------------------
+@job_runner.handler('remove_tree')
+def remove_tree(ctx, path):
+    if not os.path.lexists(path):
+        return None
+    if not os.path.isdir(path) or os.path.islink(path):
+        os.remove(path)
+        return None
+    children = os.listdir(path)
+    for i, name in enumerate(children):
+        child = os.path.join(path, name)
+        if os.path.isdir(child) and not os.path.islink(child):
+            shutil.rmtree(child)
+        else:
+            os.remove(child)
+        ctx.progress(i + 1, len(children))
+    os.rmdir(path)
+    return None
+
+
+@job_runner.handler('export_app')
+def export_app(ctx):
+    app_id = ctx.app_id
+    app_obj = UserApp.query.filter_by(app_id=app_id).first()
+    if app_obj is None:
+        raise JobError('Application not found')
+
+    files = site_index.iter_files(app_id, app_obj.path)
+
+    def entries():
+        for i, entry in enumerate(files):
+            ctx.check()
+            ctx.progress(i, len(files))
+            yield entry
+
+    name = f'{ctx.job_id}.zip'
+    path = job_runner.result_path(name)
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in stream_zip(entries()):
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+    except BaseException:
+        try:
+            os.remove(path + '.tmp')
+        except OSError:
+            pass
+        raise
+    return {'file': name, 'filename': f'{app_obj.app_name}.zip', 'size': os.path.getsize(path)}
@@ -0,0 +1,387 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from werkzeug.wsgi import ClosingIterator
+
+from extensions import db, site_cache, site_index, compressor, file_cache
+from services.blobstore import blob_store
+from services.identity import identity_cache
+from services.jobs import job_runner
+from services.site_sync import site_sync
+from services.profiler import SamplingProfiler
+
+
+# итог завершившихся воркеров в METRICS_DIR
+DEAD_WORKERS_FILE = 'dead.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# имя -> (тип, описание, корзины гистограммы)
+METRICS = {
+    'hosting_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'hosting_http_request_duration_seconds': ('histogram', 'Request latency including the body.', LATENCY_BUCKETS),
+    'hosting_http_request_db_queries': ('histogram', 'Database queries per request.', QUERY_BUCKETS),
+    'hosting_db_queries_total': ('counter', 'Database queries by endpoint ("" - background work).', None),
+    'hosting_db_query_seconds_total': ('counter', 'Time spent in database queries.', None),
+    'hosting_site_bytes_sent_total': ('counter', 'Response bytes sent by serve_site, per site.', None),
+    'hosting_site_requests_total': ('counter', 'serve_site requests per site.', None),
+    'hosting_site_throttled_total': ('counter', 'serve_site requests refused by the rate limiter (429).', None),
+    'hosting_cache_hits_total': ('counter', 'In-process cache hits.', None),
+    'hosting_cache_misses_total': ('counter', 'In-process cache misses.', None),
+    'hosting_cache_hit_ratio': ('gauge', 'hits / (hits + misses) since start.', None),
+    'hosting_blob_store_bytes': ('gauge', 'Blob store size: stored (deduplicated) vs logical.', None),
+    'hosting_jobs': ('gauge', 'Background jobs in the job table by status.', None),
+    'hosting_slow_requests_profiled_total': ('counter', 'Slow requests written out by the profiler.', None),
+}
+
+CACHES = {
+    'site': site_cache,
+    'site_index': site_index,
+    'compressed_variants': compressor,
+    'identity': identity_cache,
+    'file': file_cache,
+    'storage': site_sync,
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """Counters and histograms of one process, mergeable across workers."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        # ключ -> [счётчики по корзинам..., сумма, количество]
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self.counters[_key(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = _key(name, labels)
+        with self._lock:
+            data = self.histograms.get(key)
+            if data is None:
+                data = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(data)] for (name, labels), data in self.histograms.items()],
+            }
+
+
+def merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, data in snapshot['histograms']:
+            key = name, tuple(map(tuple, labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], data)]
+            else:
+                histograms[key] = list(data)
+    return counters, histograms
+
+
+def retire_worker(directory, pid):
+    """Fold the snapshot of a finished worker into ``dead.json``.
+
+    Called by the gunicorn master (child_exit): the counters stay in the
+    totals and do not go down, and the pid file is gone before the pid can
+    be reused by a new worker.
+    """
+    if not directory:
+        return
+    path = os.path.join(directory, f'{pid}.json')
+    dead_path = os.path.join(directory, DEAD_WORKERS_FILE)
+    snapshots = []
+    for name in (dead_path, path):
+        try:
+            with open(name) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    if not os.path.exists(path):
+        return
+    counters, histograms = merge(snapshots)
+    with open(dead_path + '.tmp', 'w') as f:
+        json.dump({
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), data] for (name, labels), data in histograms.items()],
+        }, f)
+    os.replace(dead_path + '.tmp', dead_path)
+    os.remove(path)
+
+
+def render(counters, histograms):
+    """Prometheus text exposition format (version 0.0.4)."""
+    by_name = defaultdict(list)
+    for (name, labels), value in counters.items():
+        by_name[name].append((labels, value))
+    for (name, labels), data in histograms.items():
+        by_name[name].append((labels, data))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = by_name.get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series):
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+                continue
+            for bound, count in zip(buckets, value):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """Per-request instrumentation for the app, exported on /metrics.
+
+    Records latency (until the body is fully sent) and status per
+    endpoint, database queries and their time per request, serve_site
+    bytes per site and the hit counters of the in-process caches. Bytes of
+    responses offloaded to nginx/Apache (SENDFILE_MODE) are not counted -
+    the proxy sends them.
+
+    Every gunicorn worker has its own numbers. With METRICS_DIR set each
+    worker also writes them to ``<METRICS_DIR>/<pid>.json`` and /metrics
+    adds up all files, so a scrape sees the whole server whichever worker
+    answers it. When a worker exits the master folds its file into
+    ``dead.json`` (``retire_worker``). Clear the directory when deploying.
+
+    With PROFILE_SLOW_MS > 0 requests are sampled by SamplingProfiler, and
+    the stacks of those slower than the threshold are written to
+    PROFILE_FOLDER in collapsed format for flame graphs.
+    """
+
+    ENVIRON_KEY = 'hosting.metrics.finish'
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self.enabled = False
+        self.directory = None
+        self.max_sites = 1000
+        self.profiler = None
+        self.slow_threshold = 0
+        self.profile_folder = None
+        self._sites = set()
+        self._thread = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        app.extensions['request_metrics'] = self
+        if not self.enabled:
+            return
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.max_sites = app.config.get('METRICS_MAX_SITES', self.max_sites)
+        self.slow_threshold = app.config.get('PROFILE_SLOW_MS', 0) / 1000
+        if self.slow_threshold > 0:
+            self.profile_folder = app.config['PROFILE_FOLDER']
+            os.makedirs(self.profile_folder, exist_ok=True)
+            self.profiler = SamplingProfiler(app.config.get('PROFILE_INTERVAL_MS', 5) / 1000)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.wsgi_app = self._wrap(app.wsgi_app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_query)
+            event.listen(db.engine, 'after_cursor_execute', self._after_query)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            interval = app.config.get('METRICS_FLUSH_INTERVAL', 10)
+            if interval > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, args=(interval,),
+                                                name='metrics-flush', daemon=True)
+                self._thread.start()
+
+    # -------------------------
+    # запросы к БД
+    # -------------------------
+    def _before_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_query(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if has_request_context() and '_metrics_db' in g:
+            g._metrics_db[0] += 1
+            g._metrics_db[1] += elapsed
+        else:
+            self.registry.inc('hosting_db_queries_total', {'endpoint': ''})
+            self.registry.inc('hosting_db_query_seconds_total', {'endpoint': ''}, elapsed)
+
+    # -------------------------
+    # запрос
+    # -------------------------
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_db = [0, 0.0]
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def _site_label(self, site_id):
+        # не даём числу серий расти без предела
+        if site_id in self._sites or len(self._sites) < self.max_sites:
+            self._sites.add(site_id)
+            return site_id
+        return 'other'
+
+    def _after_request(self, response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        queries, query_time = g.pop('_metrics_db')
+        endpoint = request.endpoint or 'none'
+        method = request.method
+        status = str(response.status_code)
+        site_id = None
+        if endpoint == 'files.serve_site':
+            site_id = self._site_label(request.view_args.get('site_id', ''))
+        profiling = self.profiler is not None
+
+        def finish():
+            elapsed = time.perf_counter() - started
+            labels = {'endpoint': endpoint}
+            self.registry.inc('hosting_http_requests_total',
+                              {'endpoint': endpoint, 'method': method, 'status': status})
+            self.registry.observe('hosting_http_request_duration_seconds', labels, elapsed)
+            self.registry.observe('hosting_http_request_db_queries', labels, queries)
+            self.registry.inc('hosting_db_queries_total', labels, queries)
+            self.registry.inc('hosting_db_query_seconds_total', labels, query_time)
+            if site_id is not None:
+                self.registry.inc('hosting_site_requests_total', {'site_id': site_id})
+                self.registry.inc('hosting_site_bytes_sent_total', {'site_id': site_id},
+                                  response.content_length or 0)
+                if status == '429':
+                    self.registry.inc('hosting_site_throttled_total', {'site_id': site_id})
+            if profiling:
+                self._profile(endpoint, elapsed)
+
+        request.environ[self.ENVIRON_KEY] = finish
+        return response
+
+    def _wrap(self, wsgi_app):
+        # запрос закончен, когда сервер закрыл тело ответа (важно для потоковых)
+        def middleware(environ, start_response):
+            app_iter = wsgi_app(environ, start_response)
+            finish = environ.pop(self.ENVIRON_KEY, None)
+            if finish is None:
+                return app_iter
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if isinstance(file_wrapper, type) and isinstance(app_iter, file_wrapper):
+                # обёртка сломала бы sendfile(2) у сервера; само тело отдаёт ядро
+                finish()
+                return app_iter
+            return ClosingIterator(app_iter, finish)
+        return middleware
+
+    def _profile(self, endpoint, elapsed):
+        stacks = self.profiler.stop()
+        if elapsed < self.slow_threshold or not stacks:
+            return
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = f'{stamp}-{endpoint.replace(".", "_")}-{int(elapsed * 1000)}ms.folded'
+        try:
+            self.profiler.dump(stacks, os.path.join(self.profile_folder, name))
+            self.registry.inc('hosting_slow_requests_profiled_total', {'endpoint': endpoint})
+        except OSError:
+            pass
+
+    # -------------------------
+    # экспорт
+    # -------------------------
+    def _collect_caches(self):
+        for cache_name, cache in CACHES.items():
+            stats = cache.stats()
+            self.registry.set('hosting_cache_hits_total', {'cache': cache_name}, stats['hits'])
+            self.registry.set('hosting_cache_misses_total', {'cache': cache_name}, stats['misses'])
+
+    def flush(self):
+        """Write this worker's snapshot to METRICS_DIR."""
+        self._collect_caches()
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def export(self):
+        if self.directory:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        else:
+            self._collect_caches()
+            snapshots = [self.registry.snapshot()]
+        counters, histograms = merge(snapshots)
+
+        for cache_name in CACHES:
+            hits = counters.get(_key('hosting_cache_hits_total', {'cache': cache_name}), 0)
+            misses = counters.get(_key('hosting_cache_misses_total', {'cache': cache_name}), 0)
+            if hits + misses:
+                counters[_key('hosting_cache_hit_ratio', {'cache': cache_name})] = hits / (hits + misses)
+        if blob_store.enabled:
+            stats = blob_store.stats()
+            counters[_key('hosting_blob_store_bytes', {'kind': 'stored'})] = stats['stored_bytes']
+            counters[_key('hosting_blob_store_bytes', {'kind': 'logical'})] = stats['logical_bytes']
+        for status, count in job_runner.stats().items():
+            counters[_key('hosting_jobs', {'status': status})] = count
+        return render(counters, histograms)
+
+
+request_metrics = RequestMetrics()
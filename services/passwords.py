@@ -0,0 +1,98 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt as _bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password operations queued; the caller should answer 503."""
+
+
+# функции уровня модуля - их можно передать в дочерний процесс
+def _hash(password, rounds):
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    try:
+        return _bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:  # битый хэш в БД
+        return False
+
+
+def hash_cost(hashed):
+    """Cost factor of a ``$2b$12$...`` hash, or 0 if it can't be parsed."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small process pool, so key stretching does not take
+    CPU from the web workers, and refuses work once PASSWORD_QUEUE_LIMIT
+    operations are pending instead of letting logins pile up.
+
+    Hashes are compatible with Flask-Bcrypt. With PASSWORD_WORKERS = 0 the
+    work runs inline (tests).
+    """
+
+    def __init__(self):
+        self.rounds = 12
+        self.workers = 2
+        self.timeout = 10
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = app.config.get('PASSWORD_WORKERS', self.workers)
+        self.timeout = app.config.get('PASSWORD_TIMEOUT', self.timeout)
+        limit = app.config.get('PASSWORD_QUEUE_LIMIT') or max(self.workers, 1) * 4
+        self._slots = threading.BoundedSemaphore(limit)
+        app.extensions['password_hasher'] = self
+
+    def _pool(self):
+        with self._lock:
+            # пул создаётся лениво - уже внутри воркера gunicorn. Там много
+            # потоков, а fork копирует и чужие захваченные блокировки
+            # (logging, пул SQLAlchemy), поэтому процессы без fork
+            if self._executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # место освобождается, когда bcrypt действительно закончил: после
+        # таймаута уже идущий вызов не отменить, и он продолжает занимать процесс
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, hashed, password):
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) < self.rounds
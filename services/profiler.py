@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads that are serving a request.
+
+    A daemon thread wakes up every ``interval`` seconds and, for every
+    thread registered with ``start``, adds its current stack to a counter.
+    ``stop`` returns the counter; ``dump`` writes it in the collapsed
+    ("folded") format that flamegraph.pl, speedscope and inferno read:
+    one ``outer;inner;leaf count`` line per distinct stack.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        thread_id = thread_id or threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id=None):
+        with self._lock:
+            return self._active.pop(thread_id or threading.get_ident(), Counter())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None or thread_id == own_id:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(labels))] += 1
+
+    @staticmethod
+    def dump(stacks, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(tmp_path, path)
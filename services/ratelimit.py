@@ -0,0 +1,165 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+
+# раз в столько списаний забываем корзины, не тронутые IDLE_TTL секунд
+PRUNE_EVERY = 10000
+IDLE_TTL = 3600
+
+
+class MemoryBackend:
+    """Token buckets in a dict - per process (every gunicorn worker has its own)."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def take(self, key, rate, burst, cost, allow_debt=False):
+        """Refill the bucket, then take ``cost`` tokens.
+
+        Returns (allowed, retry_after_seconds). With ``allow_debt`` the
+        tokens are always taken and the bucket may go below zero.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = allow_debt or tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+
+            self._ops += 1
+            if self._ops >= PRUNE_EVERY:
+                self._ops = 0
+                for stale in [k for k, (_, t) in self._buckets.items() if now - t > IDLE_TTL]:
+                    del self._buckets[stale]
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def peek(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + (now - updated) * rate)
+
+
+class SQLiteBackend:
+    """Token buckets in a local SQLite file shared by all workers on the host.
+
+    Every take is one short ``BEGIN IMMEDIATE`` transaction; the state is
+    disposable, so the file runs with synchronous=OFF.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ops = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, cost, allow_debt=False):
+        # время общее для процессов - берём настенное, не monotonic
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            allowed = allow_debt or tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            self._ops += 1
+            if self._ops >= PRUNE_EVERY:
+                self._ops = 0
+                conn.execute('DELETE FROM bucket WHERE updated < ?', (now - IDLE_TTL,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def peek(self, key, rate, burst):
+        now = time.time()
+        row = self._connect().execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return burst
+        return min(burst, row[0] + max(now - row[1], 0) * rate)
+
+
+class RateLimiter:
+    """Per-site request and bandwidth budgets for serve_site (token buckets).
+
+    Each app_id has a request bucket (SITE_RATE_LIMIT per second, bursts
+    up to SITE_RATE_BURST) and a byte bucket (SITE_BANDWIDTH bytes per
+    second, SITE_BANDWIDTH_BURST). A response is only refused while the
+    byte bucket is in debt, so files larger than the burst still go out -
+    they just push the site into debt for the following requests.
+
+    RATE_LIMIT_BACKEND = 'memory' keeps buckets per process; 'sqlite'
+    shares them between the workers of one host through RATE_LIMIT_DB.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+        self.rate = 50
+        self.burst = 100
+        self.bandwidth = 10 * 1024 * 1024
+        self.bandwidth_burst = 50 * 1024 * 1024
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.rate = app.config.get('SITE_RATE_LIMIT', self.rate)
+        self.burst = app.config.get('SITE_RATE_BURST', self.burst)
+        self.bandwidth = app.config.get('SITE_BANDWIDTH', self.bandwidth)
+        self.bandwidth_burst = app.config.get('SITE_BANDWIDTH_BURST', self.bandwidth_burst)
+        if app.config.get('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+            self.backend = SQLiteBackend(app.config['RATE_LIMIT_DB'])
+        else:
+            self.backend = MemoryBackend()
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, app_id):
+        """Count one request; return None if allowed, else seconds to wait."""
+        if not self.enabled:
+            return None
+        if self.bandwidth > 0:
+            allowed, retry_after = self.backend.take(f'b:{app_id}', self.bandwidth,
+                                                     self.bandwidth_burst, 0)
+            if not allowed:
+                return max(1, math.ceil(retry_after))
+        if self.rate > 0:
+            allowed, retry_after = self.backend.take(f'r:{app_id}', self.rate, self.burst, 1)
+            if not allowed:
+                return max(1, math.ceil(retry_after))
+        return None
+
+    def charge(self, app_id, nbytes):
+        """Take ``nbytes`` from the site's byte budget (may go into debt)."""
+        if self.enabled and self.bandwidth > 0 and nbytes:
+            self.backend.take(f'b:{app_id}', self.bandwidth, self.bandwidth_burst, nbytes, allow_debt=True)
+
+    def usage(self, app_id):
+        """Tokens left in the site's buckets right now."""
+        return {
+            'requests': self.backend.peek(f'r:{app_id}', self.rate, self.burst),
+            'bytes': self.backend.peek(f'b:{app_id}', self.bandwidth, self.bandwidth_burst),
+        }
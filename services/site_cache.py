@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# То, что нужно serve_site, чтобы отдать файл без похода в БД
+SiteRoot = namedtuple('SiteRoot', ['path', 'app_name', 'cache_policy', 'fingerprint'])
+
+
+class SiteCache:
+    """In-process app_id -> SiteRoot cache with LRU eviction and a TTL.
+
+    Each worker has its own; ``invalidate`` only clears this one, so the
+    others may serve old site settings for up to ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_size = app.config.get('SITE_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('SITE_CACHE_TTL', self.ttl)
+        app.extensions['site_cache'] = self
+
+    def get(self, app_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(app_id)
+            if item is None or item[1] < now:
+                if item is not None:
+                    del self._entries[app_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(app_id)
+            self.hits += 1
+            return item[0]
+
+    def set(self, app_id, entry):
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[app_id] = (entry, expires)
+            self._entries.move_to_end(app_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, app_id):
+        with self._lock:
+            self._entries.pop(app_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
@@ -0,0 +1,440 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import stat
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+
+# штамп переписывается заново, когда дорастает до этого размера
+STAMP_ROTATE_SIZE = 4096
+
+# Метаданные файла сайта, достаточные для ответа 304 без открытия файла
+FileMeta = namedtuple('FileMeta', ['path', 'size', 'mtime', 'etag', 'mimetype', 'sha256'])
+
+
+def make_etag(st):
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+def normalize(filename):
+    """Site-relative posix path, or None if it escapes the site root."""
+    filename = filename.replace('\\', '/').strip('/')
+    if not filename:
+        return ''
+    path = posixpath.normpath(filename)
+    if path == '.':
+        return ''
+    if path == '..' or path.startswith('../') or path.startswith('/'):
+        return None
+    return path
+
+
+def is_hidden(rel):
+    return any(part.startswith('.') for part in rel.split('/'))
+
+
+def file_meta(abs_path, rel, st):
+    return FileMeta(
+        path=abs_path,
+        size=st.st_size,
+        mtime=st.st_mtime,
+        etag=make_etag(st),
+        mimetype=mimetypes.guess_type(rel)[0] or 'application/octet-stream',
+        sha256=None,
+    )
+
+
+class _Site:
+    """Index of one site: every file and directory, keyed by relative path."""
+
+    def __init__(self, root, stamp=None):
+        self.root = root
+        # штамп сайта на момент обхода (см. SiteIndex._stamp)
+        self.stamp = stamp
+        self.files = {}
+        # папка -> имена непосредственных потомков ('' - корень)
+        self.children = {'': set()}
+        self.total_size = 0
+        self.built_at = time.monotonic()
+
+    def _link(self, rel):
+        parent, name = posixpath.split(rel)
+        if parent not in self.children:
+            self.add_dir(parent)
+        self.children[parent].add(name)
+
+    def add_dir(self, rel):
+        if rel and rel not in self.children:
+            self.children[rel] = set()
+            self._link(rel)
+
+    def add_file(self, rel, meta):
+        old = self.files.get(rel)
+        if old is not None:
+            self.total_size -= old.size
+        self.files[rel] = meta
+        self.total_size += meta.size
+        self._link(rel)
+
+    def remove(self, rel):
+        if rel in self.files:
+            self.total_size -= self.files.pop(rel).size
+        elif rel in self.children:
+            for name in list(self.children[rel]):
+                self.remove(posixpath.join(rel, name))
+            del self.children[rel]
+        else:
+            return
+        parent, name = posixpath.split(rel)
+        self.children.get(parent, set()).discard(name)
+
+    def scan(self, rel=''):
+        base = os.path.join(self.root, rel) if rel else self.root
+        try:
+            it = os.scandir(base)
+        except OSError:
+            return
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue  # скрытые и временные (.name.part) файлы не индексируем
+                child = posixpath.join(rel, entry.name) if rel else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        self.add_dir(child)
+                        self.scan(child)
+                    elif entry.is_file():
+                        self.add_file(child, file_meta(entry.path, child, entry.stat()))
+                except OSError:
+                    continue
+
+    def size_under(self, rel):
+        if rel in self.files:
+            return self.files[rel].size
+        prefix = rel + '/' if rel else ''
+        return sum(meta.size for path, meta in self.files.items() if path.startswith(prefix))
+
+
+class _Build:
+    """A scan in progress; other threads that missed the same site wait for it."""
+
+    def __init__(self, root):
+        self.root = root
+        self.site = None
+        self.done = threading.Event()
+
+
+class SiteIndex:
+    """Per-site index of file metadata (size, mtime, ETag, mimetype, hash).
+
+    A site is walked once, on first use; after that the mutating routes keep
+    it current through ``record``/``remove``/``invalidate``. Every worker has
+    its own index, so each of those calls also appends a byte to the site's
+    stamp file (``UPLOAD_FOLDER/ab/.<app_id>.stamp``); readers stat it and
+    re-walk the site when another process has changed it since. A name that
+    is missing from the index is checked on disk before it is reported
+    missing.
+
+    A site indexed more than SITE_INDEX_TTL seconds ago is re-walked on
+    next use to pick up out-of-band changes, unless the inotify watcher is
+    running (SITE_INDEX_WATCH), in which case changes are applied as they
+    happen.
+    """
+
+    def __init__(self, ttl=300, max_sites=1000):
+        self.ttl = ttl
+        self.max_sites = max_sites
+        self.folder = None
+        self.watcher = None
+        self._sites = OrderedDict()
+        # app_id -> _Build: обход, который уже идёт
+        self._building = {}
+        self._lock = threading.RLock()
+        # промах - сайт пришлось обходить на диске
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SITE_INDEX_TTL', self.ttl)
+        self.max_sites = app.config.get('SITE_INDEX_MAX_SITES', self.max_sites)
+        self.folder = app.config['UPLOAD_FOLDER']
+        if app.config.get('SITE_INDEX_WATCH') and self.watcher is None:
+            from services.site_watcher import SiteWatcher
+            self.watcher = SiteWatcher.create(self)
+            if self.watcher is None:
+                app.logger.warning('SITE_INDEX_WATCH is on, but inotify is not available')
+        app.extensions['site_index'] = self
+
+    # -------------------------
+    # штамп: изменения в других процессах
+    # -------------------------
+    def _stamp_path(self, app_id):
+        return os.path.join(self.folder, app_id[:2], f'.{app_id}.stamp')
+
+    def _stamp(self, app_id):
+        """``(inode, size)`` of the stamp file, None if the site has none."""
+        if self.folder is None:
+            return None
+        try:
+            st = os.stat(self._stamp_path(app_id))
+        except OSError:
+            return None
+        return st.st_ino, st.st_size
+
+    @staticmethod
+    def _stamp_current(site, stamp):
+        # в пределах одного inode размер только растёт: меньший размер - мы
+        # прочитали штамп раньше, чем этот процесс сам его сдвинул
+        if stamp is None or site.stamp is None:
+            return stamp == site.stamp
+        return stamp[0] == site.stamp[0] and stamp[1] <= site.stamp[1]
+
+    def _bump(self, app_id):
+        """Mark the site changed for every process; returns the new stamp or None."""
+        # вызывать под self._lock
+        if self.folder is None:
+            return None
+        path = self._stamp_path(app_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # дозапись в O_APPEND атомарна, так что сдвиги разных воркеров не теряются
+            with open(path, 'ab') as f:
+                f.write(b'.')
+                f.flush()
+                st = os.fstat(f.fileno())
+            if st.st_size < STAMP_ROTATE_SIZE:
+                return st.st_ino, st.st_size
+            tmp = f'{path}.{uuid.uuid4().hex[:8]}'
+            open(tmp, 'wb').close()
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        return None
+
+    def _bump_site(self, app_id, site):
+        # свои изменения уже в индексе: сдвигаем и его штамп, если других не было
+        stamp = self._bump(app_id)
+        if site is None or stamp is None:
+            return
+        previous = None if stamp[1] == 1 else (stamp[0], stamp[1] - 1)
+        if site.stamp == previous:
+            site.stamp = stamp
+
+    # -------------------------
+    # доступ к сайту
+    # -------------------------
+    def _fresh(self, app_id, root, stamp):
+        # вызывать под self._lock
+        site = self._sites.get(app_id)
+        if site is None or site.root != root or not self._stamp_current(site, stamp):
+            return None
+        if self.watcher is None and self.ttl > 0 and time.monotonic() - site.built_at > self.ttl:
+            return None
+        return site
+
+    def _site(self, app_id, root):
+        """Index of the site, scanned from disk when missing, changed or expired.
+
+        The walk runs outside ``self._lock``, so a large site being
+        rescanned does not hold up lookups in other sites; concurrent misses
+        for one site wait for a single scan. Callers read the returned site
+        under ``self._lock``.
+        """
+        stamp = self._stamp(app_id)
+        with self._lock:
+            site = self._fresh(app_id, root, stamp)
+            if site is not None:
+                self.hits += 1
+                self._sites.move_to_end(app_id)
+                return site
+            build = self._building.get(app_id)
+            owner = build is None or build.root != root
+            if owner:
+                self.misses += 1
+                build = self._building[app_id] = _Build(root)
+        if not owner:
+            build.done.wait()
+            return build.site
+
+        # штамп берём до обхода: изменение во время обхода даст новый обход
+        site = _Site(root, stamp)
+        try:
+            site.scan()
+        finally:
+            build.site = site
+            with self._lock:
+                # пока обходили, сайт могли изменить или забыть - тогда не сохраняем
+                if self._building.get(app_id) is build:
+                    del self._building[app_id]
+                    self._sites[app_id] = site
+                    self._sites.move_to_end(app_id)
+                    if self.watcher is not None:
+                        self.watcher.watch(app_id, site)
+                    while len(self._sites) > self.max_sites:
+                        evicted, _ = self._sites.popitem(last=False)
+                        if self.watcher is not None:
+                            self.watcher.unwatch(evicted)
+            build.done.set()
+        return site
+
+    def stamp(self, app_id):
+        """Stamp the cached index of the site was last checked against."""
+        with self._lock:
+            site = self._sites.get(app_id)
+            return site.stamp if site is not None else None
+
+    def lookup(self, app_id, root, filename):
+        """Return FileMeta for ``filename`` inside ``root`` or None if missing."""
+        rel = normalize(filename)
+        if not rel:
+            return None
+        site = self._site(app_id, root)
+        with self._lock:
+            meta = site.files.get(rel)
+        if meta is not None or is_hidden(rel):
+            return meta
+        # файл мог появиться в обход приложения - проверяем диск до 404
+        abs_path = os.path.join(root, *rel.split('/'))
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        meta = file_meta(abs_path, rel, st)
+        with self._lock:
+            if self._sites.get(app_id) is site:
+                site.add_file(rel, meta)
+        return meta
+
+    def content_hash(self, app_id, root, filename):
+        """SHA-256 of a file, computed on first request and kept in the index."""
+        meta = self.lookup(app_id, root, filename)
+        if meta is None:
+            return None
+        if meta.sha256 is None:
+            digest = hashlib.sha256()
+            with open(meta.path, 'rb') as f:
+                for block in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(block)
+            meta = meta._replace(sha256=digest.hexdigest())
+            rel = normalize(filename)
+            site = self._site(app_id, root)
+            with self._lock:
+                current = site.files.get(rel)
+                # файл могли заменить, пока считали хэш
+                if current is not None and current.etag == meta.etag:
+                    site.files[rel] = meta
+        return meta.sha256
+
+    def listing(self, app_id, root, directory=''):
+        """Sorted list of (name, FileMeta or None for directories), or None."""
+        rel = normalize(directory)
+        if rel is None:
+            return None
+        site = self._site(app_id, root)
+        with self._lock:
+            if rel not in site.children:
+                return None
+            result = []
+            for name in sorted(site.children[rel]):
+                child = posixpath.join(rel, name) if rel else name
+                result.append((name, site.files.get(child)))
+            return result
+
+    def iter_files(self, app_id, root):
+        """Snapshot of (absolute path, relative path) for every file, sorted."""
+        site = self._site(app_id, root)
+        with self._lock:
+            return [(site.files[rel].path, rel) for rel in sorted(site.files)]
+
+    def size_under(self, app_id, root, directory=''):
+        rel = normalize(directory)
+        if rel is None:
+            return 0
+        site = self._site(app_id, root)
+        with self._lock:
+            return site.size_under(rel)
+
+    # -------------------------
+    # изменения
+    # -------------------------
+    def record(self, app_id, filename, sha256=None):
+        """Re-read one file or directory from disk after it was written.
+
+        ``sha256`` may be passed when the caller already hashed the file.
+        """
+        rel = normalize(filename)
+        with self._lock:
+            # идущий обход мог уже пройти мимо этого файла
+            self._building.pop(app_id, None)
+            site = self._sites.get(app_id)
+            if site is not None and rel and not posixpath.basename(rel).startswith('.'):
+                self._record(app_id, site, rel, sha256)
+            self._bump_site(app_id, site)
+
+    def _record(self, app_id, site, rel, sha256):
+        # вызывать под self._lock
+        abs_path = os.path.join(site.root, rel)
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            site.remove(rel)
+            return
+        if stat.S_ISDIR(st.st_mode):
+            site.remove(rel)
+            site.add_dir(rel)
+            site.scan(rel)
+            if self.watcher is not None:
+                self.watcher.watch_dir(app_id, site, rel)
+        else:
+            site.add_file(rel, file_meta(abs_path, rel, st)._replace(sha256=sha256))
+
+    def remove(self, app_id, filename):
+        rel = normalize(filename)
+        if not rel:
+            # корень сайта (или мусор) - проще забыть сайт целиком
+            return self.invalidate(app_id)
+        with self._lock:
+            self._building.pop(app_id, None)
+            site = self._sites.get(app_id)
+            if site is not None:
+                site.remove(rel)
+            self._bump_site(app_id, site)
+
+    def invalidate(self, app_id):
+        """Forget the site here and make every other process re-walk it."""
+        with self._lock:
+            self._drop(app_id)
+            self._bump(app_id)
+
+    def forget(self, app_id):
+        """Forget a deleted site everywhere, stamp file included."""
+        with self._lock:
+            self._drop(app_id)
+            if self.folder is not None:
+                try:
+                    # нет штампа - другой штамп: остальные процессы обойдут сайт заново
+                    os.remove(self._stamp_path(app_id))
+                except OSError:
+                    pass
+
+    def _drop(self, app_id):
+        # вызывать под self._lock
+        self._sites.pop(app_id, None)
+        self._building.pop(app_id, None)
+        if self.watcher is not None:
+            self.watcher.unwatch(app_id)
+
+    def clear(self):
+        with self._lock:
+            for app_id in list(self._sites):
+                self._drop(app_id)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._sites)}
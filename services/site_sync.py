@@ -0,0 +1,301 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import click
+
+from extensions import db, site_storage, site_index, site_cache, file_cache, compressor
+from models import UserApp, SiteFile
+from services.blobstore import blob_store, file_digest
+from services.fingerprint import asset_publisher
+from services.jobs import job_runner
+from services.site_index import normalize
+from services.storage import StorageError
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+
+class SiteSync:
+    """Keeps this node's copy of every site in step with the shared manifest.
+
+    Only does anything when the storage backend is shared. Each change to
+    a site bumps ``user_app.revision``; a node compares it with the
+    revision its local copy was built from (kept in ``.<app_id>.sync`` next
+    to the site folder) and, when they differ, applies the difference of
+    the ``site_file`` manifests: missing bodies are read through BLOB_FOLDER
+    (the local cache tier) from the backend and linked into the site,
+    removed files are deleted. Files the node wrote itself already match
+    and are only recorded.
+
+    The routes call ``ensure`` with the app they loaded; serve_site calls
+    ``check``, which asks the database at most every STORAGE_SYNC_INTERVAL
+    seconds per site.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 2
+        self._synced = {}
+        self._checked = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('STORAGE_SYNC_INTERVAL', self.interval)
+        app.extensions['site_sync'] = self
+
+        @app.cli.command('storage-migrate')
+        def storage_migrate_command():
+            """Move sites to the sharded layout and upload their files to the storage backend."""
+            for app_obj in UserApp.query.order_by(UserApp.id).all():
+                moved, uploaded = self.migrate(app_obj)
+                if moved or uploaded:
+                    click.echo(f'{app_obj.app_id}: {"moved, " if moved else ""}{uploaded} files uploaded')
+
+    @property
+    def enabled(self):
+        return site_storage.shared
+
+    # -------------------------
+    # состояние копии на этом узле
+    # -------------------------
+    def _load(self, app_id):
+        try:
+            with open(site_storage.state_path(app_id), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {'revision': -1, 'files': {}}
+        self._synced[app_id] = state['revision']
+        return state
+
+    def _save(self, app_id, revision, files):
+        path = site_storage.state_path(app_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex[:8]}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'revision': revision, 'files': files}, f)
+        os.replace(tmp, path)
+        self._synced[app_id] = revision
+
+    def _revision(self, app_id):
+        revision = self._synced.get(app_id)
+        return self._load(app_id)['revision'] if revision is None else revision
+
+    def _app_lock(self, app_id):
+        with self._lock:
+            return self._locks.setdefault(app_id, threading.Lock())
+
+    # -------------------------
+    # сверка
+    # -------------------------
+    def check(self, app_id):
+        """Cheap check for serve_site; syncs the site if another node changed it."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._checked.get(app_id, 0) < self.interval:
+            return
+        self._checked[app_id] = now
+        revision = db.session.query(UserApp.revision).filter_by(app_id=app_id).scalar()
+        if revision is None:
+            if self._revision(app_id) != -1:
+                # сайт удалили на другом узле
+                self._drop_local(app_id)
+            else:
+                # несуществующий id: не копим его в памяти
+                self._synced.pop(app_id, None)
+                self._checked.pop(app_id, None)
+        elif revision != self._revision(app_id):
+            self.ensure(UserApp.query.filter_by(app_id=app_id).first())
+
+    def ensure(self, app_obj):
+        """Bring the local copy of ``app_obj`` up to its revision."""
+        if not self.enabled or app_obj is None or app_obj.revision == self._revision(app_obj.app_id):
+            return
+        app_id = app_obj.app_id
+        state_path = site_storage.state_path(app_id)
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with self._app_lock(app_id):
+            lock_file = open(state_path + '.lock', 'a') if fcntl else None
+            try:
+                if lock_file is not None:
+                    # другие воркеры этого узла синхронизируют ту же папку
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                state = self._load(app_id)
+                if state['revision'] == app_obj.revision:
+                    return
+                revision = app_obj.revision
+                rows = dict(db.session.query(SiteFile.path, SiteFile.digest).filter_by(app_id=app_id))
+                changed, removed = self._apply(app_obj.path, state['files'], rows)
+                self._save(app_id, revision, rows)
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+        if changed or removed:
+            self.app.logger.info('synced %s to revision %s: %s fetched, %s removed',
+                                 app_id, revision, len(changed), len(removed))
+            site_cache.invalidate(app_id)
+            site_index.invalidate(app_id)
+            file_cache.invalidate(app_id)
+            for rel in removed:
+                compressor.discard(app_id, rel)
+            compressor.schedule(app_id, app_obj.path, changed)
+            asset_publisher.site_changed(app_obj)
+
+    def _apply(self, root, known, rows):
+        """Make ``root`` match the manifest ``rows``; return (fetched, removed)."""
+        os.makedirs(root, exist_ok=True)
+        fetched, removed = [], []
+        for rel, digest in rows.items():
+            if normalize(rel) != rel or not rel:
+                continue
+            dst = os.path.join(root, *rel.split('/'))
+            if known.get(rel) == digest and os.path.isfile(dst):
+                self.hits += 1
+                continue
+            if self._matches(dst, digest):
+                self.hits += 1
+                continue
+            self._fetch(digest, dst)
+            fetched.append(rel)
+        for rel in set(known) - set(rows):
+            if normalize(rel) != rel or not rel:
+                continue
+            try:
+                os.remove(os.path.join(root, *rel.split('/')))
+            except (FileNotFoundError, IsADirectoryError):
+                continue
+            removed.append(rel)
+            self._prune_dirs(root, rel)
+        return fetched, removed
+
+    def _matches(self, path, digest):
+        """Whether the local file already has this body (usually: this node wrote it)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        try:
+            blob = os.stat(blob_store.blob_path(digest))
+            if (st.st_dev, st.st_ino) == (blob.st_dev, blob.st_ino):
+                return True
+        except OSError:
+            pass
+        return file_digest(path) == digest
+
+    def _download(self, digest, dst):
+        tmp = f'{dst}.{uuid.uuid4().hex[:8]}.part'
+        try:
+            site_storage.backend.fetch(digest, tmp)
+            if file_digest(tmp) != digest:
+                raise StorageError(f'blob {digest} is corrupt in the storage backend')
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.misses += 1
+
+    def _fetch(self, digest, dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if not blob_store.enabled:
+            # без дедупликации - сразу в папку сайта
+            return self._download(digest, dst)
+        blob = blob_store.blob_path(digest)
+        tmp = os.path.join(os.path.dirname(dst), f'.{uuid.uuid4().hex}.link')
+        for _ in range(2):
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                self._download(digest, blob)
+            try:
+                os.link(blob, tmp)
+                break
+            except FileNotFoundError:
+                continue  # кэш почистили между проверками - качаем ещё раз
+        else:
+            raise StorageError(f'blob {digest} could not be linked into the site')
+        os.replace(tmp, dst)
+
+    @staticmethod
+    def _prune_dirs(root, rel):
+        parent = os.path.dirname(rel.replace('/', os.sep))
+        while parent:
+            try:
+                os.rmdir(os.path.join(root, parent))
+            except OSError:
+                return
+            parent = os.path.dirname(parent)
+
+    # -------------------------
+    # удаление и перенос
+    # -------------------------
+    def forget(self, app_id):
+        """Drop this node's sync state for a deleted site."""
+        self._synced.pop(app_id, None)
+        self._checked.pop(app_id, None)
+        for path in (site_storage.state_path(app_id), site_storage.state_path(app_id) + '.lock'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _drop_local(self, app_id):
+        root = site_storage.local_path(site_storage.site_key(app_id))
+        if os.path.isdir(root):
+            job_runner.trash(root, app_id=app_id)
+        site_cache.invalidate(app_id)
+        site_index.forget(app_id)
+        file_cache.invalidate(app_id)
+        compressor.discard(app_id)
+        asset_publisher.discard(app_id)
+        self.forget(app_id)
+
+    def migrate(self, app_obj):
+        """Move a site to the sharded layout and put all its files in the backend.
+
+        Returns ``(moved, uploaded)``.
+        """
+        app_id = app_obj.app_id
+        moved = False
+        key = site_storage.site_key(app_id)
+        if app_obj.storage_key != key:
+            old, new = app_obj.path, site_storage.local_path(key)
+            if os.path.isdir(old) and not os.path.exists(new):
+                os.makedirs(os.path.dirname(new), exist_ok=True)
+                os.rename(old, new)
+            app_obj.storage_key = key
+            db.session.commit()
+            site_cache.invalidate(app_id)
+            site_index.invalidate(app_id)
+            moved = True
+
+        uploaded = 0
+        if blob_store.tracked:
+            rows = dict(db.session.query(SiteFile.path, SiteFile.digest).filter_by(app_id=app_id))
+            for path, rel in site_index.iter_files(app_id, app_obj.path):
+                if rel not in rows:
+                    rows[rel] = blob_store.adopt(app_id, rel, path)
+                    uploaded += 1
+                elif site_storage.shared and not site_storage.backend.exists(rows[rel]):
+                    site_storage.backend.put(rows[rel], path)
+                    uploaded += 1
+            if site_storage.shared:
+                db.session.refresh(app_obj)
+                self._save(app_id, app_obj.revision, rows)
+        return moved, uploaded
+
+    def stats(self):
+        # попадания: файл уже был на узле; промахи: тело скачано из хранилища
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._synced)}
+
+
+site_sync = SiteSync()
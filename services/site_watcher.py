@@ -0,0 +1,79 @@
+import posixpath
+import threading
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # inotify_simple необязателен и есть только на Linux
+    INotify = None
+
+
+class SiteWatcher:
+    """Feeds out-of-band file changes in indexed sites back into a SiteIndex.
+
+    Every directory of every indexed site gets an inotify watch; each event
+    makes the index re-read the affected path. On queue overflow the whole
+    index is dropped and rebuilt lazily.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._inotify = INotify()
+        self._mask = (flags.CREATE | flags.DELETE | flags.MODIFY | flags.CLOSE_WRITE |
+                      flags.MOVED_FROM | flags.MOVED_TO | flags.ATTRIB)
+        self._wds = {}      # wd -> (app_id, папка)
+        self._by_app = {}   # app_id -> {wd}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='site-watcher', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def create(cls, index):
+        if INotify is None:
+            return None
+        try:
+            return cls(index)
+        except OSError:
+            return None
+
+    def watch(self, app_id, site):
+        self.unwatch(app_id)
+        self.watch_dir(app_id, site, '')
+
+    def watch_dir(self, app_id, site, rel):
+        prefix = rel + '/' if rel else ''
+        for directory in list(site.children):
+            if directory == rel or directory.startswith(prefix):
+                path = posixpath.join(site.root, directory) if directory else site.root
+                try:
+                    wd = self._inotify.add_watch(path, self._mask)
+                except OSError:
+                    continue
+                with self._lock:
+                    self._wds[wd] = (app_id, directory)
+                    self._by_app.setdefault(app_id, set()).add(wd)
+
+    def unwatch(self, app_id):
+        with self._lock:
+            wds = self._by_app.pop(app_id, set())
+            for wd in wds:
+                self._wds.pop(wd, None)
+        for wd in wds:
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError:
+                pass
+
+    def _run(self):
+        while True:
+            for event in self._inotify.read():
+                if event.mask & flags.Q_OVERFLOW:
+                    self.index.clear()
+                    continue
+                with self._lock:
+                    target = self._wds.get(event.wd)
+                    if event.mask & flags.IGNORED:
+                        self._wds.pop(event.wd, None)
+                if target is None or not event.name:
+                    continue
+                app_id, directory = target
+                self.index.record(app_id, posixpath.join(directory, event.name))
@@ -0,0 +1,175 @@
+import os
+import shutil
+import time
+import uuid
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 нужен только для STORAGE_BACKEND=s3
+    boto3 = None
+
+
+def shard_path(folder, digest):
+    # ab/cd/<sha256>, как в BLOB_FOLDER: не больше 256 записей на уровень
+    return os.path.join(folder, digest[:2], digest[2:4], digest)
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalBackend:
+    """File bodies in a folder, by SHA-256: one node's disk or a shared mount (NFS)."""
+
+    name = 'local'
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, digest):
+        return shard_path(self.folder, digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, digest, src):
+        dst = self.path(digest)
+        if os.path.exists(dst):
+            return
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f'{dst}.{uuid.uuid4().hex[:8]}.part'
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def fetch(self, digest, dst):
+        try:
+            shutil.copyfile(self.path(digest), dst)
+        except FileNotFoundError:
+            raise StorageError(f'blob {digest} is missing from {self.folder}')
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def digests(self):
+        """Yield ``(digest, mtime)`` for every stored body."""
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                if len(name) == 64:
+                    try:
+                        yield name, os.stat(os.path.join(dirpath, name)).st_mtime
+                    except OSError:
+                        pass
+
+
+class S3Backend:
+    """File bodies in an S3-compatible bucket (AWS S3, MinIO, Ceph...), by SHA-256."""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None):
+        if boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND=s3 needs the boto3 package')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+
+    def key(self, digest):
+        return f'{self.prefix}{digest[:2]}/{digest[2:4]}/{digest}'
+
+    def exists(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put(self, digest, src):
+        # ключ - хэш содержимого, так что уже загруженное не перезаливаем
+        if not self.exists(digest):
+            self.client.upload_file(src, self.bucket, self.key(digest))
+
+    def fetch(self, digest, dst):
+        try:
+            self.client.download_file(self.bucket, self.key(digest), dst)
+        except ClientError as e:
+            raise StorageError(f'blob {digest} could not be fetched: {e}')
+
+    def delete(self, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+    def digests(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', ()):
+                yield item['Key'].rsplit('/', 1)[-1], item['LastModified'].timestamp()
+
+
+def make_backend(config):
+    kind = config.get('STORAGE_BACKEND', 'local')
+    if kind == 'local':
+        return LocalBackend(config.get('STORAGE_FOLDER') or config['BLOB_FOLDER'])
+    if kind == 's3':
+        return S3Backend(config['S3_BUCKET'], config.get('S3_PREFIX', ''),
+                         config.get('S3_ENDPOINT_URL'), config.get('S3_REGION'))
+    raise RuntimeError(f'Unknown STORAGE_BACKEND {kind!r}')
+
+
+class SiteStorage:
+    """Where site content lives: the local layout and the shared backend.
+
+    Every node serves sites from its own disk, ``UPLOAD_FOLDER/ab/<app_id>``
+    (sharded by the first two characters of the id). ``UserApp.storage_key``
+    (the ``path`` column) is relative to UPLOAD_FOLDER, so the same row
+    works on any node; absolute paths of sites created before sharding
+    still resolve.
+
+    The backend holds the bodies of all site files by SHA-256. With the
+    default, a local backend in BLOB_FOLDER, it is this node's blob store
+    and nothing is copied - the single-node setup. Any other backend is
+    ``shared``: uploads are written through to it, and other nodes pull
+    what they are missing (services/site_sync.py).
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.backend = None
+        self.shared = False
+
+    def init_app(self, app):
+        self.folder = app.config['UPLOAD_FOLDER']
+        self.backend = make_backend(app.config)
+        self.shared = not (isinstance(self.backend, LocalBackend)
+                           and os.path.abspath(self.backend.folder) == os.path.abspath(app.config['BLOB_FOLDER']))
+        app.extensions['site_storage'] = self
+
+    def site_key(self, app_id):
+        return f'{app_id[:2]}/{app_id}'
+
+    def local_path(self, key):
+        return key if os.path.isabs(key) else os.path.join(self.folder, key)
+
+    def state_path(self, app_id):
+        """This node's record of the synced manifest, next to the site folder."""
+        return os.path.join(self.folder, app_id[:2], f'.{app_id}.sync')
+
+    def collect_garbage(self, referenced, min_age=3600):
+        """Delete backend bodies no manifest row uses; skip recent ones (uploads in flight)."""
+        removed = 0
+        cutoff = time.time() - min_age
+        for digest, mtime in list(self.backend.digests()):
+            if digest not in referenced and mtime < cutoff:
+                self.backend.delete(digest)
+                removed += 1
+        return removed
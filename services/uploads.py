@@ -0,0 +1,221 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+CHUNK_READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Upload API error; ``status`` becomes the HTTP status of the response."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+class UploadStore:
+    """Resumable chunked uploads spooled to ``UPLOAD_TMP_FOLDER``.
+
+    Every upload is a ``<id>.json`` description plus a ``<id>.part`` data
+    file. The size of the ``.part`` file is the resume offset, so a client
+    that lost its connection asks for the offset and continues from there.
+
+    Chunks of one upload may reach different workers, so writes and
+    completion hold a flock on the ``.part`` file, not just a thread lock.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.ttl = 24 * 3600
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def init_app(self, app):
+        self.folder = app.config['UPLOAD_TMP_FOLDER']
+        self.ttl = app.config.get('UPLOAD_SESSION_TTL', self.ttl)
+        os.makedirs(self.folder, exist_ok=True)
+        app.extensions['upload_store'] = self
+
+    def _path(self, upload_id, ext):
+        return os.path.join(self.folder, f'{upload_id}.{ext}')
+
+    def _lock(self, upload_id):
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """Open the part file with the upload locked in this process and on disk."""
+        part_path = self._path(upload_id, 'part')
+        with self._lock(upload_id):
+            try:
+                f = open(part_path, 'r+b')
+            except FileNotFoundError:
+                raise UploadError('Upload not found', 404)
+            with f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # пока ждали, другой воркер мог завершить загрузку
+                    try:
+                        same = os.stat(part_path).st_ino == os.fstat(f.fileno()).st_ino
+                    except FileNotFoundError:
+                        same = False
+                    if not same:
+                        raise UploadError('Upload not found', 404)
+                yield f
+
+    # -------------------------
+    # сессии
+    # -------------------------
+    def create(self, user_id, app_id, target, size, sha256=None):
+        self.expire()
+        upload = {
+            'upload_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'app_id': app_id,
+            'target': target,
+            'size': size,
+            'sha256': sha256,
+            'created_at': time.time(),
+        }
+        open(self._path(upload['upload_id'], 'part'), 'wb').close()
+        with open(self._path(upload['upload_id'], 'json'), 'w', encoding='utf-8') as f:
+            json.dump(upload, f)
+        upload['offset'] = 0
+        return upload
+
+    def load(self, upload_id):
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._path(upload_id, 'json'), encoding='utf-8') as f:
+                upload = json.load(f)
+            upload['offset'] = os.path.getsize(self._path(upload_id, 'part'))
+        except (OSError, ValueError):
+            return None
+        return upload
+
+    def discard(self, upload_id):
+        for ext in ('part', 'json'):
+            try:
+                os.remove(self._path(upload_id, ext))
+            except OSError:
+                pass
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def expire(self):
+        """Remove uploads that were started more than ``ttl`` seconds ago."""
+        deadline = time.time() - self.ttl
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                upload_id = name[:-5]
+                upload = self.load(upload_id)
+                if upload is None or upload['created_at'] < deadline:
+                    self.discard(upload_id)
+
+    # -------------------------
+    # данные
+    # -------------------------
+    def write_chunk(self, upload, offset, stream, budget, checksum=None):
+        """Append one chunk read from ``stream`` at ``offset``.
+
+        ``budget`` is how many bytes the whole file may take before the
+        app goes over quota; the chunk is rejected the moment it crosses it.
+        ``checksum`` is an optional hex SHA-256 of the chunk. On any error
+        the part file is cut back to ``offset``, so the chunk can be retried.
+        """
+        upload_id = upload['upload_id']
+        limit = min(upload['size'], budget)
+
+        with self._locked(upload_id) as f:
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError('Offset mismatch', 409, offset=current)
+
+            digest = hashlib.sha256()
+            written = offset
+            f.seek(offset)
+            try:
+                while True:
+                    block = stream.read(CHUNK_READ_SIZE)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > limit:
+                        if written > upload['size']:
+                            raise UploadError('Chunk goes past the declared file size', 400, offset=offset)
+                        raise UploadError('Storage limit exceeded', 413, offset=offset)
+                    digest.update(block)
+                    f.write(block)
+                if checksum and digest.hexdigest() != checksum.lower():
+                    raise UploadError('Chunk checksum mismatch', 422, offset=offset)
+            except BaseException:
+                f.truncate(offset)
+                raise
+        upload['offset'] = written
+        return upload
+
+    @staticmethod
+    def _move(part_path, dst_path):
+        try:
+            # на одной ФС это атомарный rename
+            os.replace(part_path, dst_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        # другая ФС: копируем рядом с целью и подменяем уже там
+        tmp = dst_path + '.part'
+        try:
+            shutil.copyfile(part_path, tmp)
+            os.replace(tmp, dst_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def complete(self, upload, dst_path):
+        """Verify the finished file and move it to ``dst_path``.
+
+        If the move fails the part file is kept, so ``complete`` can be retried.
+        """
+        upload_id = upload['upload_id']
+        part_path = self._path(upload_id, 'part')
+
+        with self._locked(upload_id) as f:
+            received = os.fstat(f.fileno()).st_size
+            if received != upload['size']:
+                raise UploadError('Upload is incomplete', 409, offset=received)
+
+            if upload.get('sha256'):
+                digest = hashlib.sha256()
+                for block in iter(lambda: f.read(CHUNK_READ_SIZE), b''):
+                    digest.update(block)
+                if digest.hexdigest() != upload['sha256'].lower():
+                    self.discard(upload_id)
+                    raise UploadError('File checksum mismatch', 422)
+
+            # при ошибке .part остаётся - клиент может повторить complete
+            try:
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                self._move(part_path, dst_path)
+            except (IsADirectoryError, NotADirectoryError, FileExistsError):
+                raise UploadError('A folder is in the way of the target path', 409)
+            except OSError as e:
+                raise UploadError(f'Could not save the file: {e.strerror}', 400)
+        self.discard(upload_id)
+        return received
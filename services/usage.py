@@ -0,0 +1,138 @@
+import os
+import threading
+
+import click
+
+from extensions import db, site_storage
+from models import UserApp, Blob, SiteFile
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+
+def measure(path):
+    """Bytes taken by all files under ``path`` (the slow, exact way)."""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def manifest_size(app_id):
+    """Bytes of a site by its manifest: the same answer on every node."""
+    return db.session.query(db.func.coalesce(db.func.sum(Blob.size), 0)) \
+        .join(SiteFile, SiteFile.digest == Blob.digest).filter(SiteFile.app_id == app_id).scalar()
+
+
+def add_usage(app_obj, delta):
+    """Atomically shift the stored usage of ``app_obj`` by ``delta`` bytes."""
+    if not delta:
+        return
+    new_value = UserApp.storage_used + delta
+    UserApp.query.filter_by(id=app_obj.id).update(
+        {UserApp.storage_used: db.case((new_value < 0, 0), else_=new_value)},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def reconcile(apps=None):
+    """Recount usage from disk and fix drifted counters.
+
+    With shared storage the local copy may lag behind, so the manifest is
+    counted instead.
+
+    The counter is only overwritten if it still holds the value read before
+    counting; an app whose usage ``add_usage`` changed meanwhile is left for
+    the next pass.
+
+    Returns a list of (app_id, stored, actual) for every corrected app.
+    """
+    corrected = []
+    for app_obj in apps if apps is not None else UserApp.query.all():
+        stored = db.session.query(UserApp.storage_used).filter_by(id=app_obj.id).scalar()
+        if stored is None:
+            continue
+        actual = manifest_size(app_obj.app_id) if site_storage.shared else measure(app_obj.path)
+        if actual == stored:
+            continue
+        updated = UserApp.query.filter_by(id=app_obj.id, storage_used=stored).update(
+            {UserApp.storage_used: actual}, synchronize_session=False)
+        db.session.commit()
+        if updated:
+            corrected.append((app_obj.app_id, stored, actual))
+    db.session.commit()
+    return corrected
+
+
+class UsageReconciler:
+    """Daemon thread that runs ``reconcile`` every USAGE_RECONCILE_INTERVAL seconds.
+
+    Every worker starts the thread, but only the one holding the flock on
+    ``UPLOAD_FOLDER/.usage-reconcile.lock`` does the work; the others retry
+    the lock each interval and take over when that worker exits.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock_file = None
+
+    def init_app(self, app):
+        app.extensions['usage_reconciler'] = self
+
+        @app.cli.command('reconcile-usage')
+        def reconcile_usage_command():
+            """Recount per-app storage usage from disk."""
+            for app_id, stored, actual in reconcile():
+                click.echo(f'{app_id}: {stored} -> {actual}')
+
+        interval = app.config.get('USAGE_RECONCILE_INTERVAL', 0)
+        if interval > 0 and not app.testing and self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(app, interval),
+                                            name='usage-reconciler', daemon=True)
+            self._thread.start()
+
+    def _leader(self, app):
+        """Whether this process holds the reconciler lock (takes it if free)."""
+        if fcntl is None or self._lock_file is not None:
+            return True
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        lock_file = open(os.path.join(app.config['UPLOAD_FOLDER'], '.usage-reconcile.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # держим до выхода процесса
+        self._lock_file = lock_file
+        return True
+
+    def _run(self, app, interval):
+        # первый проход сразу: заодно заполняет счётчики у старых записей
+        while True:
+            if not self._leader(app):
+                if self._stop.wait(interval):
+                    return
+                continue
+            with app.app_context():
+                try:
+                    for app_id, stored, actual in reconcile():
+                        app.logger.info('usage drift for %s: %s -> %s', app_id, stored, actual)
+                except Exception:
+                    app.logger.exception('usage reconciliation failed')
+                finally:
+                    db.session.remove()
+            if self._stop.wait(interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+
+
+usage_reconciler = UsageReconciler()
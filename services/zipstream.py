@@ -0,0 +1,67 @@
+import io
+import zipfile
+
+
+# уже сжатые форматы кладём в архив как есть
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico', '.zip',
+                     '.gz', '.br', '.7z', '.rar', '.woff', '.woff2',
+                     '.mp3', '.mp4', '.webm', '.ogg', '.pdf')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target; ZipFile falls back to data descriptors on it."""
+
+    def __init__(self):
+        self._chunks = []
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def stream_zip(files, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of ``files`` ((path, arcname) pairs) chunk by chunk.
+
+    Memory use is bounded by roughly one ``chunk_size`` buffer no matter how
+    large the archive gets; entries over 4 GB are written as ZIP64.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for path, arcname in files:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            except OSError:
+                continue  # файл удалили, пока строился архив
+            if zinfo.is_dir():
+                continue
+            if arcname.lower().endswith(STORED_EXTENSIONS):
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+
+            force_zip64 = zinfo.file_size >= zipfile.ZIP64_LIMIT
+            with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dst.write(block)
+                    if sink.pending >= chunk_size:
+                        yield sink.drain()
+            if sink.pending:
+                yield sink.drain()
+    # центральный каталог пишется при закрытии архива
+    yield sink.drain()
@@ -0,0 +1,243 @@
+// -------------------------
+// Кусочная загрузка файлов с возобновлением
+// -------------------------
+async function sha256Hex(buffer) {
+  if (!window.crypto || !crypto.subtle) return null;
+  const digest = await crypto.subtle.digest('SHA-256', buffer);
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadJson(url, method, body) {
+  const resp = await fetch(url, {
+    method: method,
+    headers: body ? { 'Content-Type': 'application/json' } : {},
+    body: body ? JSON.stringify(body) : undefined,
+    credentials: 'same-origin',
+  });
+  const data = resp.status === 204 ? {} : await resp.json();
+  if (!resp.ok) throw Object.assign(new Error(data.error || resp.statusText), { status: resp.status, data: data });
+  return data;
+}
+
+async function uploadFileInChunks(baseUrl, appId, path, file, onProgress) {
+  let state = await uploadJson(baseUrl, 'POST', { app_id: appId, path: path, filename: file.name, size: file.size });
+  const url = baseUrl + '/' + state.upload_id;
+
+  while (state.offset < file.size) {
+    const chunk = await file.slice(state.offset, state.offset + state.chunk_size).arrayBuffer();
+    const checksum = await sha256Hex(chunk);
+    try {
+      const resp = await fetch(url + '?offset=' + state.offset, {
+        method: 'PUT',
+        headers: checksum ? { 'X-Chunk-SHA256': checksum } : {},
+        body: chunk,
+        credentials: 'same-origin',
+      });
+      const data = await resp.json();
+      if (resp.status === 409) {
+        state.offset = data.offset;  // сервер знает, сколько уже принято
+        continue;
+      }
+      if (!resp.ok) throw Object.assign(new Error(data.error), { status: resp.status });
+      state = data;
+    } catch (err) {
+      if (err.status) throw err;
+      // обрыв связи: спрашиваем, докуда дошли, и продолжаем
+      await new Promise(r => setTimeout(r, 1000));
+      state = await uploadJson(url, 'GET');
+    }
+    onProgress(state.offset);
+  }
+  return uploadJson(url + '/complete', 'POST');
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('form[data-chunked-upload]').forEach(form => {
+    if (!window.fetch || !window.Blob || !Blob.prototype.arrayBuffer) return;
+
+    form.addEventListener('submit', async event => {
+      const files = Array.from(form.querySelector('input[type=file]').files);
+      if (!files.length) return;
+      event.preventDefault();
+
+      const button = form.querySelector('button[type=submit]');
+      const total = files.reduce((sum, f) => sum + f.size, 0);
+      let done = 0;
+      button.disabled = true;
+      try {
+        for (const file of files) {
+          await uploadFileInChunks(form.dataset.chunkedUpload, form.elements.app_id.value,
+                                   form.elements.path.value, file,
+                                   offset => { button.textContent = Math.floor((done + offset) * 100 / (total || 1)) + '%'; });
+          done += file.size;
+        }
+        window.location.reload();
+      } catch (err) {
+        alert('Upload failed: ' + err.message);
+        window.location.reload();
+      }
+    });
+  });
+});
+
+// -------------------------
+// Развёртывание из архива: файл уходит телом запроса, без multipart
+// -------------------------
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('form[data-deploy-archive]').forEach(form => {
+    if (!window.fetch) return;
+
+    form.addEventListener('submit', async event => {
+      const file = form.querySelector('input[type=file]').files[0];
+      if (!file) return;
+      event.preventDefault();
+      if (!confirm('Replace all files of this site with "' + file.name + '"?')) return;
+
+      const button = form.querySelector('button[type=submit]');
+      button.disabled = true;
+      try {
+        const resp = await fetch(form.action, { method: 'POST', body: file, credentials: 'same-origin' });
+        const data = await resp.json();
+        if (!resp.ok) throw new Error(data.error || resp.statusText);
+      } catch (err) {
+        alert('Deploy failed: ' + err.message);
+      }
+      window.location.reload();
+    });
+  });
+});
+
+// -------------------------
+// Дерево файлов: папки раскрываются по запросу
+// -------------------------
+function fileTreeItem(list, entry, path) {
+  const li = document.createElement('li');
+  li.className = 'file-item ' + (entry.is_dir ? 'folder' : 'file');
+  const info = document.createElement('div');
+  info.className = 'file-info';
+  const fullPath = path + entry.name;
+
+  if (entry.is_dir) {
+    const toggle = document.createElement('button');
+    toggle.type = 'button';
+    toggle.className = 'btn btn-sm tree-toggle';
+    toggle.dataset.path = fullPath + '/';
+    toggle.innerHTML = '<i class="fas fa-caret-right"></i>';
+    info.appendChild(toggle);
+  }
+  const icon = document.createElement('i');
+  icon.className = 'fas ' + (entry.is_dir ? 'fa-folder' : 'fa-file');
+  info.appendChild(icon);
+
+  const link = document.createElement('a');
+  link.className = 'file-name';
+  link.textContent = entry.name;
+  link.href = entry.is_dir
+    ? list.dataset.manageUrl + '?path=' + encodeURIComponent(fullPath + '/')
+    : list.dataset.downloadUrl.replace('__FILE__', fullPath.split('/').map(encodeURIComponent).join('/'));
+  info.appendChild(link);
+  li.appendChild(info);
+  return li;
+}
+
+async function loadFileTreeLevel(list, path, container, cursor) {
+  const params = new URLSearchParams({ path: path });
+  if (cursor) params.set('cursor', cursor);
+  const resp = await fetch(list.dataset.filesApi + '?' + params, { credentials: 'same-origin' });
+  if (!resp.ok) return;
+  const data = await resp.json();
+
+  data.entries.forEach(entry => container.appendChild(fileTreeItem(list, entry, path)));
+  if (data.next_cursor) {
+    const more = document.createElement('li');
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.className = 'btn btn-secondary btn-sm';
+    button.textContent = 'Load more';
+    button.addEventListener('click', () => {
+      more.remove();
+      loadFileTreeLevel(list, path, container, data.next_cursor);
+    });
+    more.appendChild(button);
+    container.appendChild(more);
+  }
+}
+
+document.addEventListener('click', event => {
+  const toggle = event.target.closest('.tree-toggle');
+  const list = toggle && toggle.closest('.file-list');
+  if (!list) return;
+
+  const item = toggle.closest('li');
+  const nested = item.querySelector(':scope > ul.file-items');
+  if (nested) {
+    nested.remove();
+    toggle.innerHTML = '<i class="fas fa-caret-right"></i>';
+    return;
+  }
+  const container = document.createElement('ul');
+  container.className = 'file-items nested';
+  item.appendChild(container);
+  toggle.innerHTML = '<i class="fas fa-caret-down"></i>';
+  loadFileTreeLevel(list, toggle.dataset.path, container);
+});
+
+// -------------------------
+// Фоновые задачи: ZIP собирается на сервере, страница ждёт готовности
+// -------------------------
+const JOB_LABELS = { remove_tree: 'Deleting files', export_app: 'Building ZIP' };
+
+async function waitForJob(job, onProgress) {
+  while (job.status === 'queued' || job.status === 'running') {
+    onProgress(job);
+    await new Promise(r => setTimeout(r, 1000));
+    job = await uploadJson(job.status_url, 'GET');
+  }
+  return job;
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('a[data-export-url]').forEach(link => {
+    if (!window.fetch) return;
+
+    link.addEventListener('click', async event => {
+      event.preventDefault();
+      if (link.classList.contains('disabled')) return;
+      const label = link.innerHTML;
+      link.classList.add('disabled');
+      try {
+        let job = await uploadJson(link.dataset.exportUrl, 'POST');
+        job = await waitForJob(job, j => { link.textContent = 'Preparing ZIP... ' + j.progress + '%'; });
+        if (job.status !== 'done') throw new Error(job.error || job.status);
+        window.location = job.download_url;
+      } catch (err) {
+        // запасной путь - ZIP собирается прямо в ответе
+        window.location = link.href;
+      } finally {
+        link.innerHTML = label;
+        link.classList.remove('disabled');
+      }
+    });
+  });
+
+  document.querySelectorAll('.job-list[data-jobs-api]').forEach(list => {
+    async function refresh() {
+      let jobs;
+      try {
+        jobs = await uploadJson(list.dataset.jobsApi, 'GET');
+      } catch (err) {
+        return;
+      }
+      const active = jobs.filter(j => j.status === 'queued' || j.status === 'running');
+      list.replaceChildren(...active.map(j => {
+        const li = document.createElement('li');
+        li.className = 'job-item';
+        li.textContent = (JOB_LABELS[j.kind] || j.kind) + (j.app_id ? ' (' + j.app_id + ')' : '') + ': ' + j.progress + '%';
+        return li;
+      }));
+      list.hidden = !active.length;
+      if (active.length) setTimeout(refresh, 2000);
+    }
+    if (window.fetch) refresh();
+  });
+});
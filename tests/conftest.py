@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+
+def make_config(tmp_path, **overrides):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'db.sqlite')
+        UPLOAD_FOLDER = str(tmp_path / 'user_files')
+        UPLOAD_TMP_FOLDER = str(tmp_path / 'upload_tmp')
+        BLOB_FOLDER = str(tmp_path / 'blob_store')
+        STORAGE_FOLDER = str(tmp_path / 'blob_store')
+        ASSET_CACHE_FOLDER = str(tmp_path / 'asset_cache')
+        JOB_FOLDER = str(tmp_path / 'job_results')
+        PROFILE_FOLDER = str(tmp_path / 'profiles')
+        RATE_LIMIT_DB = str(tmp_path / 'ratelimit.db')
+        BCRYPT_LOG_ROUNDS = 4
+        PASSWORD_WORKERS = 0
+        USAGE_RECONCILE_INTERVAL = 0
+        STORAGE_SYNC_INTERVAL = 0
+
+    for name, value in overrides.items():
+        setattr(TestConfig, name, value)
+    return TestConfig
+
+
+def make_app(tmp_path, **overrides):
+    """App with a logged-in client and one site; returns (app, client, app_id)."""
+    from app import create_app, init_db
+    from extensions import site_cache, site_index, file_cache
+
+    app = create_app(make_config(tmp_path, **overrides))
+    init_db(app)
+    # расширения - синглтоны модуля, прошлый тест мог их заполнить
+    site_cache.clear()
+    site_index.clear()
+    file_cache.clear()
+    client = app.test_client()
+    client.post('/register', data={'username': 'alice', 'password': 'secret1'})
+    client.post('/login', data={'username': 'alice', 'password': 'secret1'})
+    client.post('/index', data={'NewApp': 'mysite'})
+    with app.app_context():
+        app_id = first_app().app_id
+    return app, client, app_id
+
+
+def first_app():
+    from models import UserApp
+    return UserApp.query.first()
+
+
+def upload(client, app_id, path, name, body):
+    return client.post('/upload', data={'app_id': app_id, 'path': path, 'files[]': [(io.BytesIO(body), name)]},
+                       content_type='multipart/form-data')
+
+
+@pytest.fixture
+def site(tmp_path):
+    return make_app(tmp_path)
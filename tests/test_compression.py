@@ -0,0 +1,81 @@
+import gzip
+import os
+import threading
+
+from services.compression import AssetCompressor
+from services.site_index import make_etag
+
+
+def make_compressor(tmp_path):
+    compressor = AssetCompressor()
+    compressor.root = str(tmp_path / 'asset_cache')
+    compressor.min_size = 16
+    return compressor
+
+
+def test_concurrent_writes_of_one_file_never_mix(tmp_path):
+    compressor = make_compressor(tmp_path)
+    dst = str(tmp_path / 'asset_cache' / 'site' / 'style.css')
+    payloads = [(f'/* {i} */ body{{color:red}} '.encode() * 2000) for i in range(8)]
+    barrier = threading.Barrier(len(payloads))
+    errors = []
+
+    def write(data):
+        barrier.wait()
+        try:
+            for _ in range(5):
+                compressor.write_variants(dst, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(data,)) for data in payloads]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    with open(dst + '.gz', 'rb') as f:
+        assert gzip.decompress(f.read()) in payloads
+    assert [name for name in os.listdir(os.path.dirname(dst)) if name.endswith('.tmp')] == []
+
+
+def test_etag_matches_the_compressed_body(tmp_path, monkeypatch):
+    compressor = make_compressor(tmp_path)
+    root = tmp_path / 'site'
+    root.mkdir()
+    (root / 'app.js').write_bytes(b'var old = 1;' * 100)
+
+    # файл заменяют, пока компрессор до него добирается
+    def replace_then_open(path, *args, **kwargs):
+        tmp = root / 'app.js.new'
+        tmp.write_bytes(b'var new = 2;' * 200)
+        os.replace(tmp, root / 'app.js')
+        monkeypatch.undo()
+        return open(path, *args, **kwargs)
+
+    monkeypatch.setattr('services.compression.open', replace_then_open, raising=False)
+    compressor.compress('site', str(root), ['app.js'])
+
+    entry = compressor._manifest('site')['app.js']
+    with open(tmp_path / 'asset_cache' / 'site' / 'app.js.gz', 'rb') as f:
+        body = gzip.decompress(f.read())
+    assert body == b'var new = 2;' * 200
+    assert entry['etag'] == make_etag(os.stat(root / 'app.js'))
+
+
+def test_sidecar_found_for_unnormalized_urls(tmp_path):
+    from conftest import make_app, upload
+    from extensions import compressor
+
+    app, client, app_id = make_app(tmp_path)
+    css = b'body { color: red; }\n' * 200
+    upload(client, app_id, 'css/', 'site.css', css)
+    root = os.path.join(app.config['UPLOAD_FOLDER'], app_id[:2], app_id)
+    compressor.compress(app_id, root, ['css/site.css'])
+
+    for url in ('css/site.css', 'css//site.css', './css/site.css', 'css/./site.css'):
+        r = client.get(f'/sites/{app_id}/{url}', headers={'Accept-Encoding': 'gzip'})
+        assert r.status_code == 200, url
+        assert r.headers.get('Content-Encoding') == 'gzip', url
+        assert gzip.decompress(r.data) == css
@@ -0,0 +1,154 @@
+import re
+from datetime import timedelta
+
+import pytest
+from werkzeug.http import http_date, parse_date
+
+from conftest import upload
+
+
+BODY = bytes(range(256)) * 4  # 1024 байта
+
+
+@pytest.fixture
+def served(site):
+    app, client, app_id = site
+    upload(client, app_id, '', 'data.bin', BODY)
+    url = f'/sites/{app_id}/data.bin'
+    full = client.get(url)
+    assert full.status_code == 200
+    return client, url, full.headers['ETag'], full.headers['Last-Modified']
+
+
+def get_range(client, url, value, **headers):
+    return client.get(url, headers={'Range': value, **headers})
+
+
+def parse_multipart(response):
+    boundary = re.search(r'boundary=(\w+)', response.headers['Content-Type']).group(1)
+    body = response.get_data()
+    assert len(body) == response.content_length
+    assert body.endswith(f'\r\n--{boundary}--\r\n'.encode())
+    parts = []
+    for chunk in body.split(f'--{boundary}'.encode())[1:-1]:
+        head, _, data = chunk.partition(b'\r\n\r\n')
+        # после данных - CRLF перед следующим разделителем
+        assert data.endswith(b'\r\n')
+        headers = dict(line.split(': ', 1) for line in head.decode().strip().split('\r\n'))
+        parts.append((headers, data[:-2]))
+    return parts
+
+
+# -------------------------
+# разбор Range
+# -------------------------
+@pytest.mark.parametrize('value, start, stop', [
+    ('bytes=0-99', 0, 100),
+    ('bytes=1000-', 1000, 1024),        # до конца файла
+    ('bytes=-24', 1000, 1024),          # последние 24 байта
+    ('bytes=-5000', 0, 1024),           # суффикс длиннее файла
+    ('bytes=1000-5000', 1000, 1024),    # конец за пределами файла
+    ('bytes=0-9,5-19,20-29', 0, 30),    # пересекающиеся и соседние склеиваются
+    ('bytes=20-29,0-19', 0, 30),        # в любом порядке
+])
+def test_single_range(served, value, start, stop):
+    client, url, _, _ = served
+    r = get_range(client, url, value)
+    assert r.status_code == 206
+    assert r.headers['Content-Range'] == f'bytes {start}-{stop - 1}/1024'
+    assert r.content_length == stop - start
+    assert r.data == BODY[start:stop]
+
+
+def test_unsatisfiable_range(served):
+    client, url, _, _ = served
+    r = get_range(client, url, 'bytes=2000-3000')
+    assert r.status_code == 416
+    assert r.headers['Content-Range'] == 'bytes */1024'
+    assert r.data == b''
+
+
+def test_too_many_ranges_send_the_whole_file(site):
+    app, client, app_id = site
+    upload(client, app_id, '', 'data.bin', BODY)
+    limit = app.config['MAX_RANGES']
+    url = f'/sites/{app_id}/data.bin'
+    ranges = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(limit + 1))
+    r = get_range(client, url, f'bytes={ranges}')
+    assert r.status_code == 200
+    assert r.data == BODY
+
+    ranges = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(limit))
+    r = get_range(client, url, f'bytes={ranges}')
+    assert r.status_code == 206
+    assert len(parse_multipart(r)) == limit
+
+
+# -------------------------
+# multipart/byteranges
+# -------------------------
+def test_multipart_byteranges(served):
+    client, url, _, _ = served
+    r = get_range(client, url, 'bytes=500-509,0-4,-3')
+    assert r.status_code == 206
+    assert r.headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    parts = parse_multipart(r)
+    # куски идут по порядку смещения
+    assert [(h['Content-Range'], data) for h, data in parts] == [
+        ('bytes 0-4/1024', BODY[0:5]),
+        ('bytes 500-509/1024', BODY[500:510]),
+        ('bytes 1021-1023/1024', BODY[1021:1024]),
+    ]
+    assert all(h['Content-Type'] == 'application/octet-stream' for h, _ in parts)
+
+
+# -------------------------
+# If-Range
+# -------------------------
+def test_if_range_etag(served):
+    client, url, etag, _ = served
+    r = get_range(client, url, 'bytes=0-9', **{'If-Range': etag})
+    assert r.status_code == 206 and r.data == BODY[:10]
+
+    r = get_range(client, url, 'bytes=0-9', **{'If-Range': '"something-else"'})
+    assert r.status_code == 200 and r.data == BODY
+
+
+def test_if_range_weak_etag_never_matches(served):
+    client, url, etag, _ = served
+    r = get_range(client, url, 'bytes=0-9', **{'If-Range': 'W/' + etag})
+    assert r.status_code == 200 and r.data == BODY
+
+
+def test_if_range_date(served):
+    client, url, _, last_modified = served
+    r = get_range(client, url, 'bytes=0-9', **{'If-Range': last_modified})
+    assert r.status_code == 206 and r.data == BODY[:10]
+
+    earlier = http_date(parse_date(last_modified) - timedelta(seconds=10))
+    r = get_range(client, url, 'bytes=0-9', **{'If-Range': earlier})
+    assert r.status_code == 200 and r.data == BODY
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('bytes=0-0', [(0, 0)]),
+    ('bytes=5-, -10', [(5, None), (None, 10)]),
+    ('bytes=10-20,0-5', [(10, 20), (0, 5)]),
+    ('BYTES = 1-2', [(1, 2)]),
+    ('bytes=5-1', None),
+    ('bytes=-', None),
+    ('bytes=a-b', None),
+    ('items=0-1', None),
+    ('bytes=', None),
+])
+def test_parse_range(value, expected):
+    from services.delivery import parse_range
+    assert parse_range(value) == expected
+
+
+def test_invalid_range_sends_the_whole_file(served):
+    client, url, _, _ = served
+    r = get_range(client, url, 'bytes=9-3')
+    assert r.status_code == 200 and r.data == BODY
+    r = get_range(client, url, 'bytes=-0')
+    assert r.status_code == 416
@@ -0,0 +1,108 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+
+FILES = {'index.html': b'<h1>deployed</h1>', 'css/site.css': b'body{color:red}' * 100}
+
+
+def make_zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, body in files.items():
+            zf.writestr(name, body)
+    return buf.getvalue()
+
+
+def make_tar(files, mode):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tf:
+        for name, body in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tf.addfile(info, io.BytesIO(body))
+    return buf.getvalue()
+
+
+# всё, что перечислено в accept= формы на странице приложения
+ARCHIVES = {
+    '.zip': lambda: make_zip(FILES),
+    '.tar': lambda: make_tar(FILES, 'w'),
+    '.tar.gz': lambda: make_tar(FILES, 'w:gz'),
+    '.tgz': lambda: make_tar(FILES, 'w:gz'),
+    '.tar.bz2': lambda: make_tar(FILES, 'w:bz2'),
+    '.tar.xz': lambda: make_tar(FILES, 'w:xz'),
+}
+
+
+def test_form_lists_every_tested_format(site):
+    app, client, app_id = site
+    page = client.get(f'/manage/{app_id}').get_data(as_text=True)
+    assert f'accept="{",".join(ARCHIVES)}"' in page
+
+
+@pytest.mark.parametrize('suffix', list(ARCHIVES))
+def test_deploy_every_accepted_format(site, suffix):
+    app, client, app_id = site
+    data = ARCHIVES[suffix]()
+
+    r = client.post(f'/api/uploads/deploy/{app_id}', data=data)
+    assert r.status_code == 200, r.json
+    assert r.json['files'] == 2
+    for name, body in FILES.items():
+        assert client.get(f'/sites/{app_id}/{name}', follow_redirects=True).data == body
+
+    # и через форму, с именем файла
+    r = client.post(f'/api/uploads/deploy/{app_id}', data={'archive': (io.BytesIO(data), 'site' + suffix)},
+                    content_type='multipart/form-data')
+    assert r.status_code == 302
+    assert client.get(f'/sites/{app_id}/', follow_redirects=True).data == FILES['index.html']
+
+
+def manifest(app_id):
+    from models import SiteFile, Blob
+    rows = {row.path: row.digest for row in SiteFile.query.filter_by(app_id=app_id)}
+    refcounts = {blob.digest: blob.refcount for blob in Blob.query}
+    return rows, refcounts
+
+
+def test_failed_manifest_rebuild_keeps_the_old_manifest(site, monkeypatch):
+    from services.blobstore import blob_store
+
+    app, client, app_id = site
+    client.post(f'/api/uploads/deploy/{app_id}', data=make_tar(FILES, 'w'))
+    with app.app_context():
+        before = manifest(app_id)
+    assert sorted(before[0]) == sorted(FILES)
+
+    calls = []
+
+    def failing_incref(digest, size):
+        calls.append(digest)
+        raise RuntimeError('database went away')
+
+    # падает добавление новых строк - уже после снятия старых
+    monkeypatch.setattr(blob_store, '_incref', failing_incref)
+    with pytest.raises(RuntimeError):
+        client.post(f'/api/uploads/deploy/{app_id}', data=make_tar({'new.html': b'new'}, 'w'))
+    assert calls
+    with app.app_context():
+        assert manifest(app_id) == before
+
+
+def test_redeploy_replaces_the_manifest(site):
+    app, client, app_id = site
+    client.post(f'/api/uploads/deploy/{app_id}', data=make_tar(FILES, 'w'))
+    # index.html остаётся тем же телом, css уходит, появляется новый файл
+    files = {'index.html': FILES['index.html'], 'js/app.js': b'alert(1)'}
+    client.post(f'/api/uploads/deploy/{app_id}', data=make_tar(files, 'w'))
+    with app.app_context():
+        rows, refcounts = manifest(app_id)
+        from models import UserApp
+        assert UserApp.query.first().storage_used == sum(map(len, files.values()))
+    assert sorted(rows) == sorted(files)
+    assert sorted(refcounts) == sorted(set(rows.values()))
+    assert all(count == 1 for count in refcounts.values())
+    assert client.get(f'/sites/{app_id}/js/app.js').data == b'alert(1)'
@@ -0,0 +1,27 @@
+import os
+
+from conftest import upload
+from services.site_index import SiteIndex
+
+
+def test_change_in_another_worker_drops_the_cached_body(site):
+    app, client, app_id = site
+    upload(client, app_id, '', 'page.html', b'<p>old</p>')
+    url = f'/sites/{app_id}/page.html'
+    for _ in range(3):
+        assert client.get(url).data == b'<p>old</p>'
+    assert app.extensions['file_cache'].stats()['size'] == 1
+
+    # другой воркер меняет файл; тот же размер и mtime - ETag совпадает
+    root = os.path.join(app.config['UPLOAD_FOLDER'], app_id[:2], app_id)
+    path = os.path.join(root, 'page.html')
+    st = os.stat(path)
+    os.remove(path)
+    with open(path, 'wb') as f:
+        f.write(b'<p>new</p>')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    other = SiteIndex()
+    other.folder = app.config['UPLOAD_FOLDER']
+    other.record(app_id, 'page.html')
+
+    assert client.get(url).data == b'<p>new</p>'
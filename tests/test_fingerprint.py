@@ -0,0 +1,80 @@
+from conftest import make_app, first_app, upload
+
+
+STYLE = b'body { background: url(../img/logo.png); }\n'
+PAGE = b'<link rel="stylesheet" href="css/style.css"><img src="img/logo.png">'
+
+
+def published(app, app_id):
+    """Source path -> fingerprinted path of the current publish."""
+    from services.fingerprint import asset_publisher
+
+    with app.app_context():
+        manifest = asset_publisher.manifest(app_id, fresh=True)
+    return {entry['source']: name for name, entry in manifest['assets'].items()}
+
+
+def fingerprinted_site(tmp_path, files):
+    # без фоновых воркеров задача публикации выполняется прямо в запросе
+    app, client, app_id = make_app(tmp_path, JOB_WORKERS=0)
+    for (folder, name), body in files.items():
+        upload(client, app_id, folder, name, body)
+    client.post(f'/settings/fingerprint/{app_id}', data={'fingerprint_assets': 'on'})
+    return app, client, app_id
+
+
+def test_previous_css_address_is_404_once_its_content_changed(tmp_path):
+    app, client, app_id = fingerprinted_site(tmp_path, {
+        ('', 'index.html'): PAGE, ('css', 'style.css'): STYLE, ('img', 'logo.png'): b'first image'})
+    old = published(app, app_id)
+    response = client.get(f"/sites/{app_id}/{old['css/style.css']}")
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert old['img/logo.png'].split('/')[-1].encode() in response.get_data()
+
+    # стиль не менялся, но ссылается на новую картинку - у его копии новый хэш
+    upload(client, app_id, 'img', 'logo.png', b'second image')
+    new = published(app, app_id)
+    assert new['css/style.css'] != old['css/style.css']
+
+    for rel in ('css/style.css', 'img/logo.png'):
+        assert client.get(f'/sites/{app_id}/{old[rel]}').status_code == 404
+        response = client.get(f'/sites/{app_id}/{new[rel]}')
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+    body = client.get(f"/sites/{app_id}/{new['css/style.css']}").get_data()
+    assert new['img/logo.png'].split('/')[-1].encode() in body
+
+
+def test_previous_address_is_served_while_its_content_matches(tmp_path, monkeypatch):
+    from extensions import site_index
+    from services.fingerprint import asset_publisher
+
+    app, client, app_id = fingerprinted_site(tmp_path, {('img', 'logo.png'): b'first image'})
+    old = published(app, app_id)
+
+    # картинки больше не публикуются - прежний адрес остаётся в previous
+    monkeypatch.setattr(asset_publisher, 'asset_extensions', ('.css',))
+    with app.app_context():
+        asset_publisher.publish(app_id, first_app().path)
+    assert 'img/logo.png' not in published(app, app_id)
+    assert client.get(f"/sites/{app_id}/{old['img/logo.png']}").get_data() == b'first image'
+
+    # файл заменили в обход загрузки, новой публикации не было
+    with app.app_context():
+        path = first_app().path
+    with open(f'{path}/img/logo.png', 'wb') as f:
+        f.write(b'second image')
+    site_index.invalidate(app_id)
+    assert client.get(f"/sites/{app_id}/{old['img/logo.png']}").status_code == 404
+
+
+def test_real_file_wins_over_previous_address(tmp_path):
+    app, client, app_id = fingerprinted_site(tmp_path, {('img', 'logo.png'): b'first image'})
+    old = published(app, app_id)
+
+    # имя с хэшем занял настоящий файл - картинка больше не публикуется
+    folder, name = old['img/logo.png'].rsplit('/', 1)
+    upload(client, app_id, folder, name, b'real file')
+    assert 'img/logo.png' not in published(app, app_id)
+    assert client.get(f"/sites/{app_id}/{old['img/logo.png']}").get_data() == b'real file'
@@ -0,0 +1,121 @@
+import sqlite3
+
+from sqlalchemy import inspect, text
+
+from conftest import make_config
+
+
+# схема до первой миграции: то, что создавал db.create_all() исходной версии
+BASELINE_SCHEMA = '''
+CREATE TABLE user (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR(20) NOT NULL UNIQUE,
+    password VARCHAR(200) NOT NULL
+);
+CREATE TABLE user_app (
+    id INTEGER NOT NULL PRIMARY KEY,
+    app_id VARCHAR(8) NOT NULL UNIQUE,
+    app_name VARCHAR(80) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES user (id),
+    path VARCHAR(200) NOT NULL,
+    created_at DATETIME
+);
+INSERT INTO user (id, username, password) VALUES (1, 'alice', 'x');
+INSERT INTO user_app (id, app_id, app_name, user_id, path, created_at)
+    VALUES (1, 'abcd1234', 'legacy', 1, 'ab/abcd1234', '2024-01-01 00:00:00');
+'''
+
+
+def baseline_app(tmp_path):
+    from app import create_app
+
+    config = make_config(tmp_path)
+    conn = sqlite3.connect(config.SQLALCHEMY_DATABASE_URI[len('sqlite:///'):])
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    return create_app(config)
+
+
+def snapshot(app):
+    """Tables, columns and indexes of the app's database."""
+    from extensions import db
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        return {table: ({column['name'] for column in inspector.get_columns(table)},
+                        {index['name'] for index in inspector.get_indexes(table)})
+                for table in inspector.get_table_names()}
+
+
+def versions(app):
+    from extensions import db
+
+    with app.app_context(), db.engine.connect() as conn:
+        return [row[0] for row in conn.execute(text('SELECT version FROM schema_version ORDER BY version'))]
+
+
+def test_db_upgrade_applies_every_migration_to_baseline(tmp_path):
+    from database import MIGRATIONS
+    from extensions import db
+
+    app = baseline_app(tmp_path)
+    result = app.test_cli_runner().invoke(args=['db-upgrade'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [f'applied {step.__name__}' for _, step in MIGRATIONS]
+    assert versions(app) == list(range(1, 8))
+
+    schema = snapshot(app)
+    assert {'user', 'user_app', 'blob', 'site_file', 'job', 'schema_version'} <= set(schema)
+    columns, indexes = schema['user_app']
+    assert {'cache_policy', 'storage_used', 'fingerprint_assets', 'revision'} <= columns
+    assert 'ix_user_app_user_id' in indexes
+
+    # старая запись получила значения по умолчанию
+    with app.app_context():
+        row = db.session.execute(text('SELECT cache_policy, storage_used, fingerprint_assets, revision '
+                                      'FROM user_app WHERE app_id = :app_id'),
+                                 {'app_id': 'abcd1234'}).one()
+    assert tuple(row) == ('standard', 0, 0, 0)
+
+    # повторный запуск ничего не делает
+    result = app.test_cli_runner().invoke(args=['db-upgrade'])
+    assert result.exit_code == 0 and result.output == ''
+    assert snapshot(app) == schema
+
+
+def test_every_migration_is_idempotent(tmp_path):
+    from database import MIGRATIONS, migrate
+    from extensions import db
+
+    app = baseline_app(tmp_path)
+    migrate(app)
+    schema = snapshot(app)
+    for version, step in MIGRATIONS:
+        with app.app_context(), db.engine.begin() as conn:
+            step(conn)
+        assert snapshot(app) == schema, f'migration {version} changed an up-to-date schema'
+
+
+def test_migrate_tolerates_steps_applied_by_another_worker(tmp_path, monkeypatch):
+    import database
+    from database import migrate
+
+    app = baseline_app(tmp_path)
+    assert len(migrate(app)) == 7
+
+    # второй воркер прочитал версии до того, как первый их записал:
+    # каждый шаг выполняется повторно, а вставка версии упирается в ключ
+    real = database.applied_versions
+    calls = []
+
+    def stale(conn):
+        calls.append(conn)
+        return set() if len(calls) == 1 else real(conn)
+
+    monkeypatch.setattr(database, 'applied_versions', stale)
+    assert migrate(app) == []
+    assert len(calls) == 1 + 7  # перепроверка после каждого проигранного шага
+    assert versions(app) == list(range(1, 8))
+
+    monkeypatch.setattr(database, 'applied_versions', real)
+    assert migrate(app) == []
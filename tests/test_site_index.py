@@ -0,0 +1,103 @@
+import os
+
+from services.site_index import SiteIndex
+
+
+APP_ID = 'ab12cd34'
+
+
+def make_worker(folder):
+    # у каждого воркера gunicorn свой индекс, общая только папка
+    index = SiteIndex(ttl=300)
+    index.folder = str(folder)
+    return index
+
+
+def write(root, rel, body):
+    path = os.path.join(root, *rel.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def make_site(tmp_path):
+    root = str(tmp_path / APP_ID[:2] / APP_ID)
+    write(root, 'index.html', b'<h1>v1</h1>')
+    return root
+
+
+def test_change_in_one_worker_reaches_the_others(tmp_path):
+    root = make_site(tmp_path)
+    a, b = make_worker(tmp_path), make_worker(tmp_path)
+    assert b.lookup(APP_ID, root, 'index.html').size == 11
+    assert b.listing(APP_ID, root) == [('index.html', b.lookup(APP_ID, root, 'index.html'))]
+
+    # воркер A загружает файл и меняет index.html
+    write(root, 'new.css', b'body{}')
+    a.record(APP_ID, 'new.css')
+    write(root, 'index.html', b'<h1>version 2</h1>')
+    a.record(APP_ID, 'index.html')
+    assert [name for name, _ in b.listing(APP_ID, root)] == ['index.html', 'new.css']
+    assert b.lookup(APP_ID, root, 'index.html').size == 18
+
+    # и удаляет его
+    os.remove(os.path.join(root, 'new.css'))
+    a.remove(APP_ID, 'new.css')
+    assert b.lookup(APP_ID, root, 'new.css') is None
+
+
+def test_own_changes_do_not_force_a_rescan(tmp_path):
+    root = make_site(tmp_path)
+    a = make_worker(tmp_path)
+    a.lookup(APP_ID, root, 'index.html')
+    for i in range(3):
+        write(root, f'f{i}.txt', b'x')
+        a.record(APP_ID, f'f{i}.txt')
+        assert a.lookup(APP_ID, root, f'f{i}.txt') is not None
+    assert a.misses == 1
+
+    # сдвиг штампа другим воркером - обход заново
+    make_worker(tmp_path).invalidate(APP_ID)
+    a.lookup(APP_ID, root, 'index.html')
+    assert a.misses == 2
+
+
+def test_forget_makes_other_workers_rescan(tmp_path):
+    root = make_site(tmp_path)
+    a, b = make_worker(tmp_path), make_worker(tmp_path)
+    a.record(APP_ID, 'index.html')
+    assert b.lookup(APP_ID, root, 'index.html') is not None
+    os.remove(os.path.join(root, 'index.html'))
+    a.forget(APP_ID)
+    assert not os.path.exists(a._stamp_path(APP_ID))
+    assert b.lookup(APP_ID, root, 'index.html') is None
+
+
+def test_lookup_miss_checks_the_disk(tmp_path):
+    root = make_site(tmp_path)
+    index = make_worker(tmp_path)
+    assert index.lookup(APP_ID, root, 'late.txt') is None
+    # файл положили в обход приложения: находится без нового обхода
+    write(root, 'late.txt', b'abc')
+    assert index.lookup(APP_ID, root, 'late.txt').size == 3
+    assert [name for name, _ in index.listing(APP_ID, root)] == ['index.html', 'late.txt']
+    assert index.misses == 1
+    # скрытые файлы не отдаются и так
+    write(root, '.secret', b'x')
+    write(root, '.git/config', b'x')
+    assert index.lookup(APP_ID, root, '.secret') is None
+    assert index.lookup(APP_ID, root, '.git/config') is None
+
+
+def test_stamp_rotation_still_invalidates(tmp_path, monkeypatch):
+    monkeypatch.setattr('services.site_index.STAMP_ROTATE_SIZE', 3)
+    root = make_site(tmp_path)
+    a, b = make_worker(tmp_path), make_worker(tmp_path)
+    b.lookup(APP_ID, root, 'index.html')
+    for i in range(5):
+        write(root, f'f{i}.txt', b'x')
+        a.record(APP_ID, f'f{i}.txt')
+        assert b.lookup(APP_ID, root, f'f{i}.txt') is not None
+        os.remove(os.path.join(root, f'f{i}.txt'))
+        a.remove(APP_ID, f'f{i}.txt')
+        assert [name for name, _ in b.listing(APP_ID, root)] == ['index.html']
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import shutil
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from conftest import make_app, first_app, upload
+
+
+BUCKET = 'sites-test'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    # поддельные ключи: moto не ходит в сеть, но boto3 без них не подпишет запрос
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        yield
+
+
+# -------------------------
+# S3Backend
+# -------------------------
+def test_s3_backend_put_fetch_delete(s3, tmp_path):
+    from services.storage import S3Backend, StorageError
+
+    backend = S3Backend(BUCKET, 'sites', region='us-east-1')
+    body = b'<h1>hello</h1>'
+    digest = hashlib.sha256(body).hexdigest()
+    src = tmp_path / 'src'
+    src.write_bytes(body)
+
+    assert not backend.exists(digest)
+    backend.put(digest, str(src))
+    backend.put(digest, str(src))  # уже есть - не перезаливается
+    assert backend.exists(digest)
+    assert backend.key(digest) == f'sites/{digest[:2]}/{digest[2:4]}/{digest}'
+    assert [d for d, _ in backend.digests()] == [digest]
+
+    dst = tmp_path / 'dst'
+    backend.fetch(digest, str(dst))
+    assert dst.read_bytes() == body
+
+    backend.delete(digest)
+    assert not backend.exists(digest)
+    with pytest.raises(StorageError):
+        backend.fetch(digest, str(tmp_path / 'missing'))
+
+
+# -------------------------
+# SiteSync
+# -------------------------
+def test_site_sync_fetches_missing_files_from_s3(s3, tmp_path):
+    from extensions import site_storage
+    from services.site_sync import site_sync
+
+    app, client, app_id = make_app(tmp_path, STORAGE_BACKEND='s3', S3_BUCKET=BUCKET, S3_REGION='us-east-1')
+    assert site_storage.shared
+
+    upload(client, app_id, 'css/', 'a.css', b'body{}')
+    upload(client, app_id, '', 'index.html', b'<h1>v1</h1>')
+
+    with app.app_context():
+        app_obj = first_app()
+        root = app_obj.path
+        assert len(list(site_storage.backend.digests())) == 2
+
+        # другой узел: ни папки сайта, ни состояния синхронизации, ни локального кэша
+        shutil.rmtree(root)
+        shutil.rmtree(app.config['BLOB_FOLDER'])
+        site_sync.forget(app_id)
+
+        site_sync.ensure(app_obj)
+        with open(os.path.join(root, 'index.html'), 'rb') as f:
+            assert f.read() == b'<h1>v1</h1>'
+        with open(os.path.join(root, 'css', 'a.css'), 'rb') as f:
+            assert f.read() == b'body{}'
+        assert site_sync.misses >= 2
+        assert site_sync._revision(app_id) == app_obj.revision
+
+    assert client.get(f'/sites/{app_id}/').data == b'<h1>v1</h1>'
+
+
+# -------------------------
+# storage-migrate
+# -------------------------
+def test_storage_migrate_moves_legacy_absolute_path(s3, tmp_path):
+    from extensions import db, site_cache, site_index, site_storage
+
+    app, client, app_id = make_app(tmp_path, STORAGE_BACKEND='s3', S3_BUCKET=BUCKET, S3_REGION='us-east-1')
+    upload(client, app_id, '', 'index.html', b'<h1>legacy</h1>')
+
+    with app.app_context():
+        app_obj = first_app()
+        # сайт из времён до шардов: абсолютный путь в базе, тела нет в бакете
+        legacy = os.path.join(app.config['UPLOAD_FOLDER'], app_id)
+        shutil.move(app_obj.path, legacy)
+        app_obj.storage_key = legacy
+        db.session.commit()
+        for digest, _ in list(site_storage.backend.digests()):
+            site_storage.backend.delete(digest)
+        site_cache.clear()
+        site_index.clear()
+
+    assert client.get(f'/sites/{app_id}/').data == b'<h1>legacy</h1>'
+
+    result = app.test_cli_runner().invoke(args=['storage-migrate'])
+    assert result.exception is None
+    assert result.output.strip() == f'{app_id}: moved, 1 files uploaded'
+
+    with app.app_context():
+        app_obj = first_app()
+        assert app_obj.storage_key == site_storage.site_key(app_id)
+        assert not os.path.exists(legacy)
+        assert len(list(site_storage.backend.digests())) == 1
+    assert client.get(f'/sites/{app_id}/').data == b'<h1>legacy</h1>'
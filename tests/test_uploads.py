@@ -0,0 +1,135 @@
+import hashlib
+import os
+
+import pytest
+
+
+DATA = os.urandom(300000)
+CHUNK = 100000
+
+
+def start(client, app_id, size=len(DATA), **extra):
+    r = client.post('/api/uploads', json={'app_id': app_id, 'filename': 'big.bin', 'size': size, **extra})
+    assert r.status_code == 201, r.json
+    return r.json['upload_id']
+
+
+def put(client, upload_id, offset, data, **headers):
+    return client.put(f'/api/uploads/{upload_id}?offset={offset}', data=data, headers=headers)
+
+
+def part_size(app, upload_id):
+    return os.path.getsize(os.path.join(app.config['UPLOAD_TMP_FOLDER'], f'{upload_id}.part'))
+
+
+def test_resumable_upload(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id, sha256=hashlib.sha256(DATA).hexdigest())
+    for offset in range(0, len(DATA), CHUNK):
+        r = put(client, upload_id, offset, DATA[offset:offset + CHUNK])
+        assert r.status_code == 200 and r.json['offset'] == offset + CHUNK
+    assert client.get(f'/api/uploads/{upload_id}').json['offset'] == len(DATA)
+    r = client.post(f'/api/uploads/{upload_id}/complete')
+    assert r.status_code == 200 and r.json == {'path': 'big.bin', 'size': len(DATA)}
+    assert client.get(f'/sites/{app_id}/big.bin').data == DATA
+    assert os.listdir(app.config['UPLOAD_TMP_FOLDER']) == []
+
+
+def test_out_of_order_and_duplicate_chunks(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id)
+    # кусок не с того места
+    r = put(client, upload_id, CHUNK, DATA[CHUNK:2 * CHUNK])
+    assert r.status_code == 409 and r.json['offset'] == 0
+    assert put(client, upload_id, 0, DATA[:CHUNK]).status_code == 200
+    # повтор уже принятого куска
+    r = put(client, upload_id, 0, DATA[:CHUNK])
+    assert r.status_code == 409 and r.json['offset'] == CHUNK
+    assert part_size(app, upload_id) == CHUNK
+
+
+def test_chunk_checksum_mismatch(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id)
+    put(client, upload_id, 0, DATA[:CHUNK])
+    r = put(client, upload_id, CHUNK, DATA[CHUNK:2 * CHUNK], **{'X-Chunk-SHA256': '0' * 64})
+    assert r.status_code == 422 and r.json['offset'] == CHUNK
+    # кусок отброшен, его можно прислать ещё раз
+    assert part_size(app, upload_id) == CHUNK
+    checksum = hashlib.sha256(DATA[CHUNK:2 * CHUNK]).hexdigest()
+    assert put(client, upload_id, CHUNK, DATA[CHUNK:2 * CHUNK], **{'X-Chunk-SHA256': checksum}).status_code == 200
+
+
+def test_quota_exceeded_mid_stream(site):
+    app, client, app_id = site
+    app.config['SITE_QUOTA_BYTES'] = 400000
+    upload_id = start(client, app_id)
+    put(client, upload_id, 0, DATA[:CHUNK])
+    # пока загрузка шла, место заняли
+    app.config['SITE_QUOTA_BYTES'] = 150000
+    r = put(client, upload_id, CHUNK, DATA[CHUNK:])
+    assert r.status_code == 413 and r.json['offset'] == CHUNK
+    assert part_size(app, upload_id) == CHUNK
+
+
+def test_chunk_past_declared_size(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id, size=10)
+    r = put(client, upload_id, 0, b'x' * 11)
+    assert r.status_code == 400
+    assert part_size(app, upload_id) == 0
+
+
+def test_complete_with_missing_parts_keeps_the_part_file(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id)
+    put(client, upload_id, 0, DATA[:CHUNK])
+    r = client.post(f'/api/uploads/{upload_id}/complete')
+    assert r.status_code == 409 and r.json['offset'] == CHUNK
+    assert part_size(app, upload_id) == CHUNK
+    # докачиваем и завершаем
+    put(client, upload_id, CHUNK, DATA[CHUNK:])
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 200
+
+
+def test_complete_onto_a_folder_keeps_the_part_file(site):
+    app, client, app_id = site
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], app_id[:2], app_id, 'big.bin'))
+    upload_id = start(client, app_id)
+    put(client, upload_id, 0, DATA)
+    r = client.post(f'/api/uploads/{upload_id}/complete')
+    assert r.status_code == 409
+    assert part_size(app, upload_id) == len(DATA)
+
+
+def test_whole_file_checksum_mismatch(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id, sha256='0' * 64)
+    put(client, upload_id, 0, DATA)
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 422
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+
+def test_cancel(site):
+    app, client, app_id = site
+    upload_id = start(client, app_id)
+    put(client, upload_id, 0, DATA[:CHUNK])
+    assert client.delete(f'/api/uploads/{upload_id}').status_code == 204
+    assert os.listdir(app.config['UPLOAD_TMP_FOLDER']) == []
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert put(client, upload_id, CHUNK, DATA[CHUNK:]).status_code == 404
+
+
+@pytest.mark.parametrize('path, status', [
+    ('a/b/c/d/e', 201),
+    ('a/b/c/d/e/f', 400),      # глубже 5 уровней, как create_folder
+    ('.git', 400),             # скрытая папка: индекс её не видит, а место считается
+    ('assets/.cache', 400),
+    ('a/../b', 400),
+    ('bad:name', 400),
+    ('/docs//img/', 201),
+])
+def test_target_folder_rules(site, path, status):
+    app, client, app_id = site
+    r = client.post('/api/uploads', json={'app_id': app_id, 'path': path, 'filename': 'x.txt', 'size': 1})
+    assert r.status_code == status, r.json
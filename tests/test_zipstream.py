@@ -0,0 +1,83 @@
+import io
+import os
+import zipfile
+
+from conftest import upload
+from services.zipstream import stream_zip
+
+
+# сжимается - уходит в deflate; .png - уже сжатый формат, кладётся как есть
+PAGE = b'<p>hello</p>\n' * 2000
+IMAGE = os.urandom(50 * 1024)
+
+
+def download(client, app_id):
+    response = client.get(f'/download/{app_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    return zipfile.ZipFile(io.BytesIO(response.get_data()))
+
+
+def upload_site(client, app_id):
+    assert upload(client, app_id, '', 'index.html', PAGE).status_code in (200, 302)
+    assert upload(client, app_id, 'img', 'logo.png', IMAGE).status_code in (200, 302)
+
+
+def test_download_app_streams_a_readable_archive(site):
+    app, client, app_id = site
+    upload_site(client, app_id)
+
+    with download(client, app_id) as zf:
+        assert zf.testzip() is None
+        infos = {info.filename: info for info in zf.infolist()}
+        assert set(infos) == {'index.html', 'img/logo.png'}
+        assert zf.read('index.html') == PAGE
+        assert zf.read('img/logo.png') == IMAGE
+
+        assert infos['index.html'].compress_type == zipfile.ZIP_DEFLATED
+        assert infos['index.html'].compress_size < len(PAGE)
+        assert infos['img/logo.png'].compress_type == zipfile.ZIP_STORED
+        for info in infos.values():
+            # поток не перематывается - размеры идут в дескрипторе после данных
+            assert info.flag_bits & 0x08
+
+
+def test_download_app_zip64_entries_are_readable(site, monkeypatch):
+    app, client, app_id = site
+    upload_site(client, app_id)
+
+    # файл в 4 ГБ тесту не по карману - опускаем порог ZIP64 ниже размера файлов
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1024)
+    response = client.get(f'/download/{app_id}')
+    assert response.status_code == 200
+    data = response.get_data()
+    monkeypatch.undo()
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.read('index.html') == PAGE
+        assert zf.read('img/logo.png') == IMAGE
+        for info in zf.infolist():
+            # в локальном заголовке - расширение ZIP64 (id 0x0001) с размерами
+            header = data[info.header_offset:]
+            name_len = int.from_bytes(header[26:28], 'little')
+            extra_len = int.from_bytes(header[28:30], 'little')
+            assert header[30 + name_len:30 + name_len + extra_len][:2] == b'\x01\x00'
+            assert info.flag_bits & 0x08
+
+
+def test_stream_zip_yields_bounded_chunks(tmp_path):
+    path = tmp_path / 'big.bin'
+    path.write_bytes(os.urandom(256 * 1024))
+    chunk_size = 16 * 1024
+
+    chunks = list(stream_zip([(str(path), 'big.bin'), (str(tmp_path / 'gone.txt'), 'gone.txt')],
+                             chunk_size=chunk_size))
+    assert len(chunks) > 1
+    # кусок - не больше буфера плюс один блок сжатых данных
+    assert max(len(chunk) for chunk in chunks) <= 2 * chunk_size + 1024
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+        # пропавший файл пропускается, архив остаётся целым
+        assert zf.namelist() == ['big.bin']
+        assert zf.read('big.bin') == path.read_bytes()
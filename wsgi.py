@@ -0,0 +1,5 @@
+from app import create_app, init_db
+
+# точка входа для продакшен-сервера: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
+init_db(app)